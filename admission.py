@@ -0,0 +1,132 @@
+"""
+Admission control and backpressure.
+
+Two layers keep a burst of submissions from turning into an OOM restart:
+
+- at the door: POST /analyze and /analyze/batch are refused with 429 and a
+  Retry-After (time for the backlog to drain at the current pace) once the
+  queue holds ADMISSION_MAX_QUEUED jobs, or ADMISSION_MAX_QUEUED_INTERACTIVE
+  interactive ones. Below that, work is queued (scheduler.py).
+- at dispatch: how many jobs a worker runs at once adapts to measured memory
+  headroom, AIMD style. Above ADMISSION_MEMORY_HIGH of the memory limit the
+  limit is cut by a quarter; below ADMISSION_MEMORY_LOW, when every slot is
+  busy, it grows by one, up to JOB_CONCURRENCY. Chromium instances are capped
+  separately per worker (SCRAPE_MAX_BROWSERS, scraper.py).
+
+Memory is the container's working set (cgroup v2 or v1, page cache excluded)
+against its limit; without a cgroup limit, the resident memory of this worker
+and its children (Chromium) from /proc against ADMISSION_MEMORY_LIMIT_MB.
+Outside Linux there is no reading and only the static limits apply.
+"""
+
+import math
+import os
+import time
+from typing import Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from metrics import ADMISSION_LIMIT, ADMISSION_REJECTED, MEMORY_PRESSURE
+from models import AnalysisJob
+from resources import container_memory, process_tree_rss
+
+ADMISSION_MAX_QUEUED = int(os.getenv("ADMISSION_MAX_QUEUED", 10000))
+ADMISSION_MAX_QUEUED_INTERACTIVE = int(os.getenv("ADMISSION_MAX_QUEUED_INTERACTIVE", 200))
+ADMISSION_MAX_RETRY_AFTER_SECONDS = int(os.getenv("ADMISSION_MAX_RETRY_AFTER_SECONDS", 600))
+# Memory ceiling; default the container's cgroup limit
+ADMISSION_MEMORY_LIMIT_MB = float(os.getenv("ADMISSION_MEMORY_LIMIT_MB", 0))
+ADMISSION_MEMORY_HIGH = float(os.getenv("ADMISSION_MEMORY_HIGH", 0.85))
+ADMISSION_MEMORY_LOW = float(os.getenv("ADMISSION_MEMORY_LOW", 0.70))
+ADMISSION_ADJUST_SECONDS = float(os.getenv("ADMISSION_ADJUST_SECONDS", 5))
+
+
+class AdmissionRejected(Exception):
+    """The queue is full: come back after `retry_after` seconds"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+# --- memory ---
+
+def memory_pressure() -> Optional[float]:
+    """Fraction of the memory limit in use, None when there is nothing to measure against"""
+    used, limit = container_memory()
+    if ADMISSION_MEMORY_LIMIT_MB > 0:
+        if limit is None:
+            used = process_tree_rss()  # no container limit: measure this worker's own footprint
+        limit = int(ADMISSION_MEMORY_LIMIT_MB * 1024 * 1024)
+    if not limit or used is None:
+        return None
+    return used / limit
+
+
+# --- dispatch: adaptive concurrency ---
+
+class AdaptiveConcurrency:
+    """Per-worker concurrency limit following memory headroom (additive increase, multiplicative decrease)"""
+
+    def __init__(self, maximum: int):
+        self.maximum = maximum
+        self.limit = maximum
+        self.pressure: Optional[float] = None
+        self._adjusted = 0.0
+        ADMISSION_LIMIT.set(self.limit)
+
+    def update(self, running: int) -> int:
+        now = time.monotonic()
+        if now - self._adjusted < ADMISSION_ADJUST_SECONDS:
+            return self.limit
+        self._adjusted = now
+        self.pressure = memory_pressure()
+        if self.pressure is not None:
+            MEMORY_PRESSURE.set(self.pressure)
+
+        if self.pressure is not None and self.pressure >= ADMISSION_MEMORY_HIGH:
+            # Cut again only once the previous cut took effect (jobs over the limit have finished)
+            if running <= self.limit:
+                limit = max(1, math.floor(self.limit * 0.75))
+                if limit < self.limit:
+                    print(f"🧯 Memory at {self.pressure:.0%}: job concurrency {self.limit} → {limit}")
+                self.limit = limit
+        elif running >= self.limit and (self.pressure is None or self.pressure < ADMISSION_MEMORY_LOW):
+            self.limit = min(self.maximum, self.limit + 1)
+        ADMISSION_LIMIT.set(self.limit)
+        return self.limit
+
+
+# --- the door: queue caps ---
+
+async def _retry_after(db: AsyncSession, excess_jobs: int) -> int:
+    """Seconds for `excess_jobs` queued jobs to be worked off at the current pace"""
+    running = await db.scalar(select(func.count()).where(AnalysisJob.status == "processing")) or 0
+    average = await db.scalar(
+        select(func.avg(AnalysisJob.expected_seconds)).where(AnalysisJob.status == "pending")
+    ) or 60.0
+    seconds = excess_jobs * average / max(running, 1)
+    return int(min(max(math.ceil(seconds), 1), ADMISSION_MAX_RETRY_AFTER_SECONDS))
+
+
+async def check_admission(db: AsyncSession, count: int, interactive_priority: Optional[int] = None) -> None:
+    """Raise AdmissionRejected when queueing `count` more jobs would overflow the queue
+
+    interactive_priority: for interactive submissions, the priority from which
+    queued jobs count against ADMISSION_MAX_QUEUED_INTERACTIVE.
+    """
+    queued = await db.scalar(select(func.count()).where(AnalysisJob.status == "pending")) or 0
+    if queued + count > ADMISSION_MAX_QUEUED:
+        ADMISSION_REJECTED.labels(reason="queue_full").inc()
+        raise AdmissionRejected(f"{queued} jobs queued (max {ADMISSION_MAX_QUEUED})",
+                                await _retry_after(db, queued + count - ADMISSION_MAX_QUEUED))
+    if interactive_priority is not None:
+        queued_interactive = await db.scalar(select(func.count()).where(
+            AnalysisJob.status == "pending", AnalysisJob.priority >= interactive_priority,
+        )) or 0
+        if queued_interactive + count > ADMISSION_MAX_QUEUED_INTERACTIVE:
+            ADMISSION_REJECTED.labels(reason="interactive_queue_full").inc()
+            raise AdmissionRejected(
+                f"{queued_interactive} interactive jobs queued (max {ADMISSION_MAX_QUEUED_INTERACTIVE})",
+                await _retry_after(db, queued_interactive + count - ADMISSION_MAX_QUEUED_INTERACTIVE),
+            )
@@ -1,20 +1,51 @@
-from openai import AsyncOpenAI
+from openai import AsyncOpenAI, RateLimitError
+import asyncio
 import json
 import os
-from typing import Dict, Any
+import re
+import threading
+import time
+from typing import Dict, Any, List, Optional
 from dotenv import load_dotenv
 from firecrawl_fallback import FirecrawlFallback
+from rule_extractor import best_candidates, extract_candidates, format_hints, is_confident
+from checkpoints import checkpoint, save_checkpoint
+from deadline import BudgetExhausted
+from executors import run_io
+from llm_limiter import LLMQueueTimeout, chat_completion
+from metrics import stage
+from tracing import span
 import logging
 
 load_dotenv()
 logger = logging.getLogger(__name__)
 
+# Start Firecrawl for historically weak fields concurrently with the main GPT-4 call
+FIRECRAWL_SPECULATIVE = os.getenv("FIRECRAWL_SPECULATIVE", "true").strip().lower() in ("1", "true", "yes", "on")
+
+URL_FIELDS = {
+    'shipping_policy': 'shipping_url',
+    'return_policy': 'return_url',
+    'self_help_returns': 'self_help_url',
+    'insurance': 'insurance_url',
+}
+
+_BUILD = object()  # sentinel: build the Firecrawl fallback from the environment
+
 class PolicyAnalyzer:
-    def __init__(self):
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            raise ValueError("OPENAI_API_KEY environment variable is required")
-        self.client = AsyncOpenAI(api_key=api_key)
+    def __init__(self, client: Optional[AsyncOpenAI] = None, firecrawl_fallback: Any = _BUILD):
+        """Pass app-scoped clients (clients.py) to share connection pools across jobs;
+        firecrawl_fallback=None disables the fallback."""
+        if client is None:
+            api_key = os.getenv("OPENAI_API_KEY")
+            if not api_key:
+                raise ValueError("OPENAI_API_KEY environment variable is required")
+            client = AsyncOpenAI(api_key=api_key)
+        self.client = client
+        
+        if firecrawl_fallback is not _BUILD:
+            self.firecrawl_fallback = firecrawl_fallback
+            return
         
         # Initialize Firecrawl fallback
         try:
@@ -24,11 +55,25 @@ class PolicyAnalyzer:
             logger.warning(f"⚠️ Firecrawl fallback initialization failed: {e}")
             self.firecrawl_fallback = None
 
-    async def analyze_policies(self, scraped_data: Dict) -> Dict[str, str]:
-        """Analyze scraped content and extract structured policy information"""
+    async def analyze_policies(self, scraped_data: Dict, speculative_fields: Optional[List[str]] = None) -> Dict[str, str]:
+        """Analyze scraped content and extract structured policy information
+
+        speculative_fields: historically weak fields whose Firecrawl search starts
+        alongside the GPT-4 call (see stats.read_weak_fields).
+        """
+        
+        # Deterministic pre-extraction: when every field is confidently matched, no LLM call at all
+        with span("rules") as rules_span:
+            rule_hits = best_candidates(extract_candidates(scraped_data))
+            rules_span.set(confident=is_confident(rule_hits))
+        if is_confident(rule_hits):
+            logger.info(f"📏 ANALYZER: All fields matched by rules → skipping GPT-4 for {scraped_data.get('domain')}")
+            return self._create_rules_result(rule_hits, scraped_data)
         
-        # If non-Shopify, skip AI pre-analysis and use Firecrawl directly
-        if scraped_data.get('is_shopify') is False and self.firecrawl_fallback and scraped_data.get('domain'):
+        # If non-Shopify, or the site blocked direct scraping before any policy page (circuit open),
+        # skip AI pre-analysis and use Firecrawl directly
+        blocked = scraped_data.get('stop_reason') == 'circuit_open' and not set(scraped_data.get('policy_pages', {})) - {'main'}
+        if (scraped_data.get('is_shopify') is False or blocked) and self.firecrawl_fallback and scraped_data.get('domain'):
             base_result = {
                 'domain': scraped_data.get('domain', 'Unknown'),
                 'shipping_policy': 'Information not available',
@@ -41,8 +86,11 @@ class PolicyAnalyzer:
                 'insurance_url': scraped_data.get('main_url', '')
             }
             try:
-                logger.info(f"🔥 ANALYZER: Non-Shopify detected → Direct Firecrawl for {scraped_data['domain']}")
-                enhanced = self.firecrawl_fallback.enhance_analysis(base_result, scraped_data['domain'])
+                logger.info(f"🔥 ANALYZER: {'Circuit open' if blocked else 'Non-Shopify detected'} → Direct Firecrawl for {scraped_data['domain']}")
+                with stage("firecrawl"):
+                    # Worker thread: keeps the event loop (and POST /job/{id}/cancel) responsive
+                    enhanced = await run_io(self.firecrawl_fallback.enhance_analysis,
+                                                       base_result, scraped_data['domain'])
                 return enhanced
             except Exception as e:
                 logger.error(f"❌ ANALYZER: Direct Firecrawl failed: {e}")
@@ -50,6 +98,9 @@ class PolicyAnalyzer:
 
         # Prepare content for analysis
         content_text = self._prepare_content(scraped_data)
+        hints = format_hints(rule_hits)
+        if hints:
+            content_text += f"\n\n--- RULE-BASED HINTS (verify against the content above, correct or complete them) ---\n{hints}"
         
         # Define the function schema for structured extraction
         function_schema = {
@@ -99,8 +150,19 @@ class PolicyAnalyzer:
             }
         }
 
+        # Resumed job whose GPT-4 call already went through: only the Firecrawl fallback is left
+        resumed = checkpoint("llm")
+        if resumed is not None:
+            logger.info(f"♻️ ANALYZER: GPT-4 result restored from checkpoint for {scraped_data.get('domain')}")
+            result = await self._settle_speculation({}, dict(resumed))
+            return await self._validate_and_format_result(result, scraped_data)
+
+        speculation = self._start_speculation(scraped_data.get('domain'), speculative_fields or [])
         try:
-            response = await self.client.chat.completions.create(
+            # Queued behind the shared RPM/TPM budget; 429s wait for retry-after instead of failing
+            response = await chat_completion(
+                self.client,
+                call_site="analysis",
                 model="gpt-4",
                 messages=[
                     {
@@ -183,15 +245,27 @@ Examples:
                 # Ensure domain is set
                 if not result.get('domain'):
                     result['domain'] = scraped_data.get('domain', 'Unknown')
+                await save_checkpoint("llm", result)
+                
+                # Merge (or cancel) speculative Firecrawl searches, then the regular fallback
+                result = await self._settle_speculation(speculation, result)
                 
                 # Ensure URLs are properly formatted
-                result = self._validate_and_format_result(result, scraped_data)
+                result = await self._validate_and_format_result(result, scraped_data, skip_fields=list(speculation))
                 
                 return result
             else:
                 raise Exception("No valid function call response received")
 
+        except asyncio.CancelledError:
+            # Job cancelled or past its deadline: stop the speculative searches too
+            self._cancel_speculation(speculation)
+            raise
         except Exception as e:
+            self._cancel_speculation(speculation)
+            if isinstance(e, (RateLimitError, LLMQueueTimeout, BudgetExhausted)):
+                # Still rate limited after queueing/retries, or out of time: fail the job rather than store a placeholder result
+                raise
             print(f"Error in AI analysis: {e}")
             # Return fallback structure
             return self._create_fallback_result(scraped_data)
@@ -207,7 +281,84 @@ Examples:
         
         return '\n'.join(content_parts)
 
-    def _validate_and_format_result(self, result: Dict, scraped_data: Dict) -> Dict[str, str]:
+    def _start_speculation(self, domain: Optional[str], fields: List[str]) -> Dict[str, Dict]:
+        """One Firecrawl search per weak field, each in a worker thread with its own cancel flag"""
+        if not (FIRECRAWL_SPECULATIVE and fields and domain and self.firecrawl_fallback):
+            return {}
+        
+        logger.info(f"🏎️ ANALYZER: Speculative Firecrawl for {', '.join(fields)} on {domain}")
+        speculation = {}
+        for field in fields:
+            cancel = threading.Event()
+            task = asyncio.create_task(run_io(self._speculate, domain, field, cancel))
+            spec = {'task': task, 'cancel': cancel, 'started': time.monotonic(), 'finished': None}
+            task.add_done_callback(lambda _, spec=spec: spec.__setitem__('finished', time.monotonic()))
+            speculation[field] = spec
+        return speculation
+
+    def _speculate(self, domain: str, field: str, cancel: threading.Event) -> Dict:
+        # Runs in the worker thread: the span ties the thread to the job (trace, per-job profiling)
+        with span("firecrawl.speculation", field=field):
+            return self.firecrawl_fallback.search_missing_information(domain, {field: True}, cancel)
+
+    def _cancel_speculation(self, speculation: Dict[str, Dict]) -> None:
+        """Stop speculative searches; a worker thread cannot be interrupted mid-call.
+
+        The thread checks its cancel flag before every billable call (Firecrawl
+        search, scrape, OpenAI extraction and its retries), so a cancelled search
+        costs at most the one call in flight. Speculation as a whole is bounded
+        by FIRECRAWL_SPECULATIVE_MAX_FIELDS searches per job.
+        """
+        for spec in speculation.values():
+            spec['cancel'].set()
+            spec['task'].cancel()
+
+    async def _settle_speculation(self, speculation: Dict[str, Dict], result: Dict) -> Dict:
+        """Cancel searches for fields the main analysis filled, merge the others.
+
+        Records result['field_missing'] (weakness history) and result['speculation']
+        with the time saved (search overlapped the GPT-4 call) or wasted (cancelled).
+        """
+        if not self.firecrawl_fallback:
+            return result
+        missing = self.firecrawl_fallback.is_information_missing(result)
+        result['field_missing'] = {field: missing.get(field, False) for field in URL_FIELDS}
+        
+        report = {}
+        main_done = time.monotonic()
+        for field, spec in speculation.items():
+            if not missing.get(field):
+                self._cancel_speculation({field: spec})
+                wasted = (spec['finished'] or main_done) - spec['started']
+                report[field] = {'outcome': 'cancelled', 'seconds_saved': 0.0, 'seconds_wasted': round(wasted, 2)}
+                logger.info(f"🛑 ANALYZER: {field} filled by GPT-4, speculative search cancelled ({wasted:.1f}s wasted)")
+                continue
+            
+            try:
+                payload = (await spec['task']).get(field)
+            except Exception as e:
+                logger.error(f"❌ ANALYZER: Speculative search for {field} failed: {e}")
+                payload = None
+            # Without speculation the search would only have started once GPT-4 returned:
+            # the part that overlapped the main call is time taken off the critical path
+            saved = min(spec['finished'] or main_done, main_done) - spec['started']
+            
+            text = payload.get('text') if isinstance(payload, dict) else None
+            if text and text != "Information not available":
+                result[field] = text
+                if payload.get('url'):
+                    result[URL_FIELDS[field]] = payload['url']
+                outcome = 'used'
+            else:
+                outcome = 'empty'
+            report[field] = {'outcome': outcome, 'seconds_saved': round(saved, 2), 'seconds_wasted': 0.0}
+            logger.info(f"🎯 ANALYZER: Speculative {field} {outcome} ({saved:.1f}s saved)")
+        
+        if report:
+            result['speculation'] = report
+        return result
+
+    async def _validate_and_format_result(self, result: Dict, scraped_data: Dict, skip_fields: List[str] = ()) -> Dict[str, str]:
         """Validate and format the analysis result"""
         base_url = scraped_data.get('main_url', '')
         policy_pages = scraped_data.get('policy_pages', {})
@@ -230,7 +381,9 @@ Examples:
             try:
                 logger.info(f"🔥 ANALYZER: Attempting Firecrawl fallback for {scraped_data['domain']}")
                 original_result = result.copy()
-                result = self.firecrawl_fallback.enhance_analysis(result, scraped_data['domain'])
+                with stage("firecrawl"):
+                    result = await run_io(self.firecrawl_fallback.enhance_analysis,
+                                                     result, scraped_data['domain'], skip_fields=skip_fields)
                 
                 # Vérifier si des améliorations ont été apportées
                 enhanced_fields = []
@@ -248,6 +401,15 @@ Examples:
         
         return result
 
+    def _create_rules_result(self, rule_hits: Dict[str, Optional[Dict]], scraped_data: Dict) -> Dict[str, str]:
+        """Result built only from rule-based candidates (the LLM was skipped)"""
+        base_url = scraped_data.get('main_url', '')
+        result = {'domain': scraped_data.get('domain', 'Unknown'), 'extraction_method': 'rules'}
+        for field, url_field in URL_FIELDS.items():
+            result[field] = rule_hits[field]['value']
+            result[url_field] = rule_hits[field]['url'] or base_url
+        return result
+
     def _create_fallback_result(self, scraped_data: Dict) -> Dict[str, str]:
         """Create a fallback result when AI analysis fails"""
         base_url = scraped_data.get('main_url', '')
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+Offline micro-benchmarks for the scraper / analyzer hot paths.
+
+Runs against the HTML corpus in benchmarks/corpus (manifest.json) and the
+checked-in Firecrawl search result (firecrawl_search_walmart.json); no network.
+For each benchmark: time per call (best of several repeats), throughput
+(calls/s, and MB/s for parsing), peak memory and net allocated blocks per call
+(tracemalloc, measured in a separate pass so it does not skew the timings).
+Corpus expectations (page type, 404 detection, rule-extracted field values) are
+checked as well, so a change that speeds things up by breaking them does not
+slip through.
+
+    python benchmarks/bench.py                          # run, print table
+    python benchmarks/bench.py --compare                # fail (exit 1) on regressions vs baseline.json
+    python benchmarks/bench.py --save-baseline          # record baseline.json (same machine as --compare!)
+    python benchmarks/bench.py --filter extract_page_text
+    python benchmarks/bench.py --capture <url> <name>   # add a real page to the corpus
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from analyzer import PolicyAnalyzer  # noqa: E402
+from firecrawl_fallback import FIELD_KEYWORDS, score_search_item  # noqa: E402
+from rule_extractor import best_candidates, extract_candidates  # noqa: E402
+from scraper import EcommerceScraper, extract_page_text, new_http_session  # noqa: E402
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+CORPUS_DIR = os.path.join(BENCH_DIR, "corpus")
+BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+SEARCH_RESULTS_PATH = os.path.join(ROOT, "firecrawl_search_walmart.json")
+
+TARGET_SECONDS = 0.2  # per repeat, after calibration
+REPEATS = 5
+
+
+class Benchmark:
+    def __init__(self, name: str, func: Callable[[], object], input_bytes: int = 0):
+        self.name = name
+        self.func = func
+        self.input_bytes = input_bytes
+
+
+def _load_corpus() -> List[Dict]:
+    with open(os.path.join(CORPUS_DIR, "manifest.json")) as f:
+        pages = json.load(f)["pages"]
+    for page in pages:
+        with open(os.path.join(CORPUS_DIR, page["file"]), encoding="utf-8") as f:
+            page["html"] = f.read()
+        page["text"] = extract_page_text(page["html"])
+        page["name"] = os.path.splitext(page["file"])[0]
+    return pages
+
+
+def _next_data(html: str) -> Optional[Dict]:
+    """__NEXT_DATA__ payload of a Next.js page (help centers embed their articles there)"""
+    marker = '<script id="__NEXT_DATA__" type="application/json">'
+    start = html.find(marker)
+    if start < 0:
+        return None
+    start += len(marker)
+    return json.loads(html[start:html.index("</script>", start)])
+
+
+def check_expectations(pages: List[Dict], scraper: EcommerceScraper) -> List[str]:
+    """Behaviour the optimisations must keep (from manifest.json)"""
+    failures = []
+    for page in pages:
+        expect = page.get("expect", {})
+        not_found = scraper._is_404_or_not_found(page["text"])
+        if "not_found" in expect and not_found != expect["not_found"]:
+            failures.append(f"{page['name']}: _is_404_or_not_found={not_found}, expected {expect['not_found']}")
+        if "page_type" in expect:
+            page_type = scraper._classify_page_type(page["url"], page["text"])
+            if page_type != expect["page_type"]:
+                failures.append(f"{page['name']}: _classify_page_type={page_type!r}, expected {expect['page_type']!r}")
+        if "rules" in expect:
+            # The page alone, under its page type (authoritative for its own fields)
+            scraped_data = {"policy_pages": {expect.get("page_type", page["name"]): {"url": page["url"], "content": page["text"]}}}
+            best = best_candidates(extract_candidates(scraped_data, infer_absence=False))
+            for field, value in expect["rules"].items():
+                got = best[field]["value"] if best[field] else None
+                if got != value:
+                    failures.append(f"{page['name']}: rule {field}={got!r}, expected {value!r}")
+    return failures
+
+
+def build_benchmarks(pages: List[Dict]) -> List[Benchmark]:
+    scraper = EcommerceScraper(session=new_http_session())
+    analyzer = PolicyAnalyzer.__new__(PolicyAnalyzer)  # _prepare_content needs no client
+    benchmarks = []
+
+    for page in pages:
+        html, text, url = page["html"], page["text"], page["url"]
+        benchmarks.append(Benchmark(f"extract_page_text[{page['name']}]",
+                                    lambda html=html: extract_page_text(html), len(html.encode())))
+        benchmarks.append(Benchmark(f"classify_page_type[{page['name']}]",
+                                    lambda url=url, text=text: scraper._classify_page_type(url, text)))
+        # Content-only path (URL without policy keywords), as for pages found by the crawler
+        benchmarks.append(Benchmark(f"classify_page_type_content[{page['name']}]",
+                                    lambda text=text: scraper._classify_page_type("https://shop.example/p/1", text)))
+        benchmarks.append(Benchmark(f"is_404_or_not_found[{page['name']}]",
+                                    lambda text=text: scraper._is_404_or_not_found(text)))
+
+    with open(SEARCH_RESULTS_PATH) as f:
+        search_results = json.load(f)
+    for page in pages:
+        data = _next_data(page["html"])
+        if data is not None:
+            benchmarks.append(Benchmark(f"extract_text_from_json[{page['name']}.__NEXT_DATA__]",
+                                        lambda data=data: scraper._extract_text_from_json(data)))
+    benchmarks.append(Benchmark("extract_text_from_json[firecrawl_search_walmart]",
+                                lambda: scraper._extract_text_from_json(search_results)))
+
+    scraped_data = {
+        "domain": "maple-co.example",
+        "main_url": "https://maple-co.example/",
+        "policy_pages": {page["name"]: {"url": page["url"], "content": page["text"]} for page in pages},
+    }
+    benchmarks.append(Benchmark("prepare_content[corpus]", lambda: analyzer._prepare_content(scraped_data)))
+
+    # Firecrawl ranking: every field's search items, both scoring modes
+    ranked = [(field, result.get("web") or []) for field, result in search_results.items() if field in FIELD_KEYWORDS]
+
+    def rank(search_only: bool):
+        for field, items in ranked:
+            sorted(items, key=lambda item: score_search_item(item, field, search_only=search_only), reverse=True)
+
+    benchmarks.append(Benchmark("score_search_item[firecrawl_search_walmart]", lambda: rank(False)))
+    benchmarks.append(Benchmark("score_search_item_search_only[firecrawl_search_walmart]", lambda: rank(True)))
+    return benchmarks
+
+
+def _time_per_call(func: Callable[[], object]) -> float:
+    """Best-of-REPEATS seconds per call, with the loop count calibrated to ~TARGET_SECONDS"""
+    number = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - started
+        if elapsed >= TARGET_SECONDS / 10 or number >= 1_000_000:
+            break
+        number *= 10
+    number = max(1, int(number * TARGET_SECONDS / max(elapsed, 1e-9)))
+    best = float("inf")
+    for _ in range(REPEATS):
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, (time.perf_counter() - started) / number)
+    return best
+
+
+def _allocations(func: Callable[[], object]) -> Dict:
+    """Peak traced memory and net allocated blocks for one call"""
+    func()  # warm caches (regex compilation, imports)
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        start_current, _ = tracemalloc.get_traced_memory()
+        result = func()
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    del result
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename"))
+    return {"peak_kib": round((peak - start_current) / 1024, 1), "net_blocks": blocks}
+
+
+def run(benchmarks: List[Benchmark]) -> Dict[str, Dict]:
+    results = {}
+    for bench in benchmarks:
+        seconds = _time_per_call(bench.func)
+        entry = {
+            "us_per_call": round(seconds * 1e6, 2),
+            "calls_per_s": round(1 / seconds, 1),
+            **_allocations(bench.func),
+        }
+        if bench.input_bytes:
+            entry["mb_per_s"] = round(bench.input_bytes / seconds / 1e6, 2)
+        results[bench.name] = entry
+        print(f"  {bench.name:<72} {entry['us_per_call']:>11.2f} us  {entry['calls_per_s']:>12.1f}/s"
+              f"  {entry.get('mb_per_s', ''):>8}{' MB/s' if bench.input_bytes else '     '}"
+              f"  peak {entry['peak_kib']:>8.1f} KiB  {entry['net_blocks']:>6} blocks")
+    return results
+
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], tolerance: float, show_missing: bool = True) -> List[str]:
+    """Benchmarks slower (or allocating more) than baseline by more than `tolerance`"""
+    regressions = []
+    print(f"\nvs baseline (tolerance {tolerance:.0%}):")
+    for name, entry in results.items():
+        base = baseline.get(name)
+        if not base:
+            print(f"  {name:<72} new")
+            continue
+        time_ratio = entry["us_per_call"] / base["us_per_call"] if base["us_per_call"] else 1.0
+        memory_ratio = entry["peak_kib"] / base["peak_kib"] if base["peak_kib"] else 1.0
+        flag = ""
+        if time_ratio > 1 + tolerance:
+            flag = "  <-- SLOWER"
+        if memory_ratio > 1 + tolerance and entry["peak_kib"] - base["peak_kib"] > 16:
+            flag += "  <-- MORE MEMORY"
+        if flag:
+            regressions.append(f"{name}: {time_ratio:.2f}x time, {memory_ratio:.2f}x peak memory")
+        print(f"  {name:<72} {time_ratio:>6.2f}x time  {memory_ratio:>6.2f}x memory{flag}")
+    for name in baseline if show_missing else ():
+        if name not in results:
+            print(f"  {name:<72} missing (removed or filtered out)")
+    return regressions
+
+
+def capture(url: str, name: str) -> None:
+    """Save a live page into the corpus and register it in manifest.json"""
+    response = new_http_session().get(url, timeout=20)
+    response.raise_for_status()
+    filename = f"{name}.html"
+    with open(os.path.join(CORPUS_DIR, filename), "w", encoding="utf-8") as f:
+        f.write(response.text)
+    manifest_path = os.path.join(CORPUS_DIR, "manifest.json")
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    manifest["pages"] = [page for page in manifest["pages"] if page["file"] != filename]
+    manifest["pages"].append({"file": filename, "url": url, "kind": "captured", "expect": {}})
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+        f.write("\n")
+    print(f"📥 Saved {url} -> corpus/{filename} ({len(response.content)} bytes); add its expectations to manifest.json")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Offline micro-benchmarks for scraper/analyzer hot paths")
+    parser.add_argument("--compare", action="store_true", help="Compare with baseline.json, exit 1 on regression")
+    parser.add_argument("--save-baseline", action="store_true", help="Write results to baseline.json")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown before flagging (0.25 = 25%%)")
+    parser.add_argument("--filter", default="", help="Only run benchmarks whose name contains this")
+    parser.add_argument("--json", metavar="PATH", help="Also write results to PATH")
+    parser.add_argument("--capture", nargs=2, metavar=("URL", "NAME"), help="Add a live page to the corpus")
+    args = parser.parse_args()
+
+    if args.capture:
+        capture(*args.capture)
+        return 0
+
+    pages = _load_corpus()
+    failures = check_expectations(pages, EcommerceScraper(session=new_http_session()))
+    for failure in failures:
+        print(f"❌ Corpus expectation failed: {failure}")
+
+    benchmarks = [bench for bench in build_benchmarks(pages) if args.filter in bench.name]
+    print(f"⏱️ {len(benchmarks)} benchmarks, {len(pages)} corpus pages (Python {sys.version.split()[0]})\n")
+    results = run(benchmarks)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(BASELINE_PATH, "w") as f:
+            json.dump({"python": sys.version.split()[0], "results": results}, f, indent=2)
+            f.write("\n")
+        print(f"\n💾 Baseline written to {os.path.relpath(BASELINE_PATH, ROOT)}")
+
+    regressions = []
+    if args.compare:
+        if not os.path.exists(BASELINE_PATH):
+            print("\n⚠️ No baseline.json yet: run with --save-baseline first")
+            return 1
+        with open(BASELINE_PATH) as f:
+            regressions = compare(results, json.load(f)["results"], args.tolerance, show_missing=not args.filter)
+        if regressions:
+            print(f"\n❌ {len(regressions)} regression(s):")
+            for regression in regressions:
+                print(f"  - {regression}")
+        else:
+            print("\n✅ No regressions")
+    return 1 if failures or regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
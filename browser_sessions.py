@@ -0,0 +1,77 @@
+"""
+Browser session state per domain: cookies and localStorage reused across renders.
+
+Every render opens a fresh browser context. Sites that need a warm-up visit
+before their pages load (Walmart help pages: homepage first, for session
+cookies) would pay that navigation on every page; instead the context's storage
+state is captured after the first render of a domain and handed to the next
+contexts for that domain (renderer.py) for BROWSER_SESSION_TTL_SECONDS.
+
+A WAF redirect means the session is burnt: it is dropped, and the renderer warms
+up again and captures a fresh one. Like the LLM rate limiter, the state lives in
+a small local SQLite file (stdlib sqlite3), shared by every process rendering on
+the host - API workers, or the render service.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+BROWSER_SESSION_PATH = os.getenv("BROWSER_SESSION_PATH", "./browser_sessions.sqlite")
+BROWSER_SESSION_TTL_SECONDS = float(os.getenv("BROWSER_SESSION_TTL_SECONDS", 1800))
+
+
+class BrowserSessionStore:
+    """Playwright storage state per domain, with a TTL, in a SQLite file shared by all local processes"""
+
+    def __init__(self, path: str = BROWSER_SESSION_PATH, ttl_seconds: float = BROWSER_SESSION_TTL_SECONDS):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS browser_sessions ("
+                "domain TEXT PRIMARY KEY, state TEXT NOT NULL, captured_at REAL NOT NULL)"
+            )
+            self._local.conn = conn
+        return conn
+
+    def load(self, domain: str) -> Optional[Dict]:
+        """Storage state captured for `domain` less than the TTL ago, else None"""
+        row = self._conn().execute(
+            "SELECT state FROM browser_sessions WHERE domain = ? AND captured_at > ?",
+            (domain, time.time() - self.ttl_seconds),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, domain: str, state: Dict) -> None:
+        conn = self._conn()
+        now = time.time()
+        conn.execute(
+            "INSERT INTO browser_sessions (domain, state, captured_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(domain) DO UPDATE SET state = excluded.state, captured_at = excluded.captured_at",
+            (domain, json.dumps(state, separators=(",", ":")), now),
+        )
+        # Expired sessions are never read again
+        conn.execute("DELETE FROM browser_sessions WHERE captured_at <= ?", (now - self.ttl_seconds,))
+
+    def drop(self, domain: str) -> None:
+        self._conn().execute("DELETE FROM browser_sessions WHERE domain = ?", (domain,))
+
+
+_store: Optional[BrowserSessionStore] = None
+
+
+def get_session_store() -> BrowserSessionStore:
+    global _store
+    if _store is None:
+        _store = BrowserSessionStore()
+    return _store
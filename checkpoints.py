@@ -0,0 +1,162 @@
+"""
+Stage checkpoints: interrupted or retried jobs continue where they stopped.
+
+After each pipeline stage the job stores that stage's output in job_checkpoints:
+the main page, platform detection, discovered policy URLs, every scraped page,
+the main GPT-4 result and the final analysis (Firecrawl enhancements included).
+When the same job runs again - POST /job/{id}/retry, or a job whose worker died
+(worker recycling, deploys) picked up by recover_stale_jobs - each stage first
+looks for its checkpoint and skips the work it already did.
+
+Like the trace and the deadline, the job's checkpoints travel in a contextvar:
+`checkpoint("urls")` / `await save_checkpoint("urls", urls)` anywhere along the
+pipeline, no-ops outside a job. Checkpoints are deleted when the job completes.
+
+Running jobs also refresh analysis_jobs.heartbeat_at; a 'processing' job whose
+heartbeat is older than JOB_STALE_SECONDS is considered orphaned.
+"""
+
+import json
+import os
+import zlib
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import SessionLocal, dialect_insert
+from models import AnalysisJob, JobCheckpoint
+from stats import record_job_finished
+
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", 15))
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", 90))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+CHECKPOINT_RETENTION_HOURS = float(os.getenv("CHECKPOINT_RETENTION_HOURS", 72))
+
+_checkpoints: ContextVar[Optional["JobCheckpoints"]] = ContextVar("job_checkpoints", default=None)
+
+
+class JobCheckpoints:
+    def __init__(self, job_id: str, saved: Dict[Tuple[str, str], Any]):
+        self.job_id = job_id
+        self.saved = saved  # (stage, key) -> data
+        self.resumed = sorted({stage for stage, _ in saved})  # stages found when the job started
+
+    def get(self, stage: str, key: str = "") -> Any:
+        return self.saved.get((stage, key))
+
+
+def _pack(data: Any) -> bytes:
+    return zlib.compress(json.dumps(data, separators=(",", ":"), default=str).encode())
+
+
+async def load_checkpoints(db: AsyncSession, job_id: str) -> JobCheckpoints:
+    rows = await db.execute(
+        select(JobCheckpoint.stage, JobCheckpoint.key, JobCheckpoint.data).where(JobCheckpoint.job_id == job_id)
+    )
+    return JobCheckpoints(job_id, {(stage, key): json.loads(zlib.decompress(data)) for stage, key, data in rows})
+
+
+@contextmanager
+def use_checkpoints(store: JobCheckpoints):
+    """Make the job's checkpoints visible to every stage it runs"""
+    token = _checkpoints.set(store)
+    try:
+        yield store
+    finally:
+        _checkpoints.reset(token)
+
+
+def checkpoint(stage: str, key: str = "") -> Any:
+    """Output saved by an earlier run of this job for `stage` (None if there is none, or outside a job)"""
+    store = _checkpoints.get()
+    return store.get(stage, key) if store is not None else None
+
+
+async def save_checkpoint(stage: str, data: Any, key: str = "") -> None:
+    """Persist a stage's output in its own transaction (committed even if the job fails later)"""
+    store = _checkpoints.get()
+    if store is None:
+        return
+    now = datetime.utcnow()
+    try:
+        async with SessionLocal() as db:
+            stmt = dialect_insert(db)(JobCheckpoint).values(
+                job_id=store.job_id, stage=stage, key=key, data=_pack(data), created_at=now,
+            )
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[JobCheckpoint.job_id, JobCheckpoint.stage, JobCheckpoint.key],
+                set_={"data": stmt.excluded.data, "created_at": stmt.excluded.created_at},
+            )
+            await db.execute(stmt)
+            # Progress is also a sign of life
+            await db.execute(update(AnalysisJob).where(AnalysisJob.id == store.job_id).values(heartbeat_at=now))
+            await db.commit()
+        store.saved[(stage, key)] = data
+    except Exception as e:
+        # A lost checkpoint only costs redoing the stage on a retry
+        print(f"⚠️ Checkpoint {stage} {key} not saved for job {store.job_id}: {e}")
+
+
+async def clear_checkpoints(db: AsyncSession, job_id: str) -> None:
+    """Drop a job's checkpoints (part of the caller's transaction)"""
+    await db.execute(delete(JobCheckpoint).where(JobCheckpoint.job_id == job_id))
+
+
+async def touch_job(db: AsyncSession, job_id: str) -> None:
+    await db.execute(update(AnalysisJob).where(AnalysisJob.id == job_id).values(heartbeat_at=datetime.utcnow()))
+
+
+async def recover_stale_jobs(db: AsyncSession) -> List[AnalysisJob]:
+    """Put jobs whose worker died back in the queue; returns them, fails those out of attempts.
+
+    Orphaned: 'processing' without a heartbeat for JOB_STALE_SECONDS ('pending'
+    jobs are simply waiting for the scheduler). The claim is a conditional UPDATE
+    on the heartbeat seen, so with several workers sweeping each job is taken once.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=JOB_STALE_SECONDS)
+    stale = (await db.scalars(
+        select(AnalysisJob).where(
+            AnalysisJob.status == "processing",
+            or_(AnalysisJob.heartbeat_at < cutoff, AnalysisJob.heartbeat_at.is_(None)),
+        )
+    )).all()
+
+    claimed = []
+    for job in stale:
+        now = datetime.utcnow()
+        seen = AnalysisJob.heartbeat_at.is_(None) if job.heartbeat_at is None else AnalysisJob.heartbeat_at == job.heartbeat_at
+        if job.attempts + 1 >= JOB_MAX_ATTEMPTS:
+            values = {"status": "failed", "completed_at": now,
+                      "error_message": f"Worker lost {job.attempts + 1} times, giving up"}
+        else:
+            values = {"status": "pending", "heartbeat_at": now, "started_at": None, "attempts": job.attempts + 1}
+        result = await db.execute(
+            update(AnalysisJob)
+            .where(AnalysisJob.id == job.id, AnalysisJob.status == job.status, seen)
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount != 1:
+            continue  # another worker claimed it first
+        for name, value in values.items():
+            setattr(job, name, value)
+        if job.status == "pending":
+            claimed.append(job)
+        else:
+            await record_job_finished(db, job)
+    await db.commit()
+    return claimed
+
+
+async def prune_checkpoints(db: AsyncSession) -> None:
+    """Checkpoints of jobs that ended without completing are kept CHECKPOINT_RETENTION_HOURS for retries"""
+    cutoff = datetime.utcnow() - timedelta(hours=CHECKPOINT_RETENTION_HOURS)
+    ended = select(AnalysisJob.id).where(
+        AnalysisJob.status.in_(("failed", "cancelled", "completed")),
+        AnalysisJob.completed_at < cutoff,
+    )
+    await db.execute(delete(JobCheckpoint).where(JobCheckpoint.job_id.in_(ended)))
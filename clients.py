@@ -0,0 +1,89 @@
+"""
+App-scoped clients shared by every analysis job.
+
+Built once per worker process at startup (after gunicorn has forked, so no
+socket is shared between processes) and closed at shutdown. Every job reuses
+the same pooled connections to OpenAI and to target sites instead of opening
+new TLS sessions. The scraper, analyzer and Firecrawl fallback hold no per-job
+state, so single instances are safe for concurrent jobs.
+"""
+
+import logging
+import os
+from typing import Optional
+
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
+
+from analyzer import PolicyAnalyzer
+from firecrawl_fallback import FIRECRAWL_API_URL, FirecrawlFallback
+from scraper import SCRAPE_RENDERER, EcommerceScraper, new_http_session
+
+logger = logging.getLogger(__name__)
+
+# Keep-alive pool towards the OpenAI API (per worker process)
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", 20))
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", 120))
+
+
+class Clients:
+    def __init__(self):
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            raise ValueError("OPENAI_API_KEY environment variable is required")
+
+        limits = httpx.Limits(max_connections=OPENAI_MAX_CONNECTIONS,
+                              max_keepalive_connections=OPENAI_MAX_CONNECTIONS)
+        timeout = httpx.Timeout(OPENAI_TIMEOUT_SECONDS, connect=10.0)
+        # max_retries=0: retries (and 429 retry-after) are handled by llm_limiter, against the shared budget
+        self.openai = AsyncOpenAI(api_key=api_key, max_retries=0,
+                                  http_client=DefaultAsyncHttpxClient(limits=limits, timeout=timeout))
+        # Sync client for the Firecrawl fallback, which runs in worker threads (httpx.Client is thread-safe)
+        self.openai_sync = OpenAI(api_key=api_key, max_retries=0,
+                                  http_client=DefaultHttpxClient(limits=limits, timeout=timeout))
+        self.http = new_http_session()
+
+        self.firecrawl_fallback: Optional[FirecrawlFallback] = None
+        firecrawl_key = os.getenv("FIRECRAWL_API_KEY")
+        if firecrawl_key:
+            from firecrawl import Firecrawl
+            firecrawl = Firecrawl(api_key=firecrawl_key, api_url=FIRECRAWL_API_URL)
+            self.firecrawl_fallback = FirecrawlFallback(firecrawl=firecrawl, openai_client=self.openai_sync)
+        else:
+            logger.warning("⚠️ FIRECRAWL_API_KEY not set - Firecrawl fallback disabled")
+
+        self.scraper = EcommerceScraper(session=self.http)
+        self.analyzer = PolicyAnalyzer(client=self.openai, firecrawl_fallback=self.firecrawl_fallback)
+
+    async def aclose(self) -> None:
+        await self.openai.close()
+        self.openai_sync.close()
+        self.http.close()
+        if SCRAPE_RENDERER == "service":
+            from render_worker import close_render_client
+            await close_render_client()
+
+
+_clients: Optional[Clients] = None
+
+
+def init_clients() -> Clients:
+    """Build the shared clients (startup)"""
+    global _clients
+    if _clients is None:
+        _clients = Clients()
+        print("🔌 Shared clients ready (OpenAI, Firecrawl, HTTP pool)")
+    return _clients
+
+
+def get_clients() -> Clients:
+    """Shared clients, built lazily when used outside the app lifecycle (CLI, scripts)"""
+    return _clients or init_clients()
+
+
+async def close_clients() -> None:
+    """Close pooled connections (shutdown)"""
+    global _clients
+    if _clients is not None:
+        await _clients.aclose()
+        _clients = None
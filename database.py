@@ -1,6 +1,8 @@
-from sqlalchemy import create_engine, MetaData
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 import os
 from dotenv import load_dotenv
 
@@ -8,19 +10,89 @@ load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./ecommerce_analyzer.db")
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Pool sizing, tunable per deployment (per worker process)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+
+# SQLite storage profile: "production" (WAL + tuned pragmas) or "default" (SQLite defaults)
+SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", "production").strip().lower()
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", 32 * 1024))
+
+def to_async_url(url: str) -> str:
+    """Map a plain DATABASE_URL to its async driver (aiosqlite / asyncpg)"""
+    if url.startswith("sqlite:"):
+        return "sqlite+aiosqlite:" + url[len("sqlite:"):]
+    if url.startswith("postgres://"):
+        return "postgresql+asyncpg://" + url[len("postgres://"):]
+    if url.startswith("postgresql://"):
+        return "postgresql+asyncpg://" + url[len("postgresql://"):]
+    return url
+
+def _engine_options(url: str) -> dict:
+    if url.startswith("sqlite"):
+        if ":memory:" in url or url.rstrip("/").endswith("sqlite+aiosqlite:"):
+            return {}  # in-memory: single shared connection (StaticPool)
+        # aiosqlite defaults to NullPool; pool file connections so sizing applies here too
+        return {
+            "poolclass": AsyncAdaptedQueuePool,
+            "pool_size": DB_POOL_SIZE,
+            "max_overflow": DB_MAX_OVERFLOW,
+            "pool_timeout": DB_POOL_TIMEOUT,
+        }
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+
+ASYNC_DATABASE_URL = to_async_url(DATABASE_URL)
+
+engine = create_async_engine(ASYNC_DATABASE_URL, **_engine_options(ASYNC_DATABASE_URL))
+
+if engine.dialect.name == "sqlite" and SQLITE_PROFILE == "production":
+    @event.listens_for(engine.sync_engine, "connect")
+    def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+        """WAL lets readers run alongside the single writer; busy_timeout makes
+        writers from other workers wait instead of failing with 'database is locked'."""
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+
+SessionLocal = async_sessionmaker(engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
-    try:
+def dialect_insert(db: AsyncSession):
+    """INSERT construct supporting on_conflict_do_update for the session's dialect"""
+    return postgresql.insert if db.bind.dialect.name == "postgresql" else sqlite.insert
+
+async def get_db():
+    """FastAPI dependency: one session per request, always closed afterwards"""
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 async def init_db():
-    """Initialize the database with tables"""
-    from models import AnalysisResult, AnalysisJob
-    Base.metadata.create_all(bind=engine)
+    """Bring the schema up to date (versioned migrations) and backfill counters and facts"""
+    from migrations import run_migrations
+    from stats import ensure_stats
+    from facts import backfill_facts
+    await run_migrations(engine)
+
+    async with SessionLocal() as db:
+        await ensure_stats(db)
+        await backfill_facts(db)
+
+async def close_db():
+    """Release pooled connections on shutdown"""
+    await engine.dispose()
@@ -0,0 +1,155 @@
+"""
+Per-job deadline budget and cancellation.
+
+process_website opens a budget of JOB_DEADLINE_SECONDS; code along the pipeline
+asks it how long it may still wait (`budget_timeout(30)` -> at most 30s, less if
+the job is running out of time) and whether to keep going (`check_budget()`).
+Like the trace (tracing.py), the budget travels in a contextvar, so code running
+in worker threads via asyncio.to_thread or executors.py sees it too.
+
+When the deadline passes or POST /job/{id}/cancel arrives, the budget's event is
+set (worker threads stop at their next check) and the job's asyncio task is
+cancelled (awaits in flight - Playwright navigations, OpenAI calls - are
+interrupted and their `finally` blocks close browsers and pages).
+"""
+
+import asyncio
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+JOB_DEADLINE_SECONDS = float(os.getenv("JOB_DEADLINE_SECONDS", 600))
+# Below this, a stage does not start a new network call at all
+DEADLINE_MIN_TIMEOUT_SECONDS = float(os.getenv("DEADLINE_MIN_TIMEOUT_SECONDS", 1))
+
+_budget: ContextVar[Optional["Budget"]] = ContextVar("job_budget", default=None)
+_running: Dict[str, "Budget"] = {}  # job_id -> budget of jobs running in this process
+
+
+class BudgetExhausted(Exception):
+    """The job must stop: its deadline passed or it was cancelled"""
+
+
+class DeadlineExceeded(BudgetExhausted):
+    pass
+
+
+class JobCancelled(BudgetExhausted):
+    pass
+
+
+class Budget:
+    def __init__(self, job_id: Optional[str], seconds: float):
+        self.job_id = job_id
+        self.seconds = seconds
+        self.deadline = time.monotonic() + seconds
+        self.stopped = threading.Event()  # set on cancel or expiry; checked by worker threads
+        self.cancelled = False
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def remaining(self) -> float:
+        return self.deadline - time.monotonic()
+
+    def exhausted(self) -> bool:
+        return self.stopped.is_set() or self.remaining() <= 0
+
+    def check(self) -> None:
+        if self.cancelled:
+            raise JobCancelled(f"job {self.job_id} cancelled")
+        if self.stopped.is_set() or self.remaining() < DEADLINE_MIN_TIMEOUT_SECONDS:
+            raise DeadlineExceeded(f"job deadline of {self.seconds:.0f}s exceeded")
+
+    def timeout(self, default: Optional[float]) -> float:
+        """`default` seconds, capped by the time left; raises once there is no time left"""
+        self.check()
+        return min(default if default is not None else math.inf, self.remaining())
+
+    def cancel(self) -> None:
+        """Stop the job from any thread (POST /job/{id}/cancel)"""
+        if not self.stopped.is_set():
+            self.cancelled = True
+            self._stop()
+
+    def _stop(self) -> None:
+        if self.stopped.is_set():
+            return  # the task is cancelled once; its cleanup must not be interrupted again
+        self.stopped.set()
+        if self._task is not None and not self._task.done():
+            self._loop.call_soon_threadsafe(self._task.cancel)
+
+    def _attach(self) -> None:
+        """Bind to the current asyncio task and arm the hard deadline"""
+        try:
+            self._task = asyncio.current_task()
+        except RuntimeError:
+            return
+        if self._task is not None:
+            self._loop = self._task.get_loop()
+            self._timer = self._loop.call_later(max(self.remaining(), 0), self._stop)
+
+    def _detach(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+        self._task = None
+
+
+@contextmanager
+def job_budget(job_id: Optional[str] = None, seconds: float = JOB_DEADLINE_SECONDS):
+    """Give the current job (and every stage it runs) `seconds` to finish"""
+    budget = Budget(job_id, seconds)
+    budget._attach()
+    token = _budget.set(budget)
+    if job_id:
+        _running[job_id] = budget
+    try:
+        yield budget
+    finally:
+        if job_id:
+            _running.pop(job_id, None)
+        budget._detach()
+        _budget.reset(token)
+
+
+def current_budget() -> Optional[Budget]:
+    return _budget.get()
+
+
+def check_budget() -> None:
+    """Raise DeadlineExceeded / JobCancelled if the current job must stop (no-op outside a job)"""
+    budget = _budget.get()
+    if budget is not None:
+        budget.check()
+
+
+def budget_exhausted() -> bool:
+    """Non-raising check for loops that return partial results"""
+    budget = _budget.get()
+    return budget is not None and budget.exhausted()
+
+
+def budget_timeout(default: Optional[float]) -> Optional[float]:
+    """Timeout for the next call: `default`, shrunk to the job's time left (raises if none is left)"""
+    budget = _budget.get()
+    if budget is None:
+        return default
+    return budget.timeout(default)
+
+
+def time_left() -> float:
+    budget = _budget.get()
+    return budget.remaining() if budget is not None else math.inf
+
+
+def cancel_running_job(job_id: str) -> bool:
+    """Cancel a job running in this process; False if it runs elsewhere (or not at all)"""
+    budget = _running.get(job_id)
+    if budget is None:
+        return False
+    budget.cancel()
+    return True
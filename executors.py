@@ -0,0 +1,74 @@
+"""
+Dedicated thread pools for blocking calls made from async code.
+
+asyncio.to_thread shares one default executor (min(32, cpus + 4) threads) with
+everything else in the process. Two pools replace it on the job path:
+
+- run_io: slow blocking I/O - requests page fetches and HEADs, the Firecrawl
+  fallback and its LLM calls, speculative Firecrawl searches. Sized from
+  JOB_CONCURRENCY (BLOCKING_IO_THREADS_PER_JOB threads per running job), so a
+  full worker never waits on another job's Firecrawl scrape for a thread.
+- run_bookkeeping: millisecond sqlite3 calls to the host-shared stores (LLM
+  limiter, host health, browser sessions). A few threads of their own, so
+  pacing and accounting never queue behind a 60s scrape.
+
+Like asyncio.to_thread, both copy the caller's context: the job's deadline,
+trace and checkpoints follow the call into the thread.
+"""
+
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+# Same setting as scheduler.JOB_CONCURRENCY (read here to keep this module import-light for render_worker.py)
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", 8))
+# Per job: the page fetch or Firecrawl fallback, plus up to FIRECRAWL_SPECULATIVE_MAX_FIELDS searches
+BLOCKING_IO_THREADS_PER_JOB = int(os.getenv("BLOCKING_IO_THREADS_PER_JOB", 4))
+BLOCKING_IO_THREADS = int(os.getenv("BLOCKING_IO_THREADS", JOB_CONCURRENCY * BLOCKING_IO_THREADS_PER_JOB))
+BOOKKEEPING_THREADS = int(os.getenv("BOOKKEEPING_THREADS", 4))
+
+_io_executor: Optional[ThreadPoolExecutor] = None
+_bookkeeping_executor: Optional[ThreadPoolExecutor] = None
+_lock = threading.Lock()
+
+
+def _executors():
+    # Created on first use: after gunicorn has forked, in the worker that uses them
+    global _io_executor, _bookkeeping_executor
+    with _lock:
+        if _io_executor is None:
+            _io_executor = ThreadPoolExecutor(BLOCKING_IO_THREADS, thread_name_prefix="blocking-io")
+            _bookkeeping_executor = ThreadPoolExecutor(BOOKKEEPING_THREADS, thread_name_prefix="bookkeeping")
+        return _io_executor, _bookkeeping_executor
+
+
+async def _run(executor: ThreadPoolExecutor, func: Callable[..., T], *args, **kwargs) -> T:
+    context = contextvars.copy_context()
+    call = functools.partial(context.run, func, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(executor, call)
+
+
+async def run_io(func: Callable[..., T], *args, **kwargs) -> T:
+    """func(*args, **kwargs) in the blocking I/O pool"""
+    return await _run(_executors()[0], func, *args, **kwargs)
+
+
+async def run_bookkeeping(func: Callable[..., T], *args, **kwargs) -> T:
+    """func(*args, **kwargs) in the small pool for local sqlite3 stores"""
+    return await _run(_executors()[1], func, *args, **kwargs)
+
+
+def shutdown_executors() -> None:
+    """Stop both pools (shutdown); queued calls are dropped, running ones finish in the background"""
+    global _io_executor, _bookkeeping_executor
+    with _lock:
+        for executor in (_io_executor, _bookkeeping_executor):
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+        _io_executor = _bookkeeping_executor = None
@@ -0,0 +1,124 @@
+"""
+Streaming exporters for analysis results.
+
+Rows are pulled from the database in server-side batches (``yield_per``) and
+serialized incrementally, so memory use stays flat whatever the table size.
+"""
+
+import csv
+import io
+import json
+import os
+from datetime import datetime
+from typing import AsyncIterable, AsyncIterator, Iterable, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import AnalysisResult
+
+EXPORT_COLUMNS = [
+    "domain",
+    "shipping_policy",
+    "shipping_url",
+    "return_policy",
+    "return_url",
+    "self_help_returns",
+    "self_help_url",
+    "insurance",
+    "insurance_url",
+    "analyzed_at",
+]
+
+# Rows fetched per round-trip, and bytes buffered before a chunk is flushed
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 500))
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+# Free-text columns flattened to a single line in CSV output
+_FLATTENED_COLUMNS = {"shipping_policy", "return_policy", "self_help_returns", "insurance"}
+
+
+def resolve_delimiter(val: Optional[str]) -> str:
+    """Map the `sep` query param to a CSV delimiter (defaults to ';' for Excel)."""
+    if not val:
+        return ';'
+    v = val.lower()
+    if v in {',', 'comma'}:
+        return ','
+    if v in {';', 'semicolon', 'semi'}:
+        return ';'
+    if v in {'tab', '\t'}:
+        return '\t'
+    # If single char provided, use it; else fallback to ';'
+    return v[0] if len(v) == 1 else ';'
+
+
+def result_filters(domain: Optional[str] = None,
+                   since: Optional[datetime] = None,
+                   until: Optional[datetime] = None) -> List:
+    """Build the WHERE clauses shared by the results listing and the exports"""
+    clauses = []
+    if domain:
+        clauses.append(AnalysisResult.domain.ilike(f"%{domain}%"))
+    if since:
+        clauses.append(AnalysisResult.analyzed_at >= since)
+    if until:
+        clauses.append(AnalysisResult.analyzed_at < until)
+    return clauses
+
+
+async def iter_result_rows(db: AsyncSession, filters: Iterable = (), columns: Optional[List[str]] = None) -> AsyncIterator:
+    """Yield result rows (column tuples, not ORM objects) in server-side batches"""
+    columns = [getattr(AnalysisResult, name) for name in (columns or EXPORT_COLUMNS)]
+    stmt = (
+        select(*columns)
+        .where(*filters)
+        .order_by(AnalysisResult.id)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+    result = await db.stream(stmt)
+    async for row in result:
+        yield row
+
+
+async def iter_csv(rows: AsyncIterable, delimiter: str = ';', bom: bool = False) -> AsyncIterator[bytes]:
+    """Serialize rows to CSV, yielding ~64KB encoded chunks"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=delimiter, quoting=csv.QUOTE_MINIMAL, lineterminator='\n')
+    if bom:
+        buffer.write('\ufeff')
+    writer.writerow(EXPORT_COLUMNS)
+
+    async for row in rows:
+        writer.writerow([
+            (value or "").replace("\n", " ") if name in _FLATTENED_COLUMNS
+            else ("" if value is None else value)
+            for name, value in zip(EXPORT_COLUMNS, row)
+        ])
+        if buffer.tell() >= EXPORT_CHUNK_BYTES:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+async def iter_ndjson(rows: AsyncIterable) -> AsyncIterator[bytes]:
+    """Serialize rows to newline-delimited JSON, yielding ~64KB encoded chunks"""
+    parts: List[str] = []
+    size = 0
+    async for row in rows:
+        record = dict(zip(EXPORT_COLUMNS, row))
+        if isinstance(record["analyzed_at"], datetime):
+            record["analyzed_at"] = record["analyzed_at"].isoformat()
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        parts.append(line)
+        size += len(line)
+        if size >= EXPORT_CHUNK_BYTES:
+            yield "".join(parts).encode('utf-8')
+            parts = []
+            size = 0
+
+    if parts:
+        yield "".join(parts).encode('utf-8')
@@ -0,0 +1,366 @@
+"""
+Structured policy facts parsed from the free-text analysis.
+
+Runs after analyze_policies: numbers (return window, free-shipping threshold,
+delivery times), the restocking-fee flag and the insurance provider are parsed
+out of the policy text into typed, indexed columns on analysis_results, so
+questions like "return window >= 60 days" are index lookups instead of scans.
+Patterns cover English and French wording.
+"""
+
+import math
+import re
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import AnalysisResult
+
+FACT_FIELDS = [
+    "return_window_days",
+    "free_shipping_threshold",
+    "free_shipping_currency",
+    "standard_delivery_days",
+    "express_delivery_days",
+    "restocking_fee",
+    "insurance_provider",
+]
+
+FACTS_BACKFILL_BATCH = 200
+
+# Columns GET /facts/aggregate can group by (low-cardinality, indexed)
+FACT_GROUPS = ["insurance_provider", "free_shipping_currency", "restocking_fee"]
+
+# --- Durations ---
+
+_UNIT_DAYS = {
+    "day": 1, "days": 1, "jour": 1, "jours": 1,
+    "week": 7, "weeks": 7, "semaine": 7, "semaines": 7,
+    "month": 30, "months": 30, "mois": 30,
+    "h": 1 / 24, "hour": 1 / 24, "hours": 1 / 24, "heure": 1 / 24, "heures": 1 / 24,
+}
+_NUMBER_WORDS = {
+    "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7,
+    "ten": 10, "fourteen": 14, "thirty": 30, "sixty": 60, "ninety": 90,
+    "un": 1, "une": 1, "deux": 2, "trois": 3, "quatre": 4, "cinq": 5, "sept": 7,
+    "dix": 10, "quatorze": 14, "trente": 30, "soixante": 60,
+}
+_QUALIFIER = r"(?:calendar|business|working|ouvrés|ouvrables|calendaires|francs)"
+_DURATION_RE = re.compile(
+    r"\b(?P<n>\d{1,3}|" + "|".join(_NUMBER_WORDS) + r")"
+    r"(?:\s*(?:-|–|to|à|a)\s*(?P<m>\d{1,3}))?"
+    rf"[\s-]*(?:{_QUALIFIER}\s+)?(?P<unit>days?|jours?|weeks?|semaines?|months?|mois|hours?|heures?|h)\b"
+    rf"(?:\s+{_QUALIFIER})?",
+    re.IGNORECASE,
+)
+
+# --- Money ---
+
+_CURRENCY_SYMBOLS = {"$": "USD", "us$": "USD", "ca$": "CAD", "c$": "CAD", "a$": "AUD", "au$": "AUD",
+                     "€": "EUR", "£": "GBP", "chf": "CHF"}
+_CURRENCY_CODES = r"USD|EUR|GBP|CAD|AUD|CHF"
+_AMOUNT = r"\d{1,5}(?:[.,]\d{1,2})?"
+_MONEY_RE = re.compile(
+    rf"(?P<pre>US\$|CA\$|AU\$|C\$|A\$|\$|€|£|\b(?:{_CURRENCY_CODES})\b)\s?(?P<a1>{_AMOUNT})"
+    rf"|(?P<a2>{_AMOUNT})\s?(?P<post>€|\$|£|\b(?:{_CURRENCY_CODES}|euros?|dollars?)\b)",
+    re.IGNORECASE,
+)
+_FREE_RE = re.compile(r"\bfree\b|gratuite?s?\b|offerte?s?\b|\bno charge\b", re.IGNORECASE)
+
+# --- Return windows / delivery speed / restocking / insurance ---
+
+_CLAUSE_SPLIT_RE = re.compile(r"[.;!?](?:\s|$)|,|\n")
+_RETURN_WORD_RE = re.compile(r"return|exchange|retour|échange|rétractation|renvo", re.IGNORECASE)
+# Refund / processing timelines are not return windows: "Refunds are processed within 5 business days"
+_REFUND_WORD_RE = re.compile(r"refund|rembours|process|credit|crédit|issued|trait[ée]", re.IGNORECASE)
+
+_EXPRESS_RE = re.compile(
+    r"express|expedited|next[\s-]day|overnight|priority|rush|two[\s-]day|2[\s-]day|rapide|chronopost",
+    re.IGNORECASE,
+)
+_STANDARD_RE = re.compile(r"standard|ground|economy|regular|normal|classique|colissimo", re.IGNORECASE)
+_SPEED_RE = re.compile(rf"\b(?:(?P<express>{_EXPRESS_RE.pattern})|(?P<standard>{_STANDARD_RE.pattern}))\b",
+                       re.IGNORECASE)
+# Between a speed label and its duration: "Standard shipping: ", "Express (", "Livraison standard : "
+_LABEL_GAP_RE = re.compile(r"[^\d.;!?,\n]{0,30}")
+# Handling time, not transit: "processed within 1-2 business days", "ships within 24 hours", "expédiée sous 48h"
+_HANDLING_RE = re.compile(
+    r"process|handl|dispatch|prepar|fulfil|ships?\s+(?:with)?in|shipped\s+(?:with)?in|ships?\s+(?:the\s+)?same"
+    r"|trait[ée]|prépar|expédiée?s?\s+sous|expédions",
+    re.IGNORECASE,
+)
+# Before the price right after an option's duration: "3-5 business days $6.95", "2 jours (9,90 €)", "5-7 days: FREE"
+_OPTION_COST_PREFIX_RE = re.compile(r"[\s:()–—-]*")
+
+_RESTOCKING_RE = re.compile(r"restocking\s+fee|frais\s+de\s+(?:re)?stockage|frais\s+de\s+remise\s+en\s+stock",
+                            re.IGNORECASE)
+_NO_RESTOCKING_RE = re.compile(
+    r"\b(?:no|without|free\s+of|waive[sd]?)\b[^.]{0,20}restocking\s+fee"
+    r"|restocking\s+fees?\s+(?:is|are)\s+(?:not|never)\b|sans\s+frais\s+de\s+(?:re)?stockage"
+    r"|aucuns?\s+frais\s+de\s+(?:re)?stockage",
+    re.IGNORECASE,
+)
+
+INSURANCE_PROVIDERS = {
+    "Route": re.compile(r"\bRoute(?:\+|\s+(?:package|shipping|protection|insurance))|\broute\.com\b|\bRoute\b(?=[\s,.)]*$)"),
+    "Allstate": re.compile(r"\ballstate\b", re.IGNORECASE),
+    "SquareTrade": re.compile(r"\bsquare\s?trade\b", re.IGNORECASE),
+    "Extend": re.compile(r"\bExtend\b(?:\s+(?:protection|warranty|plan))"),
+    "Mulberry": re.compile(r"\bmulberry\b", re.IGNORECASE),
+    "Seel": re.compile(r"\bseel\b", re.IGNORECASE),
+    "Navidium": re.compile(r"\bnavidium\b", re.IGNORECASE),
+    "ShipInsure": re.compile(r"\bship\s?insure\b", re.IGNORECASE),
+    "Corso": re.compile(r"\bcorso\b", re.IGNORECASE),
+    "XCover": re.compile(r"\bxcover\b", re.IGNORECASE),
+    "Clyde": re.compile(r"\bclyde\b", re.IGNORECASE),
+    "Asurion": re.compile(r"\basurion\b", re.IGNORECASE),
+    "Shipsurance": re.compile(r"\bshipsurance\b", re.IGNORECASE),
+}
+
+
+def _to_int(token: str) -> Optional[int]:
+    token = token.lower()
+    return int(token) if token.isdigit() else _NUMBER_WORDS.get(token)
+
+
+def _to_amount(token: str) -> float:
+    return float(token.replace(",", "."))
+
+
+def iter_durations(text: str):
+    """Yield (days, match) for every duration, using the upper bound of ranges ('3-5 days' -> 5)"""
+    for match in _DURATION_RE.finditer(text or ""):
+        upper = match.group("m") or match.group("n")
+        value = _to_int(upper)
+        if value:
+            yield math.ceil(value * _UNIT_DAYS[match.group("unit").lower()]), match
+
+
+def _money_value(match: re.Match) -> Tuple[float, str]:
+    if match.group("a1"):
+        amount, symbol = match.group("a1"), match.group("pre")
+    else:
+        amount, symbol = match.group("a2"), match.group("post")
+    symbol = symbol.lower()
+    if symbol.startswith("euro"):
+        currency = "EUR"
+    elif symbol.startswith("dollar"):
+        currency = "USD"
+    else:
+        currency = _CURRENCY_SYMBOLS.get(symbol, symbol.upper())
+    return _to_amount(amount), currency
+
+
+def iter_money(text: str):
+    """Yield (amount, currency, match) for every price in `text`"""
+    for match in _MONEY_RE.finditer(text or ""):
+        yield (*_money_value(match), match)
+
+
+def _names_return(clause: str, match: re.Match) -> bool:
+    """The keyword closest to a duration in its clause (before it, else after it) is about returns"""
+    before, after = clause[:match.start()], clause[match.end():]
+    keywords = [(m.end(), True) for m in _RETURN_WORD_RE.finditer(before)]
+    keywords += [(m.end(), False) for m in _REFUND_WORD_RE.finditer(before)]
+    if keywords:
+        return max(keywords)[1]
+    keywords = [(m.start(), True) for m in _RETURN_WORD_RE.finditer(after)]
+    keywords += [(m.start(), False) for m in _REFUND_WORD_RE.finditer(after)]
+    return min(keywords)[1] if keywords else False
+
+
+def parse_return_window(text: str) -> Optional[int]:
+    """Return window in days ('30-day returns', 'sous 14 jours', '2 weeks'), the longest stated.
+
+    Only durations in a clause about returns or exchanges count; refund and processing
+    timelines ('Refunds are processed within 5 business days') are skipped.
+    """
+    windows = [
+        days
+        for clause in _CLAUSE_SPLIT_RE.split(text or "")
+        for days, match in iter_durations(clause)
+        if 1 <= days <= 730 and _names_return(clause, match)
+    ]
+    return max(windows, default=None)
+
+
+def parse_free_shipping_threshold(text: str) -> Tuple[Optional[float], Optional[str]]:
+    """Order amount above which shipping is free; (0.0, None) for unconditional free shipping"""
+    for amount, currency, match in iter_money(text):
+        window = text[max(0, match.start() - 80):match.start()]
+        if _FREE_RE.search(window) and amount > 0:
+            return amount, currency
+    if re.search(r"\bfree (?:standard )?shipping on (?:all|every) orders?\b|livraison (?:toujours )?offerte\b|"
+                 r"livraison gratuite (?:sur|pour) toutes", text or "", re.IGNORECASE):
+        return 0.0, None
+    return None, None
+
+
+def parse_shipping_options(text: str) -> List[Dict]:
+    """Delivery options stated as a speed label right next to a duration, with their price.
+
+    "Standard 3-5 business days $6.95" -> {label: 'Standard', speed: 'standard', min_days: 3, days: 5,
+    cost: 6.95, currency: 'USD'}. Handling times ("processed within 1-2 business days", "ships
+    within 24 hours") and durations without an adjacent label are not delivery options.
+    """
+    options = []
+    for days, match in iter_durations(text):
+        if days > 60:
+            continue
+        before = text[max(0, match.start() - 60):match.start()]
+        label = None
+        for label in _SPEED_RE.finditer(before):
+            pass
+        if label is None:
+            continue
+        gap = before[label.end():]
+        if not _LABEL_GAP_RE.fullmatch(_MONEY_RE.sub("", gap)) or _HANDLING_RE.search(gap):
+            continue
+
+        cost = currency = None
+        price = next(iter_money(gap), None)
+        start = _OPTION_COST_PREFIX_RE.match(text, match.end()).end()
+        after = _MONEY_RE.match(text, start)
+        if price is not None:
+            cost, currency = price[0], price[1]
+        elif after:
+            cost, currency = _money_value(after)
+        elif _FREE_RE.search(gap) or _FREE_RE.match(text, start):
+            cost = 0.0
+
+        lower = _to_int(match.group("n")) or days
+        name = label.group(0)
+        options.append({
+            "label": name[:1].upper() + name[1:],
+            "speed": "express" if label.group("express") else "standard",
+            "min_days": min(math.ceil(lower * _UNIT_DAYS[match.group("unit").lower()]), days),
+            "days": days,
+            "cost": cost,
+            "currency": currency,
+        })
+    return options
+
+
+def parse_delivery_days(text: str) -> Tuple[Optional[int], Optional[int]]:
+    """(standard, express) delivery times in days: the first option of each speed"""
+    options = parse_shipping_options(text)
+    standard = next((option["days"] for option in options if option["speed"] == "standard"), None)
+    express = next((option["days"] for option in options if option["speed"] == "express"), None)
+    return standard, express
+
+
+def parse_restocking_fee(text: str) -> Optional[bool]:
+    """True if a restocking fee applies, False if explicitly waived, None if not mentioned"""
+    if not text:
+        return None
+    if _NO_RESTOCKING_RE.search(text):
+        return False
+    if _RESTOCKING_RE.search(text):
+        return True
+    return None
+
+
+def parse_insurance_provider(*texts: str) -> Optional[str]:
+    for text in texts:
+        for name, pattern in INSURANCE_PROVIDERS.items():
+            if text and pattern.search(text):
+                return name
+    return None
+
+
+def extract_facts(analysis: Dict) -> Dict:
+    """Typed facts (FACT_FIELDS) parsed from an analysis dict or result row values"""
+    shipping = analysis.get("shipping_policy") or ""
+    returns = analysis.get("return_policy") or ""
+    insurance = analysis.get("insurance") or ""
+
+    threshold, currency = parse_free_shipping_threshold(shipping)
+    standard, express = parse_delivery_days(shipping)
+    return {
+        "return_window_days": parse_return_window(returns),
+        "free_shipping_threshold": threshold,
+        "free_shipping_currency": currency,
+        "standard_delivery_days": standard,
+        "express_delivery_days": express,
+        "restocking_fee": parse_restocking_fee(returns),
+        "insurance_provider": parse_insurance_provider(insurance, shipping),
+    }
+
+
+async def backfill_facts(db: AsyncSession) -> int:
+    """Extract facts for rows saved before the extraction stage existed"""
+    total = 0
+    while True:
+        rows = (await db.scalars(
+            select(AnalysisResult)
+            .where(AnalysisResult.facts_extracted_at.is_(None))
+            .order_by(AnalysisResult.id)
+            .limit(FACTS_BACKFILL_BATCH)
+        )).all()
+        if not rows:
+            break
+        now = datetime.utcnow()
+        for row in rows:
+            values = extract_facts({field: getattr(row, field) for field in ("shipping_policy", "return_policy", "insurance")})
+            await db.execute(
+                update(AnalysisResult).where(AnalysisResult.id == row.id).values(facts_extracted_at=now, **values)
+            )
+        await db.commit()
+        total += len(rows)
+    if total:
+        print(f"📐 Extracted policy facts for {total} existing results")
+    return total
+
+
+def fact_filters(min_return_days: Optional[int] = None, max_return_days: Optional[int] = None,
+                 max_free_shipping: Optional[float] = None, currency: Optional[str] = None,
+                 max_standard_days: Optional[int] = None, max_express_days: Optional[int] = None,
+                 restocking_fee: Optional[bool] = None, insurance_provider: Optional[str] = None) -> List:
+    """WHERE clauses over the typed fact columns (each one served by an index)"""
+    filters = []
+    if min_return_days is not None:
+        filters.append(AnalysisResult.return_window_days >= min_return_days)
+    if max_return_days is not None:
+        filters.append(AnalysisResult.return_window_days <= max_return_days)
+    if currency:
+        filters.append(AnalysisResult.free_shipping_currency == currency.upper())
+    if max_free_shipping is not None:
+        filters.append(AnalysisResult.free_shipping_threshold <= max_free_shipping)
+    if max_standard_days is not None:
+        filters.append(AnalysisResult.standard_delivery_days <= max_standard_days)
+    if max_express_days is not None:
+        filters.append(AnalysisResult.express_delivery_days <= max_express_days)
+    if restocking_fee is not None:
+        filters.append(AnalysisResult.restocking_fee == restocking_fee)
+    if insurance_provider:
+        # Case-insensitive; served by the lower(insurance_provider) expression index
+        filters.append(func.lower(AnalysisResult.insurance_provider) == insurance_provider.lower())
+    return filters
+
+
+async def aggregate_facts(db: AsyncSession, filters: List, group_by: Optional[str] = None) -> List[Dict]:
+    """Count plus min/avg/max of the numeric facts, overall or per `group_by` value"""
+    metrics = []
+    for field in ("return_window_days", "free_shipping_threshold", "standard_delivery_days", "express_delivery_days"):
+        column = getattr(AnalysisResult, field)
+        metrics += [
+            func.count(column).label(f"{field}_count"),
+            func.min(column).label(f"{field}_min"),
+            func.avg(column).label(f"{field}_avg"),
+            func.max(column).label(f"{field}_max"),
+        ]
+
+    columns = [func.count().label("sites")] + metrics
+    if group_by:
+        columns.insert(0, getattr(AnalysisResult, group_by).label(group_by))
+    query = select(*columns).where(*filters)
+    if group_by:
+        query = query.group_by(getattr(AnalysisResult, group_by)).order_by(func.count().desc())
+
+    rows = (await db.execute(query)).mappings().all()
+    return [
+        {key: round(value, 2) if isinstance(value, float) else value for key, value in row.items()}
+        for row in rows
+    ]
@@ -6,30 +6,99 @@ Dernier recours pour rechercher des informations manquantes spécifiques
 
 import os
 import logging
-from typing import Dict, Optional, List
+import threading
+from typing import Dict, Iterable, Optional, List
 from firecrawl import Firecrawl
 import openai
 from dotenv import load_dotenv
+from deadline import budget_exhausted, budget_timeout
+from llm_limiter import chat_completion_sync
+from metrics import firecrawl_call
 
 # Charger les variables d'environnement
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# API Firecrawl (surchargeable pour les stubs locaux des tests de charge)
+FIRECRAWL_API_URL = os.getenv("FIRECRAWL_API_URL", "https://api.firecrawl.dev")
+
+# Mots-clés de pertinence par champ (classement des résultats de recherche)
+FIELD_KEYWORDS = {
+    "shipping_policy": ["shipping", "delivery", "ship", "shipping policy", "delivery options"],
+    "return_policy": ["return", "refund", "exchange", "return policy", "returns"],
+    "self_help_returns": [
+        "start a return", "start an online return", "returns portal",
+        "self-service", "guest help", "online return", "return label",
+        "return barcode", "drive up returns", "self service"
+    ],
+    "insurance": ["protection plan", "warranty", "insurance", "allstate", "squaretrade"]
+}
+
+
+def item_value(item, key: str):
+    """Champ d'un résultat de recherche (objet SDK ou dict)"""
+    if hasattr(item, key):
+        return getattr(item, key)
+    return item.get(key) if isinstance(item, dict) else None
+
+
+FIRECRAWL_MAX_TIMEOUT_MS = 300_000  # l'API refuse les timeouts au-delà de 5 minutes
+
+
+def timeout_ms() -> Optional[int]:
+    """Timeout d'un appel Firecrawl (ms) : le temps restant du job (5 min max), None hors job (défaut du SDK)"""
+    timeout = budget_timeout(None)
+    return min(int(timeout * 1000), FIRECRAWL_MAX_TIMEOUT_MS) if timeout is not None else None
+
+
+def should_stop(cancel: Optional[threading.Event]) -> bool:
+    """Recherche spéculative annulée, job annulé ou échéance du job atteinte"""
+    return (cancel is not None and cancel.is_set()) or budget_exhausted()
+
+
+def score_search_item(item, field: str, search_only: bool = False) -> int:
+    """Pertinence d'un résultat Firecrawl pour un champ (mots-clés + heuristiques d'URL)"""
+    title = str(item_value(item, 'title') or '')
+    desc = str(item_value(item, 'description') or '')
+    url = str(item_value(item, 'url') or '')
+    hay = " ".join(filter(None, [title, desc, url])).lower()
+    score = sum(1 for kw in FIELD_KEYWORDS.get(field, []) if kw in hay)
+    if search_only:
+        if field == "self_help_returns":
+            if "start an online return" in hay or "start a return" in hay:
+                score += 2
+            if "help/article" in url or "returns" in url:
+                score += 1
+        if field == "return_policy" and ("return policy" in hay or "returns & refunds" in hay):
+            score += 1
+        return score
+    # Heuristics: penalize marketplace/seller pages for consumer policies
+    if field in ("return_policy", "shipping_policy"):
+        if "marketplace" in hay or "seller" in hay:
+            score -= 2
+        if "help/article" in url or "cp/returns" in url or "return-policy" in url:
+            score += 2
+    return score
+
 class FirecrawlFallback:
-    def __init__(self):
-        # Initialisation de Firecrawl avec la clé API depuis l'environnement
-        firecrawl_key = os.getenv("FIRECRAWL_API_KEY")
-        if not firecrawl_key:
-            raise ValueError("❌ FIRECRAWL_API_KEY non trouvée dans les variables d'environnement (.env)")
-        self.firecrawl = Firecrawl(api_key=firecrawl_key)
-        
-        # Configuration OpenAI avec vérification
-        openai_key = os.getenv("OPENAI_API_KEY")
-        if not openai_key:
-            raise ValueError("❌ OPENAI_API_KEY non trouvée dans les variables d'environnement")
+    def __init__(self, firecrawl: Optional[Firecrawl] = None, openai_client: Optional[openai.OpenAI] = None):
+        # Clients partagés (clients.py) : réutilise les connexions entre les jobs
+        if firecrawl is None:
+            # Initialisation de Firecrawl avec la clé API depuis l'environnement
+            firecrawl_key = os.getenv("FIRECRAWL_API_KEY")
+            if not firecrawl_key:
+                raise ValueError("❌ FIRECRAWL_API_KEY non trouvée dans les variables d'environnement (.env)")
+            firecrawl = Firecrawl(api_key=firecrawl_key, api_url=FIRECRAWL_API_URL)
+        self.firecrawl = firecrawl
         
-        self.openai_client = openai.OpenAI(api_key=openai_key)
+        if openai_client is None:
+            # Configuration OpenAI avec vérification
+            openai_key = os.getenv("OPENAI_API_KEY")
+            if not openai_key:
+                raise ValueError("❌ OPENAI_API_KEY non trouvée dans les variables d'environnement")
+            openai_client = openai.OpenAI(api_key=openai_key)
+        self.openai_client = openai_client
         
         # SEARCH-ONLY toggle: if true, do not scrape URLs; pass titles+descriptions to OpenAI
         self.search_only = str(os.getenv("FIRECRAWL_SEARCH_ONLY", "false")).strip().lower() in ("1", "true", "yes", "on")
@@ -68,12 +137,12 @@ class FirecrawlFallback:
                 "not found",
                 "unable to find",
                 "could not determine",
-                "",
-                None
             ]
             
             # Plus agressif : considérer comme manquant si trop court ou trop vague
-            if (any(indicator in str(value).lower() for indicator in missing_indicators) or 
+            # (valeur vide/None testée explicitement : "" est sous-chaîne de toute valeur)
+            if (not value or
+                any(indicator in str(value).lower() for indicator in missing_indicators) or 
                 len(str(value).strip()) < 50 or  # Trop court
                 "no -" in str(value).lower() or  # Commence par "No -"
                 "yes -" in str(value).lower() or  # Commence par "Yes -" (souvent vague)
@@ -116,7 +185,9 @@ class FirecrawlFallback:
             Respond with only: YES or NO
             """
             
-            response = self.openai_client.chat.completions.create(
+            response = chat_completion_sync(
+                self.openai_client,
+                call_site="firecrawl_gate",
                 model="gpt-4",
                 messages=[{"role": "user", "content": prompt}],
                 max_tokens=10,
@@ -140,9 +211,13 @@ class FirecrawlFallback:
             logger.info(f"🆘 FIRECRAWL: Fallback decision (≥2 missing): {'YES' if fallback_decision else 'NO'}")
             return fallback_decision
 
-    def search_missing_information(self, domain: str, missing_info: Dict[str, bool]) -> Dict[str, Dict[str, Optional[str]]]:
+    def search_missing_information(self, domain: str, missing_info: Dict[str, bool],
+                                   cancel: Optional[threading.Event] = None) -> Dict[str, Dict[str, Optional[str]]]:
         """
         Utilise Firecrawl pour rechercher les informations manquantes
+        `cancel` (recherche spéculative) et l'échéance du job (deadline.py) sont vérifiés
+        avant chaque appel facturé (search, scrape, extraction OpenAI et ses tentatives) :
+        après annulation, seul l'appel déjà en vol se termine
         """
         results: Dict[str, Dict[str, Optional[str]]] = {}
         
@@ -157,37 +232,31 @@ class FirecrawlFallback:
             "insurance": f"protection plan warranty {clean_domain}"
         }
         
-        # Keywords to score the most relevant search item per field
-        field_keywords = {
-            "shipping_policy": ["shipping", "delivery", "ship", "shipping policy", "delivery options"],
-            "return_policy": ["return", "refund", "exchange", "return policy", "returns"],
-            "self_help_returns": [
-                "start a return", "start an online return", "returns portal",
-                "self-service", "guest help", "online return", "return label",
-                "return barcode", "drive up returns", "self service"
-            ],
-            "insurance": ["protection plan", "warranty", "insurance", "allstate", "squaretrade"]
-        }
-
         for field, is_missing in missing_info.items():
             if not is_missing:
                 continue
+            if should_stop(cancel):
+                logger.info(f"🛑 FIRECRAWL: Search cancelled before {field}")
+                break
                 
             try:
                 logger.info(f"🔥 FIRECRAWL: Searching for {field} with query: {search_queries[field][:50]}...")
                 
                 # Recherche avec Firecrawl (SEARCH UNIQUEMENT)
                 try:
-                    search_result = self.firecrawl.search(
-                        query=search_queries[field],
-                        limit=3,
-                    )
+                    with firecrawl_call("search", field=field):
+                        search_result = self.firecrawl.search(
+                            query=search_queries[field],
+                            limit=3,
+                            timeout=timeout_ms(),
+                        )
                 except TypeError:
                     # Compatibilité: anciennes versions Python SDK sans scrape_options
-                    search_result = self.firecrawl.search(
-                        query=search_queries[field],
-                        limit=3
-                    )
+                    with firecrawl_call("search", field=field):
+                        search_result = self.firecrawl.search(
+                            query=search_queries[field],
+                            limit=3
+                        )
                 logger.info(f"📡 FIRECRAWL: Search completed for {field}")
 
                 # Normaliser les items (supporte .web, ['web'], ou liste directe)
@@ -203,23 +272,7 @@ class FirecrawlFallback:
                 if items:
                     # SEARCH_ONLY: sort by relevance and aggregate topK titles/descriptions for OpenAI
                     if self.search_only:
-                        def score_item_so(it) -> int:
-                            getv = (lambda k: getattr(it, k) if hasattr(it, k) else (it.get(k) if isinstance(it, dict) else None))
-                            title = str(getv('title') or '')
-                            desc = str(getv('description') or '')
-                            url = str(getv('url') or '')
-                            hay = " ".join(filter(None, [title, desc, url])).lower()
-                            score = sum(1 for kw in field_keywords.get(field, []) if kw in hay)
-                            if field == "self_help_returns":
-                                if "start an online return" in hay or "start a return" in hay:
-                                    score += 2
-                                if "help/article" in url or "returns" in url:
-                                    score += 1
-                            if field == "return_policy" and ("return policy" in hay or "returns & refunds" in hay):
-                                score += 1
-                            return score
-
-                        sorted_items_so = sorted(items, key=score_item_so, reverse=True)
+                        sorted_items_so = sorted(items, key=lambda it: score_search_item(it, field, search_only=True), reverse=True)
                         top_items: List[str] = []
                         for idx, it in enumerate(sorted_items_so[: self.search_only_topk], start=1):
                             getv = (lambda k: getattr(it, k) if hasattr(it, k) else (it.get(k) if isinstance(it, dict) else None))
@@ -234,32 +287,23 @@ class FirecrawlFallback:
                             ])))
                         combined = "\n\n".join(top_items)
                         best_url = (getattr(sorted_items_so[0], 'url', None) if hasattr(sorted_items_so[0], 'url') else (sorted_items_so[0].get('url') if isinstance(sorted_items_so[0], dict) else None))
-                        extracted_info = self._extract_specific_info(combined[:4000], field, domain)
+                        if should_stop(cancel):
+                            logger.info(f"🛑 FIRECRAWL: Search cancelled for {field}")
+                            break
+                        extracted_info = self._extract_specific_info(combined[:4000], field, domain, cancel)
                         results[field] = {"text": extracted_info or "Information not available", "url": best_url}
                         logger.info(f"✅ FIRECRAWL: SEARCH_ONLY extracted {field}")
                         continue
 
                     # Score and try multiple candidates to avoid picking a bad one (e.g., marketplace pages)
-                    def score_item(it) -> int:
-                        getv = (lambda k: getattr(it, k) if hasattr(it, k) else (it.get(k) if isinstance(it, dict) else None))
-                        title = str(getv('title') or '')
-                        desc = str(getv('description') or '')
-                        url = str(getv('url') or '')
-                        hay = " ".join(filter(None, [title, desc, url])).lower()
-                        score = sum(1 for kw in field_keywords.get(field, []) if kw in hay)
-                        # Heuristics: penalize marketplace/seller pages for consumer policies
-                        if field in ("return_policy", "shipping_policy"):
-                            if "marketplace" in hay or "seller" in hay:
-                                score -= 2
-                            if "help/article" in url or "cp/returns" in url or "return-policy" in url:
-                                score += 2
-                        return score
-
-                    sorted_items = sorted(items, key=score_item, reverse=True)
+                    sorted_items = sorted(items, key=lambda it: score_search_item(it, field), reverse=True)
                     success = False
                     chosen_url_for_logging = None
 
                     for idx, candidate in enumerate(sorted_items[:3], start=1):
+                        if should_stop(cancel):
+                            logger.info(f"🛑 FIRECRAWL: Search cancelled for {field}")
+                            break
                         getv = (lambda k: getattr(candidate, k) if hasattr(candidate, k) else (candidate.get(k) if isinstance(candidate, dict) else None))
                         url = getv('url')
                         markdown = getv('markdown')
@@ -274,10 +318,13 @@ class FirecrawlFallback:
                         elif url:
                             try:
                                 logger.info(f"🔄 FIRECRAWL: Scraping {url} for full content...")
-                                scraped_content = self.firecrawl.scrape(
-                                    url=url,
-                                    formats=['markdown', 'html']
-                                )
+                                with firecrawl_call("scrape", url=url) as scrape_span:
+                                    scraped_content = self.firecrawl.scrape(
+                                        url=url,
+                                        formats=['markdown', 'html'],
+                                        timeout=timeout_ms(),
+                                    )
+                                    scrape_span.set(bytes=len(getattr(scraped_content, 'markdown', None) or ''))
                                 if scraped_content and hasattr(scraped_content, 'markdown') and scraped_content.markdown:
                                     combined_content = scraped_content.markdown[:4000]
                                     logger.info(f"✅ FIRECRAWL: Got {len(combined_content)} chars of markdown content")
@@ -308,8 +355,11 @@ class FirecrawlFallback:
                                 parts.append(f"Description: {desc}")
                             combined_content = "\n".join(parts)[:1500] if parts else ""
 
+                        if should_stop(cancel):
+                            logger.info(f"🛑 FIRECRAWL: Search cancelled for {field}")
+                            break
                         if combined_content:
-                            extracted_info = self._extract_specific_info(combined_content, field, domain)
+                            extracted_info = self._extract_specific_info(combined_content, field, domain, cancel)
                             if extracted_info and extracted_info != "Information not available":
                                 results[field] = {"text": extracted_info, "url": url}
                                 logger.info(f"✅ FIRECRAWL: Extracted {field} from candidate {idx}")
@@ -331,9 +381,11 @@ class FirecrawlFallback:
         
         return results
 
-    def _extract_specific_info(self, content: str, field: str, domain: str) -> str:
+    def _extract_specific_info(self, content: str, field: str, domain: str,
+                               cancel: Optional[threading.Event] = None) -> str:
         """
         Utilise OpenAI pour extraire des informations spécifiques du contenu Firecrawl
+        `cancel` arrête la file d'attente et les nouvelles tentatives de l'appel
         """
         try:
             field_prompts = {
@@ -375,7 +427,10 @@ class FirecrawlFallback:
             Extract the {field_info['task']} information:
             """
             
-            response = self.openai_client.chat.completions.create(
+            response = chat_completion_sync(
+                self.openai_client,
+                call_site="firecrawl_extract",
+                cancel=cancel,
                 model="gpt-4",
                 messages=[{"role": "user", "content": prompt}],
                 max_tokens=400,  # Augmenté pour des réponses plus complètes
@@ -388,19 +443,25 @@ class FirecrawlFallback:
             logger.error(f"❌ Error extracting {field} info: {e}")
             return "Information not available"
 
-    def enhance_analysis(self, analysis_result: Dict, domain: str) -> Dict:
+    def enhance_analysis(self, analysis_result: Dict, domain: str, skip_fields: Iterable[str] = ()) -> Dict:
         """
         Fonction principale pour améliorer l'analyse avec Firecrawl
+        skip_fields: champs déjà recherchés (ex. par la recherche spéculative)
         """
         try:
             logger.info(f"🚀 FIRECRAWL: Starting fallback analysis for {domain}")
             
             # 1. Vérifier quelles informations manquent
             missing_info = self.is_information_missing(analysis_result)
+            for field in skip_fields:
+                missing_info[field] = False
             
             if not any(missing_info.values()):
                 logger.info("✅ FIRECRAWL: No missing information detected - skipping")
                 return analysis_result
+            if should_stop(None):
+                logger.info("⏱️ FIRECRAWL: Job deadline reached or job cancelled - skipping")
+                return analysis_result
             
             # 2. Decision gate: bypass if SEARCH_ONLY is forced
             if not self.search_only:
@@ -27,7 +27,7 @@ export const Dashboard: React.FC = () => {
 
   useEffect(() => {
     let interval: NodeJS.Timeout
-    if (jobId && jobStatus !== 'completed' && jobStatus !== 'failed') {
+    if (jobId && jobStatus !== 'completed' && jobStatus !== 'failed' && jobStatus !== 'cancelled') {
       interval = setInterval(async () => {
         try {
           const job = await apiService.getJobStatus(jobId)
@@ -36,7 +36,7 @@ export const Dashboard: React.FC = () => {
             await loadData()
             setJobId(null)
             setAnalyzing(false)
-          } else if (job.status === 'failed') {
+          } else if (job.status === 'failed' || job.status === 'cancelled') {
             setJobId(null)
             setAnalyzing(false)
           }
@@ -258,12 +258,13 @@ export const Dashboard: React.FC = () => {
                     {jobStatus === 'pending' && <Clock className="h-5 w-5 text-yellow-500" />}
                     {jobStatus === 'processing' && <RotateCcw className="h-5 w-5 text-blue-500 animate-spin" />}
                     {jobStatus === 'completed' && <CheckCircle className="h-5 w-5 text-green-500" />}
-                    {jobStatus === 'failed' && <XCircle className="h-5 w-5 text-red-500" />}
+                    {(jobStatus === 'failed' || jobStatus === 'cancelled') && <XCircle className="h-5 w-5 text-red-500" />}
                     <span className="text-sm font-medium">
                       {jobStatus === 'pending' && 'Pending...'}
                       {jobStatus === 'processing' && 'Analyzing...'}
                       {jobStatus === 'completed' && 'Analysis completed!'}
                       {jobStatus === 'failed' && 'Analysis failed'}
+                      {jobStatus === 'cancelled' && 'Analysis cancelled'}
                     </span>
                   </div>
                 </motion.div>
@@ -26,7 +26,7 @@ export interface AnalysisResult {
 export interface AnalysisJob {
   job_id: string
   url: string
-  status: 'pending' | 'processing' | 'completed' | 'failed'
+  status: 'pending' | 'processing' | 'completed' | 'failed' | 'cancelled'
   created_at: string
   completed_at?: string
   error_message?: string
@@ -39,6 +39,8 @@ export interface PlatformStats {
   insurance_rate: number
   sites_with_self_service: number
   sites_with_insurance: number
+  jobs_completed: number
+  jobs_failed: number
 }
 
 export const apiService = {
@@ -1,5 +1,6 @@
 # Gunicorn configuration for production deployment
 import os
+import shutil
 
 # Server socket
 bind = f"0.0.0.0:{os.getenv('PORT', 10000)}"
@@ -31,3 +32,17 @@ preload_app = True
 limit_request_line = 4094
 limit_request_fields = 100
 limit_request_field_size = 8190
+
+# Prometheus multiprocess mode: each worker writes its metrics under this directory
+# and GET /metrics merges them (see metrics.py). Set up here because preload_app
+# imports the app (and creates metric files) before any server hook runs; the
+# directory is emptied so counters from a previous run are not merged in.
+prometheus_dir = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/analyzer-prometheus")
+shutil.rmtree(prometheus_dir, ignore_errors=True)
+os.makedirs(prometheus_dir, exist_ok=True)
+
+
+def child_exit(server, worker):
+    # Drop the live gauges (queue depth, active browsers) of a worker that exited
+    from metrics import mark_worker_dead
+    mark_worker_dead(worker.pid)
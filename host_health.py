@@ -0,0 +1,285 @@
+"""
+Per-host health for direct scraping: circuit breaker and adaptive request rate.
+
+Every direct request to a target site (main page, Shopify probes, policy page
+renders) first asks for the host's turn and then reports how it went:
+
+- blocked: WAF redirect (walmart.com/blocked?), HTTP 403/429, a challenge or
+  "access denied" page instead of content;
+- timeout: the request or render timed out, or the connection failed;
+- error: HTTP 5xx;
+- ok: the host answered normally (404s included: the host is fine).
+
+Rate: each host gets at most `rate` requests per second across all workers,
+AIMD style - every failure halves it (down to HOST_RATE_MIN_PER_SECOND), every
+ok adds HOST_RATE_INCREASE_PER_SECOND back (up to HOST_RATE_MAX_PER_SECOND).
+
+Breaker: HOST_BREAKER_FAILURES failures open the host's circuit, each ok taking
+one off (a host that blocks most requests trips it, a stray timeout does not). While
+open, the scraper leaves the host alone and the job goes straight to the
+Firecrawl path (scraper.py). After the cooldown one request is let through as a
+probe: ok closes the circuit, a failure opens it again for twice as long (up
+to HOST_BREAKER_MAX_COOLDOWN_SECONDS).
+
+Like the LLM rate limiter, the state lives in a small local SQLite file (stdlib
+sqlite3, BEGIN IMMEDIATE) shared by every worker on the host.
+"""
+
+import asyncio
+import os
+import random
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+import requests
+
+from deadline import BudgetExhausted, check_budget, time_left
+from executors import run_bookkeeping
+from metrics import HOST_CIRCUIT_EVENTS, HOST_OUTCOMES
+from renderer import is_waf_block
+
+HOST_HEALTH_PATH = os.getenv("HOST_HEALTH_PATH", "./host_health.sqlite")
+HOST_BREAKER_FAILURES = int(os.getenv("HOST_BREAKER_FAILURES", 3))
+HOST_BREAKER_COOLDOWN_SECONDS = float(os.getenv("HOST_BREAKER_COOLDOWN_SECONDS", 300))
+HOST_BREAKER_MAX_COOLDOWN_SECONDS = float(os.getenv("HOST_BREAKER_MAX_COOLDOWN_SECONDS", 3600))
+HOST_RATE_MAX_PER_SECOND = float(os.getenv("HOST_RATE_MAX_PER_SECOND", 2))
+HOST_RATE_MIN_PER_SECOND = float(os.getenv("HOST_RATE_MIN_PER_SECOND", 0.05))
+HOST_RATE_INCREASE_PER_SECOND = float(os.getenv("HOST_RATE_INCREASE_PER_SECOND", 0.1))
+# Longest a request waits for its host's turn before the host is treated as unavailable
+HOST_MAX_WAIT_SECONDS = float(os.getenv("HOST_MAX_WAIT_SECONDS", 60))
+
+FAILURES = ("blocked", "timeout", "error")
+BLOCK_PAGE_MARKERS = (
+    "access denied", "request blocked", "just a moment", "verify you are human", "are you a robot",
+    "pardon our interruption", "captcha", "unusual traffic",
+)
+_BLOCK_PAGE_MAX_CHARS = 2000  # longer pages are real content, even if they mention a captcha
+_PROBE_SECONDS = 120  # a probe that never reports back frees the half-open slot after this
+_MAX_SLEEP = 5.0
+
+
+class HostUnavailable(Exception):
+    """The host's circuit is open (or it cannot take a request in time): do not scrape it directly"""
+
+
+def host_of(url: str) -> str:
+    """Host key of a URL or bare domain"""
+    return (urlparse(url).netloc if "://" in url else url).lower()
+
+
+def classify_status(status_code: int) -> Optional[str]:
+    """Outcome of an HTTP response; None for 4xx that say nothing about the host's health"""
+    if status_code in (403, 429):
+        return "blocked"
+    if status_code >= 500:
+        return "error"
+    if status_code < 400 or status_code in (404, 410):
+        return "ok"
+    return None
+
+
+def classify_content(content: Optional[str], final_url: str = "") -> str:
+    """Outcome of a rendered page: a WAF redirect or challenge page counts as a block"""
+    if is_waf_block(final_url):
+        return "blocked"
+    if content and len(content) < _BLOCK_PAGE_MAX_CHARS:
+        text = content.lower()
+        if any(marker in text for marker in BLOCK_PAGE_MARKERS):
+            return "blocked"
+    return "ok"
+
+
+def classify_error(error: Exception) -> Optional[str]:
+    """Timeouts and failed connections count against the host; other errors (ours, the job's deadline) do not"""
+    if isinstance(error, (BudgetExhausted, HostUnavailable)):
+        return None
+    text = f"{type(error).__name__} {error}".lower()
+    if isinstance(error, (requests.Timeout, requests.ConnectionError)) or "timeout" in text or "net::err_" in text:
+        return "timeout"
+    return None
+
+
+class HostHealthStore:
+    """Breaker state and AIMD rate per host, stored in a SQLite file shared by all local processes"""
+
+    def __init__(self, path: str = HOST_HEALTH_PATH):
+        self.path = path
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS host_health ("
+                "host TEXT PRIMARY KEY, rate REAL NOT NULL, next_at REAL NOT NULL DEFAULT 0, "
+                "failures INTEGER NOT NULL DEFAULT 0, open_until REAL, cooldown REAL NOT NULL DEFAULT 0, "
+                "probe_until REAL NOT NULL DEFAULT 0, updated_at REAL NOT NULL)"
+            )
+            self._local.conn = conn
+        return conn
+
+    def _row(self, conn: sqlite3.Connection, host: str, now: float) -> Dict:
+        row = conn.execute(
+            "SELECT rate, next_at, failures, open_until, cooldown, probe_until FROM host_health WHERE host = ?", (host,)
+        ).fetchone()
+        if row is None:
+            conn.execute("INSERT INTO host_health (host, rate, updated_at) VALUES (?, ?, ?)",
+                         (host, HOST_RATE_MAX_PER_SECOND, now))
+            row = (HOST_RATE_MAX_PER_SECOND, 0.0, 0, None, 0.0, 0.0)
+        return dict(zip(("rate", "next_at", "failures", "open_until", "cooldown", "probe_until"), row))
+
+    def _save(self, conn: sqlite3.Connection, host: str, state: Dict, now: float) -> None:
+        conn.execute(
+            "UPDATE host_health SET rate = ?, next_at = ?, failures = ?, open_until = ?, cooldown = ?, "
+            "probe_until = ?, updated_at = ? WHERE host = ?",
+            (state["rate"], state["next_at"], state["failures"], state["open_until"], state["cooldown"],
+             state["probe_until"], now, host),
+        )
+
+    def is_open(self, host: str) -> bool:
+        """Circuit open: cooling down, or a probe request is already testing the host"""
+        row = self._conn().execute(
+            "SELECT open_until, probe_until FROM host_health WHERE host = ?", (host,)
+        ).fetchone()
+        if row is None or row[0] is None:
+            return False
+        now = time.time()
+        return now < row[0] or now < row[1]
+
+    def try_acquire(self, host: str) -> float:
+        """Take the host's next request slot; returns 0 on success, else seconds to wait.
+
+        Raises HostUnavailable while the circuit is open. Past the cooldown, the
+        first caller to get a slot is the probe and the others stay out.
+        """
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            state = self._row(conn, host, now)
+            unavailable = state["open_until"] is not None and (now < state["open_until"] or now < state["probe_until"])
+            wait = max(state["next_at"] - now, 0.0)
+            if not unavailable and wait <= 0:
+                state["next_at"] = now + 1 / state["rate"]
+                if state["open_until"] is not None:
+                    state["probe_until"] = now + _PROBE_SECONDS
+                    HOST_CIRCUIT_EVENTS.labels(event="probe").inc()
+                    print(f"    🩺 Probing {host} after its cooldown")
+                self._save(conn, host, state, now)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if unavailable:
+            raise HostUnavailable(f"{host}: circuit open")
+        return wait
+
+    def record(self, host: str, outcome: str) -> None:
+        """Report a request's outcome (ok, blocked, timeout, error): adjusts the rate and the breaker"""
+        HOST_OUTCOMES.labels(outcome=outcome).inc()
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            state = self._row(conn, host, now)
+            is_open = state["open_until"] is not None
+            # Past the cooldown this is the probe's answer; earlier, a request from before the circuit opened
+            half_open = is_open and now >= state["open_until"]
+            if outcome in FAILURES:
+                state["failures"] += 1
+                state["rate"] = max(HOST_RATE_MIN_PER_SECOND, state["rate"] / 2)
+                if half_open or (not is_open and state["failures"] >= HOST_BREAKER_FAILURES):
+                    state["cooldown"] = (min(state["cooldown"] * 2, HOST_BREAKER_MAX_COOLDOWN_SECONDS)
+                                         if half_open else HOST_BREAKER_COOLDOWN_SECONDS)
+                    state["open_until"] = now + state["cooldown"]
+                    state["probe_until"] = 0.0
+                    HOST_CIRCUIT_EVENTS.labels(event="opened").inc()
+                    print(f"    ⛔ Circuit open for {host} after {state['failures']} failures "
+                          f"({outcome}), direct scraping paused {state['cooldown']:.0f}s")
+            else:
+                state["failures"] = max(state["failures"] - 1, 0)
+                state["rate"] = min(HOST_RATE_MAX_PER_SECOND, state["rate"] + HOST_RATE_INCREASE_PER_SECOND)
+                if half_open:
+                    state["open_until"], state["cooldown"], state["probe_until"], state["failures"] = None, 0.0, 0.0, 0
+                    HOST_CIRCUIT_EVENTS.labels(event="closed").inc()
+                    print(f"    ✅ Circuit closed for {host}")
+            self._save(conn, host, state, now)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """Hosts that are open or throttled below the maximum rate"""
+        rows = self._conn().execute(
+            "SELECT host, rate, failures, open_until, cooldown FROM host_health "
+            "WHERE open_until IS NOT NULL OR rate < ? OR failures > 0 ORDER BY host",
+            (HOST_RATE_MAX_PER_SECOND,),
+        ).fetchall()
+        now = time.time()
+        return {
+            host: {
+                "circuit": "closed" if open_until is None else ("open" if now < open_until else "half_open"),
+                "open_for_seconds": round(max(open_until - now, 0.0), 1) if open_until is not None else 0.0,
+                "cooldown_seconds": cooldown,
+                "failures": failures,
+                "rate_per_second": round(rate, 3),
+            }
+            for host, rate, failures, open_until, cooldown in rows
+        }
+
+
+_store: Optional[HostHealthStore] = None
+
+
+def get_host_health() -> HostHealthStore:
+    global _store
+    if _store is None:
+        _store = HostHealthStore()
+    return _store
+
+
+def _max_wait() -> float:
+    return time.monotonic() + min(HOST_MAX_WAIT_SECONDS, time_left())
+
+
+async def host_turn(host: str) -> None:
+    """Wait for `host`'s next request slot (HostUnavailable if its circuit is open or the wait is too long)"""
+    store = get_host_health()
+    deadline = _max_wait()
+    while True:
+        check_budget()
+        wait = await run_bookkeeping(store.try_acquire, host)
+        if wait <= 0:
+            return
+        if time.monotonic() + wait > deadline:
+            raise HostUnavailable(f"{host}: throttled, next request in {wait:.0f}s")
+        await asyncio.sleep(min(wait, _MAX_SLEEP) + random.uniform(0, 0.05))
+
+
+def host_turn_sync(host: str) -> None:
+    store = get_host_health()
+    deadline = _max_wait()
+    while True:
+        check_budget()
+        wait = store.try_acquire(host)
+        if wait <= 0:
+            return
+        if time.monotonic() + wait > deadline:
+            raise HostUnavailable(f"{host}: throttled, next request in {wait:.0f}s")
+        time.sleep(min(wait, _MAX_SLEEP) + random.uniform(0, 0.05))
+
+
+def record_outcome(host: str, outcome: Optional[str]) -> None:
+    if outcome is None:
+        return
+    try:
+        get_host_health().record(host, outcome)
+    except Exception as e:
+        # Health tracking must never fail a scrape
+        print(f"⚠️ Host health not recorded for {host}: {e}")
@@ -0,0 +1,351 @@
+"""
+Shared OpenAI rate limiter: token buckets per model, coordinated across workers.
+
+Every chat completion goes through chat_completion() / chat_completion_sync().
+Before sending, the call reserves one request and an estimated token count
+(prompt chars / 4 + the completion budget) from the model's requests-per-minute
+and tokens-per-minute buckets. The buckets live in a small local SQLite file
+(stdlib sqlite3, BEGIN IMMEDIATE), so all gunicorn workers on the host share one
+budget. A call that does not fit waits in line instead of failing; a 429 blocks
+the model for every worker for the retry-after the API returned, then retries.
+Actual usage is reconciled against the estimate after each response.
+
+Inside a job, queueing, each request's timeout and retry backoff are capped by
+the job's deadline (deadline.py).
+
+Limits: LLM_LIMITS="gpt-4=500:10000,gpt-3.5-turbo=3500:200000" (rpm:tpm per model),
+LLM_DEFAULT_RPM / LLM_DEFAULT_TPM for models not listed.
+"""
+
+import asyncio
+import json
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import openai
+
+from deadline import DeadlineExceeded, JobCancelled, budget_timeout, check_budget, time_left
+from executors import run_bookkeeping
+from metrics import LLM_QUEUE_SECONDS, record_llm_call
+from tracing import span
+
+LLM_LIMITER_PATH = os.getenv("LLM_LIMITER_PATH", "./llm_limiter.sqlite")
+LLM_DEFAULT_RPM = int(os.getenv("LLM_DEFAULT_RPM", 500))
+LLM_DEFAULT_TPM = int(os.getenv("LLM_DEFAULT_TPM", 30000))
+LLM_DEFAULT_COMPLETION_TOKENS = int(os.getenv("LLM_DEFAULT_COMPLETION_TOKENS", 1000))
+LLM_MAX_WAIT_SECONDS = float(os.getenv("LLM_MAX_WAIT_SECONDS", 300))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 6))
+
+CHARS_PER_TOKEN = 4
+_MAX_SLEEP = 5.0  # re-check the shared buckets at least this often while queued
+
+_RETRYABLE = (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError, openai.InternalServerError)
+
+
+class LLMQueueTimeout(Exception):
+    """A call waited longer than LLM_MAX_WAIT_SECONDS for rate-limit budget"""
+
+
+def _parse_limits(spec: str) -> Dict[str, Tuple[int, int]]:
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        model, _, values = item.partition("=")
+        rpm, _, tpm = values.partition(":")
+        limits[model.strip()] = (int(rpm), int(tpm))
+    return limits
+
+
+LLM_LIMITS = _parse_limits(os.getenv("LLM_LIMITS", "gpt-4=500:10000,gpt-3.5-turbo=3500:200000"))
+
+
+def model_limits(model: str) -> Tuple[int, int]:
+    return LLM_LIMITS.get(model, (LLM_DEFAULT_RPM, LLM_DEFAULT_TPM))
+
+
+def estimate_tokens(request: Dict) -> int:
+    """Prompt size (chars / 4 over messages and tool schemas) plus the completion budget"""
+    chars = sum(len(str(message.get("content") or "")) for message in request.get("messages", []))
+    if request.get("tools"):
+        chars += len(json.dumps(request["tools"]))
+    completion = request.get("max_tokens") or LLM_DEFAULT_COMPLETION_TOKENS
+    return chars // CHARS_PER_TOKEN + completion
+
+
+def _duration_seconds(value: str) -> Optional[float]:
+    """'1.5', '20ms', '6m0s', '1s' (OpenAI reset headers) -> seconds"""
+    value = (value or "").strip()
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    total, matched = 0.0, False
+    for amount, unit in re.findall(r"([\d.]+)(ms|s|m|h)", value):
+        matched = True
+        total += float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    return total if matched else None
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Server-provided wait from a 429: retry-after-ms, retry-after, or the x-ratelimit reset headers"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    for name in ("retry-after", "x-ratelimit-reset-tokens", "x-ratelimit-reset-requests"):
+        seconds = _duration_seconds(headers.get(name, ""))
+        if seconds is not None:
+            return seconds
+    return None
+
+
+class TokenBucketLimiter:
+    """RPM/TPM token buckets per model, stored in a SQLite file shared by all local processes"""
+
+    def __init__(self, path: str = LLM_LIMITER_PATH):
+        self.path = path
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_buckets ("
+                "model TEXT PRIMARY KEY, requests REAL NOT NULL, tokens REAL NOT NULL, "
+                "updated_at REAL NOT NULL, blocked_until REAL NOT NULL DEFAULT 0)"
+            )
+            self._local.conn = conn
+        return conn
+
+    def _refilled(self, conn: sqlite3.Connection, model: str, now: float) -> Tuple[float, float, float]:
+        rpm, tpm = model_limits(model)
+        row = conn.execute(
+            "SELECT requests, tokens, updated_at, blocked_until FROM llm_buckets WHERE model = ?", (model,)
+        ).fetchone()
+        if row is None:
+            conn.execute(
+                "INSERT INTO llm_buckets (model, requests, tokens, updated_at, blocked_until) VALUES (?, ?, ?, ?, 0)",
+                (model, rpm, tpm, now),
+            )
+            return float(rpm), float(tpm), 0.0
+        requests, tokens, updated_at, blocked_until = row
+        elapsed = max(now - updated_at, 0.0)
+        return (
+            min(rpm, requests + elapsed * rpm / 60),
+            min(tpm, tokens + elapsed * tpm / 60),
+            blocked_until,
+        )
+
+    def try_acquire(self, model: str, tokens: int) -> float:
+        """Reserve one request and `tokens` tokens; returns 0 on success, else seconds to wait"""
+        rpm, tpm = model_limits(model)
+        # A prompt larger than the whole minute budget runs once the bucket is full
+        tokens = min(tokens, tpm)
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            available_requests, available_tokens, blocked_until = self._refilled(conn, model, now)
+            wait = max(
+                blocked_until - now,
+                (1 - available_requests) * 60 / rpm,
+                (tokens - available_tokens) * 60 / tpm,
+                0.0,
+            )
+            if wait <= 0:
+                available_requests -= 1
+                available_tokens -= tokens
+            conn.execute(
+                "UPDATE llm_buckets SET requests = ?, tokens = ?, updated_at = ? WHERE model = ?",
+                (available_requests, available_tokens, now, model),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+    def adjust(self, model: str, delta_tokens: float) -> None:
+        """Give back (delta > 0) or charge (delta < 0) tokens once actual usage is known"""
+        if not delta_tokens:
+            return
+        _, tpm = model_limits(model)
+        conn = self._conn()
+        conn.execute(
+            "UPDATE llm_buckets SET tokens = MIN(?, tokens + ?) WHERE model = ?",
+            (tpm, delta_tokens, model),
+        )
+
+    def block(self, model: str, seconds: float) -> None:
+        """Pause the model for every worker (429 with retry-after)"""
+        conn = self._conn()
+        until = time.time() + seconds
+        conn.execute(
+            "UPDATE llm_buckets SET blocked_until = MAX(blocked_until, ?) WHERE model = ?",
+            (until, model),
+        )
+
+    def snapshot(self) -> Dict[str, Dict]:
+        rows = self._conn().execute(
+            "SELECT model, requests, tokens, updated_at, blocked_until FROM llm_buckets"
+        ).fetchall()
+        now = time.time()
+        return {
+            model: {
+                "rpm_limit": model_limits(model)[0],
+                "tpm_limit": model_limits(model)[1],
+                "requests_available": round(requests, 1),
+                "tokens_available": round(tokens),
+                "blocked_for_seconds": round(max(blocked_until - now, 0.0), 1),
+            }
+            for model, requests, tokens, updated_at, blocked_until in rows
+        }
+
+
+_limiter: Optional[TokenBucketLimiter] = None
+
+
+def get_limiter() -> TokenBucketLimiter:
+    global _limiter
+    if _limiter is None:
+        _limiter = TokenBucketLimiter()
+    return _limiter
+
+
+def _backoff(attempt: int, error: Exception) -> float:
+    retry_after = retry_after_seconds(error)
+    if retry_after is not None:
+        return retry_after + random.uniform(0, 0.5)
+    return min(2 ** attempt, 60) * random.uniform(0.5, 1.0)
+
+
+def _usage_tokens(response) -> Optional[int]:
+    usage = getattr(response, "usage", None)
+    return getattr(usage, "total_tokens", None)
+
+
+def _queue_timeout(model: str) -> Exception:
+    if time_left() < LLM_MAX_WAIT_SECONDS:
+        return DeadlineExceeded(f"{model}: no rate-limit budget before the job deadline")
+    return LLMQueueTimeout(f"{model}: no rate-limit budget within {LLM_MAX_WAIT_SECONDS:.0f}s")
+
+
+def _with_budget_timeout(client, request: Dict) -> Dict:
+    """Cap the request timeout (else the client's) at the job's time left; raises once none is left"""
+    default = request.get("timeout", getattr(client, "timeout", None))
+    timeout = budget_timeout(default if isinstance(default, (int, float)) else None)
+    return request if timeout is None else {**request, "timeout": timeout}
+
+
+def _call_steps(client, call_site: str, request: Dict, cancel: Optional[threading.Event] = None):
+    """Queueing, retry, 429 and usage accounting of one chat completion, shared by both variants.
+
+    A generator of I/O steps for the caller to run, sync or async, sending back
+    each step's result (or throwing its exception):
+    ("limiter", method, args) - a TokenBucketLimiter call (blocking sqlite3),
+    ("sleep", seconds), ("create", request) - the API call itself.
+    Returns the response. A set `cancel` event stops it before the next attempt.
+    """
+    model = request["model"]
+    estimate = estimate_tokens(request)
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        queued = time.perf_counter()
+        deadline = time.monotonic() + min(LLM_MAX_WAIT_SECONDS, time_left())
+        while True:
+            check_budget()
+            if cancel is not None and cancel.is_set():
+                raise JobCancelled(f"{model}: {call_site} call cancelled")
+            wait = yield ("limiter", "try_acquire", (model, estimate))
+            if wait <= 0:
+                break
+            if time.monotonic() + wait > deadline:
+                raise _queue_timeout(model)
+            yield ("sleep", min(wait, _MAX_SLEEP) + random.uniform(0, 0.05))
+        waited = time.perf_counter() - queued
+        LLM_QUEUE_SECONDS.labels(call_site=call_site, model=model).observe(waited)
+        try:
+            started = time.perf_counter()
+            with span(f"llm.{call_site}", model=model, attempt=attempt + 1, queued_ms=round(waited * 1000)) as llm_span:
+                response = yield ("create", _with_budget_timeout(client, request))
+                llm_span.set(tokens=_usage_tokens(response))
+        except _RETRYABLE as e:
+            record_llm_call(call_site, model, time.perf_counter() - started, type(e).__name__)
+            if attempt == LLM_MAX_RETRIES:
+                raise
+            delay = _backoff(attempt, e)
+            if isinstance(e, openai.RateLimitError):
+                yield ("limiter", "block", (model, delay))
+            if delay >= time_left():
+                raise DeadlineExceeded(f"{model}: retry in {delay:.0f}s would pass the job deadline") from e
+            print(f"⏳ LLM {model}: {type(e).__name__}, retrying in {delay:.1f}s ({attempt + 1}/{LLM_MAX_RETRIES})")
+            yield ("sleep", delay)
+            continue
+        record_llm_call(call_site, model, time.perf_counter() - started, "ok", getattr(response, "usage", None))
+        used = _usage_tokens(response)
+        if used is not None:
+            yield ("limiter", "adjust", (model, estimate - used))
+        return response
+
+
+async def chat_completion(client: openai.AsyncOpenAI, call_site: str = "other",
+                          cancel: Optional[threading.Event] = None, **request):
+    """client.chat.completions.create(**request), queued behind the shared RPM/TPM budget.
+
+    call_site labels the latency/token metrics (analysis, firecrawl_extract, ...);
+    a set `cancel` event stops queueing and retries (speculative calls).
+    The limiter's sqlite3 calls run in the bookkeeping pool, off the event loop (executors.py).
+    """
+    limiter = get_limiter()
+    steps = _call_steps(client, call_site, request, cancel)
+    resume, value = steps.send, None
+    while True:
+        try:
+            kind, *args = resume(value)
+        except StopIteration as done:
+            return done.value
+        try:
+            if kind == "limiter":
+                method, method_args = args
+                value = await run_bookkeeping(getattr(limiter, method), *method_args)
+            elif kind == "sleep":
+                value = await asyncio.sleep(args[0])
+            else:
+                value = await client.chat.completions.create(**args[0])
+            resume = steps.send
+        except BaseException as e:  # cancellation too: the step's span records it
+            resume, value = steps.throw, e
+
+
+def chat_completion_sync(client: openai.OpenAI, call_site: str = "other",
+                         cancel: Optional[threading.Event] = None, **request):
+    """Blocking variant for code running in worker threads (Firecrawl fallback)"""
+    limiter = get_limiter()
+    steps = _call_steps(client, call_site, request, cancel)
+    resume, value = steps.send, None
+    while True:
+        try:
+            kind, *args = resume(value)
+        except StopIteration as done:
+            return done.value
+        try:
+            if kind == "limiter":
+                method, method_args = args
+                value = getattr(limiter, method)(*method_args)
+            elif kind == "sleep":
+                value = time.sleep(args[0])
+            else:
+                value = client.chat.completions.create(**args[0])
+            resume = steps.send
+        except BaseException as e:  # cancellation too: the step's span records it
+            resume, value = steps.throw, e
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Local stand-ins for everything the analyzer talks to, for load tests.
+
+Three FastAPI apps served from one asyncio loop:
+
+- site farm: replays the recorded pages of benchmarks/corpus. Every store is a
+  loopback address 127.0.1.N (Linux routes the whole 127/8 to lo), so the
+  scraper sees one domain per store without any DNS setup. N picks the variant:
+  shopify, shopify_slow (every response delayed), shopify_waf (403 on policy
+  pages) and non_shopify (left to the Firecrawl fallback).
+- OpenAI: POST /v1/chat/completions with configurable latency; returns the
+  extract_ecommerce_policies tool call for the analysis, YES for the Firecrawl
+  gate, an ordering for URL prioritisation and a short sentence otherwise.
+- Firecrawl: POST /v2/search and /v2/scrape (v2 API wire format).
+
+    python loadtest/fakes.py                                    # defaults, Ctrl-C to stop
+    python loadtest/fakes.py --openai-latency 2 --site-latency 0.3
+
+loadtest/run.py starts these itself; run them by hand to point a dev server at them.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+from dataclasses import dataclass
+from ipaddress import ip_address
+from typing import Dict, List
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import HTMLResponse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CORPUS_DIR = os.path.join(ROOT, "benchmarks", "corpus")
+
+SITE_VARIANTS = ["shopify", "shopify", "shopify_slow", "shopify_waf", "non_shopify"]
+
+SHOPIFY_PAGES = {
+    "/policies/shipping-policy": "shopify_shipping_policy.html",
+    "/policies/refund-policy": "shopify_refund_policy.html",
+    "/pages/faq": "shopify_faq.html",
+}
+
+WAF_PAGE = "<html><head><title>Access Denied</title></head><body><h1>Access Denied</h1>" \
+           "<p>You don't have permission to access this page. Reference #18.4f2a3b17</p></body></html>"
+
+
+@dataclass
+class FakeConfig:
+    site_port: int = 8101
+    openai_port: int = 8102
+    firecrawl_port: int = 8103
+    site_latency: float = 0.05
+    slow_site_latency: float = 3.0
+    openai_latency: float = 1.5
+    openai_jitter: float = 0.5
+    firecrawl_latency: float = 0.8
+
+
+def store_url(index: int, port: int) -> str:
+    """Base URL of the index-th store of the farm (127.0.1.1, 127.0.1.2, ...)"""
+    return f"http://127.0.1.{index % 254 + 1}:{port}/"
+
+
+def store_variant(host: str) -> str:
+    """Variant served for a Host header (127.0.1.N[:port]); anything else is a plain Shopify store"""
+    try:
+        last_octet = int(ip_address(host.rsplit(":", 1)[0]).packed[-1])
+    except ValueError:
+        return "shopify"
+    return SITE_VARIANTS[(last_octet - 1) % len(SITE_VARIANTS)]
+
+
+def _load_corpus() -> Dict[str, str]:
+    pages = {}
+    for name in os.listdir(CORPUS_DIR):
+        if name.endswith(".html"):
+            with open(os.path.join(CORPUS_DIR, name), encoding="utf-8") as f:
+                pages[name] = f.read()
+    return pages
+
+
+def _jittered(latency: float, jitter: float = 0.0) -> float:
+    return max(0.0, latency + random.uniform(-jitter, jitter))
+
+
+def create_site_app(config: FakeConfig) -> FastAPI:
+    app = FastAPI(title="site farm")
+    corpus = _load_corpus()
+    shopify_headers = {"x-shopify-stage": "production", "x-sorting-hat-shopid": "48213"}
+
+    @app.api_route("/{path:path}", methods=["GET", "HEAD"])
+    async def page(path: str, request: Request):
+        variant = store_variant(request.headers.get("host", ""))
+        path = "/" + path.rstrip("/") if path.strip("/") else "/"
+        await asyncio.sleep(config.slow_site_latency if variant == "shopify_slow" else config.site_latency)
+
+        if variant == "non_shopify":
+            if path == "/":
+                return HTMLResponse(corpus["bestbuy_help_returns.html"])
+            return HTMLResponse(corpus["generic_404.html"], status_code=404)
+
+        if path == "/":
+            return HTMLResponse("<html><body><h1>Store</h1></body></html>", headers=shopify_headers)
+        if path in SHOPIFY_PAGES:
+            if variant == "shopify_waf":
+                return HTMLResponse(WAF_PAGE, status_code=403)
+            return HTMLResponse(corpus[SHOPIFY_PAGES[path]], headers=shopify_headers)
+        return HTMLResponse(corpus["shopify_404.html"], status_code=404, headers=shopify_headers)
+
+    return app
+
+
+def _tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def _policy_arguments(domain: str) -> Dict[str, str]:
+    base = f"https://{domain}"
+    return {
+        "domain": domain,
+        "shipping_policy": "FREE standard shipping (3-5 business days) on orders over $50, otherwise $5.95. "
+                           "Express shipping (1-2 business days) costs $14.95.",
+        "shipping_url": f"{base}/policies/shipping-policy",
+        "return_policy": "Returns accepted within 30 days of delivery for unworn items with tags attached. "
+                         "Refunds are issued to the original payment method within 5-7 business days.",
+        "return_url": f"{base}/policies/refund-policy",
+        "self_help_returns": "Yes - customers can start a return online through the returns portal",
+        "self_help_url": f"{base}/pages/returns",
+        "insurance": "Yes - Route package protection is offered at checkout",
+        "insurance_url": f"{base}/pages/faq",
+    }
+
+
+def create_openai_app(config: FakeConfig) -> FastAPI:
+    app = FastAPI(title="fake openai")
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        prompt = "\n".join(str(message.get("content") or "") for message in body.get("messages", []))
+        await asyncio.sleep(_jittered(config.openai_latency, config.openai_jitter))
+
+        message = {"role": "assistant", "content": None}
+        finish_reason = "stop"
+        if body.get("tools"):
+            match = re.search(r"Domain: (\S+)", prompt)
+            arguments = json.dumps(_policy_arguments(match.group(1) if match else "unknown"))
+            message["tool_calls"] = [{
+                "id": f"call_{random.getrandbits(48):012x}", "type": "function",
+                "function": {"name": "extract_ecommerce_policies", "arguments": arguments},
+            }]
+            finish_reason = "tool_calls"
+            completion = arguments
+        elif "YES or NO" in prompt:
+            completion = "YES"
+        elif "Priority order" in prompt:
+            count = len(re.findall(r"^\d+\. ", prompt, flags=re.MULTILINE))
+            completion = ",".join(str(i) for i in range(1, count + 1))
+        else:
+            completion = "Returns accepted within 30 days; free return shipping with the prepaid label."
+        if message.get("tool_calls") is None:
+            message["content"] = completion
+
+        usage = {"prompt_tokens": _tokens(prompt), "completion_tokens": _tokens(completion)}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        return {
+            "id": f"chatcmpl-{random.getrandbits(64):016x}", "object": "chat.completion",
+            "created": 0, "model": body.get("model", "gpt-4"),
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+            "usage": usage,
+        }
+
+    return app
+
+
+def _search_results(query: str) -> List[Dict[str, str]]:
+    """Three results on the queried domain (last word of the query), like a real web search"""
+    domain = query.split()[-1] if query.split() else "example.com"
+    topic = " ".join(query.split()[:-1]) or "help"
+    return [
+        {"url": f"http://{domain}/policies/refund-policy", "title": f"Return policy - {domain}",
+         "description": f"Our {topic}: returns & refunds within 30 days. Start a return online."},
+        {"url": f"http://{domain}/policies/shipping-policy", "title": f"Shipping policy - {domain}",
+         "description": f"{topic}: free shipping over $50, delivery in 3-5 business days."},
+        {"url": f"http://{domain}/pages/faq", "title": f"FAQ - {domain}",
+         "description": f"{topic}: protection plan, warranty and package insurance questions."},
+    ]
+
+
+def create_firecrawl_app(config: FakeConfig) -> FastAPI:
+    app = FastAPI(title="fake firecrawl")
+    corpus = _load_corpus()
+
+    @app.post("/v2/search")
+    async def search(request: Request):
+        body = await request.json()
+        await asyncio.sleep(_jittered(config.firecrawl_latency, config.firecrawl_latency / 4))
+        results = _search_results(str(body.get("query", "")))[: int(body.get("limit") or 3)]
+        return {"success": True, "data": {"web": results}}
+
+    @app.post("/v2/scrape")
+    async def scrape(request: Request):
+        body = await request.json()
+        await asyncio.sleep(_jittered(config.firecrawl_latency, config.firecrawl_latency / 4))
+        url = str(body.get("url", ""))
+        page = next((name for path, name in SHOPIFY_PAGES.items() if url.rstrip("/").endswith(path)),
+                    "bestbuy_help_returns.html")
+        # Pas de vrai rendu markdown : le texte brut de la page suffit pour l'extraction
+        text = re.sub(r"\s+", " ", re.sub(r"<[^>]+>", " ", corpus[page])).strip()
+        return {"success": True, "data": {"markdown": text, "metadata": {"sourceURL": url, "statusCode": 200}}}
+
+    return app
+
+
+async def serve(config: FakeConfig, ready: asyncio.Event = None, stop: asyncio.Event = None) -> None:
+    """Run the three fakes until `stop` is set (or the task is cancelled)"""
+    servers = [
+        uvicorn.Server(uvicorn.Config(create_site_app(config), host="0.0.0.0", port=config.site_port,
+                                      log_level="warning", backlog=2048)),
+        uvicorn.Server(uvicorn.Config(create_openai_app(config), host="127.0.0.1", port=config.openai_port,
+                                      log_level="warning")),
+        uvicorn.Server(uvicorn.Config(create_firecrawl_app(config), host="127.0.0.1", port=config.firecrawl_port,
+                                      log_level="warning")),
+    ]
+    tasks = [asyncio.create_task(server.serve()) for server in servers]
+    while not all(server.started for server in servers):
+        if any(task.done() for task in tasks):
+            break
+        await asyncio.sleep(0.05)
+    if ready is not None:
+        ready.set()
+    try:
+        if stop is not None:
+            await stop.wait()
+        else:
+            await asyncio.gather(*tasks)
+    finally:
+        for server in servers:
+            server.should_exit = True
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    defaults = FakeConfig()
+    parser.add_argument("--site-port", type=int, default=defaults.site_port)
+    parser.add_argument("--openai-port", type=int, default=defaults.openai_port)
+    parser.add_argument("--firecrawl-port", type=int, default=defaults.firecrawl_port)
+    parser.add_argument("--site-latency", type=float, default=defaults.site_latency, help="seconds per page")
+    parser.add_argument("--slow-site-latency", type=float, default=defaults.slow_site_latency,
+                        help="seconds per page for the shopify_slow stores")
+    parser.add_argument("--openai-latency", type=float, default=defaults.openai_latency, help="seconds per completion")
+    parser.add_argument("--openai-jitter", type=float, default=defaults.openai_jitter, help="+/- seconds")
+    parser.add_argument("--firecrawl-latency", type=float, default=defaults.firecrawl_latency,
+                        help="seconds per search/scrape")
+
+
+def config_from_args(args: argparse.Namespace) -> FakeConfig:
+    return FakeConfig(**{field: getattr(args, field) for field in FakeConfig.__dataclass_fields__})
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_arguments(parser)
+    config = config_from_args(parser.parse_args())
+    print(f"🏬 Site farm:  {store_url(0, config.site_port)} ... (variants: {', '.join(SITE_VARIANTS)})")
+    print(f"🤖 OpenAI:     http://127.0.0.1:{config.openai_port}/v1")
+    print(f"🔥 Firecrawl:  http://127.0.0.1:{config.firecrawl_port}")
+    try:
+        asyncio.run(serve(config))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+End-to-end load test: jobs per minute and job latency without real API credits.
+
+Starts the local stand-ins (loadtest/fakes.py) and the API itself with OpenAI,
+Firecrawl and a throwaway database pointed at them, then submits POST /analyze
+open-loop at --rate jobs/minute for --duration seconds over the store farm,
+waits for the jobs to finish and reports:
+
+- submitted / completed / failed and throughput (completed jobs per minute),
+- p50 / p95 / p99 job latency (server-side created_at -> completed_at),
+- per-stage breakdown from each job's trace (GET /job/{id}/trace): time per job
+  spent in each span name, p50 / p95 over jobs.
+
+    python loadtest/run.py --rate 30 --duration 120
+    python loadtest/run.py --rate 60 --duration 300 --workers 4          # gunicorn
+    python loadtest/run.py --openai-latency 4 --slow-site-latency 8 --json
+    python loadtest/run.py --no-spawn-app --app-url http://127.0.0.1:8000   # server already started with the env printed by fakes.py
+
+Needs Linux (the store farm uses 127.0.1.N loopback addresses).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fakes import SITE_VARIANTS, add_arguments, config_from_args, serve, store_url, store_variant  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+POLL_INTERVAL = 1.0
+
+
+def _default_renderer() -> str:
+    try:
+        import playwright  # noqa: F401
+        return "playwright"
+    except ImportError:
+        return "requests"
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(q / 100 * len(values) + 0.5) - 1))
+    return round(values[index], 2)
+
+
+def _parse_time(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value.rstrip("Z")) if value else None
+
+
+def app_env(args, workdir: str) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.update({
+        "OPENAI_API_KEY": "fake",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{args.openai_port}/v1",
+        "FIRECRAWL_API_KEY": "fake",
+        "FIRECRAWL_API_URL": f"http://127.0.0.1:{args.firecrawl_port}",
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'loadtest.db')}",
+        "LLM_LIMITER_PATH": os.path.join(workdir, "llm_limiter.sqlite"),
+        "HOST_HEALTH_PATH": os.path.join(workdir, "host_health.sqlite"),
+        "BROWSER_SESSION_PATH": os.path.join(workdir, "browser_sessions.sqlite"),
+        "SCRAPE_RENDERER": args.renderer,
+        "PYTHONUNBUFFERED": "1",
+    })
+    if args.page_delay is not None:
+        env["SCRAPE_PAGE_DELAY_SECONDS"] = str(args.page_delay)
+    if args.workers > 1:
+        env["PROMETHEUS_MULTIPROC_DIR"] = os.path.join(workdir, "prometheus")
+        env["WEB_CONCURRENCY"] = str(args.workers)
+    return env
+
+
+def spawn_app(args, workdir: str) -> subprocess.Popen:
+    if args.workers > 1:
+        command = [sys.executable, "-m", "gunicorn", "main:app", "-c", "gunicorn.conf.py",
+                   "--bind", f"127.0.0.1:{args.app_port}", "--workers", str(args.workers)]
+    else:
+        command = [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(args.app_port)]
+    log = open(os.path.join(workdir, "app.log"), "w")
+    print(f"🚀 Starting API: {' '.join(command[1:])} (log: {log.name})")
+    return subprocess.Popen(command, cwd=ROOT, env=app_env(args, workdir), stdout=log, stderr=subprocess.STDOUT)
+
+
+async def wait_for_app(client: httpx.AsyncClient, app: Optional[subprocess.Popen], timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if app is not None and app.poll() is not None:
+            raise RuntimeError(f"API exited with code {app.returncode} (see app.log)")
+        try:
+            if (await client.get("/")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.5)
+    raise RuntimeError(f"API not ready after {timeout:.0f}s")
+
+
+async def submit(client: httpx.AsyncClient, url: str, jobs: List[Dict]) -> None:
+    job = {"url": url, "variant": store_variant(url.split("/")[2]), "submitted": time.monotonic()}
+    try:
+        response = await client.post("/analyze", json={"url": url})
+        if response.status_code == 200:
+            job["job_id"] = response.json()["job_id"]
+        else:
+            job["status"] = f"rejected_{response.status_code}"
+    except httpx.HTTPError as e:
+        job["status"] = f"error_{type(e).__name__}"
+    jobs.append(job)
+
+
+async def drive(client: httpx.AsyncClient, args) -> List[Dict]:
+    """Open-loop arrivals: submissions don't wait for earlier jobs (unlike a closed loop that hides queueing)"""
+    jobs: List[Dict] = []
+    interval = 60.0 / args.rate
+    started = time.monotonic()
+    pending = set()
+    index = 0
+    while time.monotonic() - started < args.duration:
+        url = store_url(index, args.site_port)
+        pending.add(asyncio.create_task(submit(client, url, jobs)))
+        index += 1
+        next_at = started + index * interval
+        await asyncio.sleep(max(0.0, next_at - time.monotonic()))
+    await asyncio.gather(*pending)
+    print(f"📨 Submitted {len(jobs)} jobs in {time.monotonic() - started:.0f}s")
+    return jobs
+
+
+async def collect(client: httpx.AsyncClient, jobs: List[Dict], drain_timeout: float) -> None:
+    """Poll until every accepted job completed/failed or the drain timeout expires"""
+    deadline = time.monotonic() + drain_timeout
+    waiting = [job for job in jobs if "job_id" in job]
+    while waiting and time.monotonic() < deadline:
+        still = []
+        for job in waiting:
+            try:
+                data = (await client.get(f"/job/{job['job_id']}")).json()
+            except (httpx.HTTPError, ValueError):
+                still.append(job)
+                continue
+            if data.get("status") in ("completed", "failed", "cancelled"):
+                job["status"] = data["status"]
+                created, completed = _parse_time(data.get("created_at")), _parse_time(data.get("completed_at"))
+                if created and completed:
+                    job["latency"] = (completed - created).total_seconds()
+                job["stages"] = await _stage_breakdown(client, job["job_id"])
+            else:
+                still.append(job)
+        waiting = still
+        if waiting:
+            print(f"⏳ {len(waiting)} jobs still running...", end="\r")
+            await asyncio.sleep(POLL_INTERVAL)
+    for job in waiting:
+        job["status"] = "timeout"
+    print()
+
+
+async def _stage_breakdown(client: httpx.AsyncClient, job_id: str) -> Dict[str, float]:
+    """Seconds spent per span name in one job (spans of the same name summed, root excluded)"""
+    try:
+        response = await client.get(f"/job/{job_id}/trace")
+        if response.status_code != 200:
+            return {}
+        spans = response.json()["spans"]
+    except (httpx.HTTPError, ValueError, KeyError):
+        return {}
+    totals: Dict[str, float] = defaultdict(float)
+    for s in spans:
+        if s["depth"] > 0:
+            totals[s["name"]] += s["duration_ms"] / 1000
+    return dict(totals)
+
+
+def summarize(jobs: List[Dict], args, elapsed: float) -> Dict:
+    statuses = Counter(job.get("status", "unknown") for job in jobs)
+    latencies = [job["latency"] for job in jobs if job.get("status") == "completed" and "latency" in job]
+    per_stage: Dict[str, List[float]] = defaultdict(list)
+    for job in jobs:
+        for name, seconds in job.get("stages", {}).items():
+            per_stage[name].append(seconds)
+    by_variant: Dict[str, Counter] = defaultdict(Counter)
+    for job in jobs:
+        by_variant[job["variant"]][job.get("status", "unknown")] += 1
+
+    return {
+        "config": {"rate_per_min": args.rate, "duration_s": args.duration, "workers": args.workers,
+                   "renderer": args.renderer, "openai_latency_s": args.openai_latency,
+                   "firecrawl_latency_s": args.firecrawl_latency, "site_latency_s": args.site_latency},
+        "submitted": len(jobs),
+        "completed": statuses.get("completed", 0),
+        "failed": statuses.get("failed", 0),
+        "statuses": dict(statuses),
+        "elapsed_s": round(elapsed, 1),
+        "throughput_jobs_per_min": round(statuses.get("completed", 0) / elapsed * 60, 2) if elapsed else 0,
+        "latency_s": {"p50": _percentile(latencies, 50), "p95": _percentile(latencies, 95),
+                      "p99": _percentile(latencies, 99), "max": round(max(latencies), 2) if latencies else None},
+        "stages_s": {
+            name: {"jobs": len(values), "p50": _percentile(values, 50), "p95": _percentile(values, 95)}
+            for name, values in sorted(per_stage.items(), key=lambda item: -sum(item[1]))
+        },
+        "by_variant": {variant: dict(counts) for variant, counts in by_variant.items()},
+    }
+
+
+def print_report(report: Dict) -> None:
+    latency = report["latency_s"]
+    print("\n📊 Load test results")
+    print(f"   Jobs:        {report['submitted']} submitted, {report['completed']} completed, "
+          f"{report['failed']} failed  {report['statuses']}")
+    print(f"   Throughput:  {report['throughput_jobs_per_min']} jobs/min over {report['elapsed_s']}s "
+          f"(target {report['config']['rate_per_min']}/min)")
+    print(f"   Latency:     p50 {latency['p50']}s  p95 {latency['p95']}s  p99 {latency['p99']}s  max {latency['max']}s")
+    print("   By store:    " + "  ".join(f"{variant} {dict(counts)}" for variant, counts in report["by_variant"].items()))
+    print(f"\n   {'stage (per job)':<28} {'jobs':>5} {'p50 s':>8} {'p95 s':>8}")
+    for name, row in report["stages_s"].items():
+        print(f"   {name:<28} {row['jobs']:>5} {row['p50']:>8} {row['p95']:>8}")
+
+
+async def run(args) -> Dict:
+    app = None
+    workdir = tempfile.mkdtemp(prefix="loadtest_")
+    fakes_ready, fakes_stop = asyncio.Event(), asyncio.Event()
+    fakes = asyncio.create_task(serve(config_from_args(args), fakes_ready, fakes_stop))
+    try:
+        await fakes_ready.wait()
+        if not args.no_spawn_app:
+            app = spawn_app(args, workdir)
+        async with httpx.AsyncClient(base_url=args.app_url or f"http://127.0.0.1:{args.app_port}",
+                                     timeout=30) as client:
+            await wait_for_app(client, app)
+            started = time.monotonic()
+            jobs = await drive(client, args)
+            await collect(client, jobs, args.drain_timeout)
+            return summarize(jobs, args, time.monotonic() - started)
+    finally:
+        if app is not None:
+            app.terminate()
+            try:
+                app.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                app.kill()
+        fakes_stop.set()
+        await fakes
+        if args.keep_workdir:
+            print(f"📁 Kept {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=float, default=30, help="jobs submitted per minute")
+    parser.add_argument("--duration", type=float, default=120, help="seconds of submissions")
+    parser.add_argument("--drain-timeout", type=float, default=600, help="seconds to wait for jobs after the last one")
+    parser.add_argument("--workers", type=int, default=1, help=">1 runs gunicorn with that many workers")
+    parser.add_argument("--app-port", type=int, default=8100)
+    parser.add_argument("--app-url", help="API base URL (with --no-spawn-app)")
+    parser.add_argument("--no-spawn-app", action="store_true", help="drive an API that is already running")
+    parser.add_argument("--renderer", choices=["playwright", "requests"], default=_default_renderer(),
+                        help="SCRAPE_RENDERER of the spawned API (default: playwright if installed)")
+    parser.add_argument("--page-delay", type=float, help="SCRAPE_PAGE_DELAY_SECONDS of the spawned API")
+    parser.add_argument("--keep-workdir", action="store_true", help="keep the temp database and app.log")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    add_arguments(parser)
+    args = parser.parse_args()
+    if args.no_spawn_app and not args.app_url:
+        parser.error("--no-spawn-app needs --app-url")
+    if args.rate <= 0:
+        parser.error("--rate must be positive")
+
+    print(f"🏬 {len(SITE_VARIANTS)} store variants cycled over 127.0.1.N:{args.site_port}: {', '.join(SITE_VARIANTS)}")
+    report = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,48 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks, Request
+from fastapi import FastAPI, HTTPException, Request, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel, HttpUrl
+from pydantic import BaseModel, Field, HttpUrl
 from typing import Optional, List
 from urllib.parse import urlparse
+from datetime import datetime
 import asyncio
+import hmac
 import os
+import time
+import uuid
 from dotenv import load_dotenv
+from sqlalchemy import select, delete, func, update
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from database import init_db, get_db
+from database import init_db, close_db, get_db, SessionLocal
 from models import AnalysisResult, AnalysisJob
-from scraper import EcommerceScraper
-from analyzer import PolicyAnalyzer
+from stats import (
+    read_stats, read_daily_series, read_firecrawl_stats, read_weak_fields, record_result_removed,
+    record_results_cleared, record_job_finished, record_field_outcomes,
+)
+from result_store import save_result, prune_history, read_history
+from search import search_policies
+from facts import FACT_FIELDS, FACT_GROUPS, extract_facts, fact_filters, aggregate_facts
+from exporter import result_filters, resolve_delimiter, iter_result_rows, iter_csv, iter_ndjson
+from llm_limiter import get_limiter
+from host_health import get_host_health
+from clients import init_clients, get_clients, close_clients
+from metrics import JOBS, JOB_SECONDS, JOBS_RUNNING, render_metrics, stage
+from deadline import BudgetExhausted, cancel_running_job, job_budget
+from executors import run_bookkeeping, shutdown_executors
+from checkpoints import (
+    JOB_HEARTBEAT_SECONDS, JOB_STALE_SECONDS, checkpoint, clear_checkpoints, load_checkpoints, prune_checkpoints,
+    recover_stale_jobs, save_checkpoint, touch_job, use_checkpoints,
+)
+from admission import AdmissionRejected, check_admission
+from scheduler import (
+    JOB_PRIORITY_BATCH, JOB_PRIORITY_INTERACTIVE, enqueue_jobs, estimate_requeued, run_cost_class, start_scheduler,
+    stop_scheduler, wake_scheduler,
+)
+from tracing import chrome_trace, load_trace, running_trace, span, start_trace, trace_timeline
+from profiler import ProfilerBusy, collapsed, sample, top_functions
+from scraper import SCRAPE_RENDERER
 
 load_dotenv()
 
@@ -40,6 +70,20 @@ app.add_middleware(
     expose_headers=["*"],
 )
 
+# Debug endpoints (/debug/*) are disabled unless DEBUG_TOKEN is set
+DEBUG_TOKEN = os.getenv("DEBUG_TOKEN")
+# How often a running job checks whether another worker cancelled it (0 = only same-worker cancels)
+JOB_CANCEL_POLL_SECONDS = float(os.getenv("JOB_CANCEL_POLL_SECONDS", 2))
+BATCH_MAX_URLS = int(os.getenv("BATCH_MAX_URLS", 5000))
+
+def require_debug_token(request: Request):
+    """X-Debug-Token: <token> or Authorization: Bearer <token>"""
+    if not DEBUG_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    supplied = request.headers.get("x-debug-token") or request.headers.get("authorization", "").removeprefix("Bearer ").strip()
+    if not hmac.compare_digest(supplied.encode(), DEBUG_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid debug token")
+
 # Add CORS handling middleware BEFORE request logging
 @app.middleware("http")
 async def cors_handler(request: Request, call_next):
@@ -76,6 +120,21 @@ async def log_requests(request: Request, call_next):
 
 class AnalyzeRequest(BaseModel):
     url: HttpUrl
+    # Default and ceiling JOB_PRIORITY_INTERACTIVE: a caller can only lower its own job
+    priority: Optional[int] = Field(None, ge=JOB_PRIORITY_BATCH, le=JOB_PRIORITY_INTERACTIVE)
+
+class BatchAnalyzeRequest(BaseModel):
+    urls: List[HttpUrl]
+    # Default JOB_PRIORITY_BATCH, always below interactive requests (X-Submitter is not authenticated)
+    priority: Optional[int] = Field(None, ge=JOB_PRIORITY_BATCH, le=JOB_PRIORITY_INTERACTIVE - 1)
+
+def _too_busy(e: AdmissionRejected) -> HTTPException:
+    return HTTPException(status_code=429, detail=f"Too busy: {e}", headers={"Retry-After": str(e.retry_after)})
+
+def _submitter(http_request: Request) -> Optional[str]:
+    """Fair-share key: X-Submitter header, else the client address"""
+    submitter = http_request.headers.get("x-submitter") or (http_request.client.host if http_request.client else None)
+    return submitter[:100] if submitter else None
 
 class AnalysisResponse(BaseModel):
     job_id: str
@@ -85,16 +144,41 @@ class AnalysisResponse(BaseModel):
 @app.on_event("startup")
 async def startup():
     await init_db()
-    
-    # Install Playwright browsers for production
-    import subprocess
-    import sys
     try:
-        subprocess.run([sys.executable, "-m", "playwright", "install", "chromium"], 
-                      check=True, capture_output=True)
-        print("✅ Playwright browsers installed successfully")
-    except Exception as e:
-        print(f"⚠️ Playwright browser installation warning: {e}")
+        init_clients()
+    except ValueError as e:
+        # Keep serving stats/results/exports: each job retries get_clients() and fails on its own
+        print(f"⚠️ Shared clients unavailable, analysis jobs will fail until configured: {e}")
+    
+    # Apply the history retention policy to the whole archive once per start
+    async with SessionLocal() as db:
+        await prune_history(db)
+        await prune_checkpoints(db)
+        await db.commit()
+    
+    # Pick up jobs orphaned by a worker that died (recycling, deploys); they resume from their checkpoints
+    app.state.recovery = asyncio.create_task(_recover_jobs_forever())
+    # Run queued jobs (this worker's share of them), see scheduler.py
+    start_scheduler(process_website)
+    
+    # Install Playwright browsers for production (with SCRAPE_RENDERER=service, render_worker.py does it)
+    if SCRAPE_RENDERER == "playwright":
+        import subprocess
+        import sys
+        try:
+            subprocess.run([sys.executable, "-m", "playwright", "install", "chromium"], 
+                          check=True, capture_output=True)
+            print("✅ Playwright browsers installed successfully")
+        except Exception as e:
+            print(f"⚠️ Playwright browser installation warning: {e}")
+
+@app.on_event("shutdown")
+async def shutdown():
+    app.state.recovery.cancel()
+    await stop_scheduler()
+    await close_clients()
+    shutdown_executors()
+    await close_db()
 
 @app.get("/")
 async def root():
@@ -115,29 +199,60 @@ async def handle_cors_preflight():
     )
 
 @app.post("/analyze", response_model=AnalysisResponse)
-async def analyze_website(request: AnalyzeRequest, background_tasks: BackgroundTasks):
+async def analyze_website(request: AnalyzeRequest, http_request: Request, db: AsyncSession = Depends(get_db)):
     """Analyze a website's shipping and return policies"""
+    priority = request.priority if request.priority is not None else JOB_PRIORITY_INTERACTIVE
+    try:
+        await check_admission(db, 1, JOB_PRIORITY_INTERACTIVE if priority >= JOB_PRIORITY_INTERACTIVE else None)
+    except AdmissionRejected as e:
+        raise _too_busy(e)
     try:
         # TEMPORARILY DISABLED: Prevent duplicate analyses for the same domain in quick succession
         # (Disabled for testing - will re-enable later)
         
-        # Create a new job
-        job_id = await create_analysis_job(str(request.url))
-        background_tasks.add_task(process_website, job_id, str(request.url))
+        # Queue the job; interactive requests go ahead of batches (scheduler.py)
+        job, = await enqueue_jobs(db, [str(request.url)], priority=priority, submitter=_submitter(http_request))
         
         return AnalysisResponse(
-            job_id=job_id,
+            job_id=job.id,
             status="started",
             message="Analysis started successfully"
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to start analysis: {str(e)}")
 
+@app.post("/analyze/batch")
+async def analyze_batch(request: BatchAnalyzeRequest, http_request: Request, db: AsyncSession = Depends(get_db)):
+    """Queue many websites at once; they share the submitter's fair share and yield to interactive requests"""
+    if not request.urls:
+        raise HTTPException(status_code=400, detail="urls is empty")
+    if len(request.urls) > BATCH_MAX_URLS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_URLS} URLs per batch")
+    try:
+        await check_admission(db, len(request.urls))
+    except AdmissionRejected as e:
+        raise _too_busy(e)
+    batch_id = str(uuid.uuid4())
+    priority = request.priority if request.priority is not None else JOB_PRIORITY_BATCH
+    jobs = await enqueue_jobs(db, [str(url) for url in request.urls], priority=priority,
+                              submitter=_submitter(http_request), batch_id=batch_id)
+    return {"batch_id": batch_id, "status": "queued", "job_ids": [job.id for job in jobs]}
+
+@app.get("/batch/{batch_id}")
+async def get_batch_status(batch_id: str, db: AsyncSession = Depends(get_db)):
+    """Job counts per status for a batch"""
+    rows = (await db.execute(
+        select(AnalysisJob.status, func.count()).where(AnalysisJob.batch_id == batch_id).group_by(AnalysisJob.status)
+    )).all()
+    if not rows:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    counts = dict(rows)
+    return {"batch_id": batch_id, "total": sum(counts.values()), "statuses": counts}
+
 @app.get("/job/{job_id}")
-async def get_job_status(job_id: str):
+async def get_job_status(job_id: str, db: AsyncSession = Depends(get_db)):
     """Get the status of an analysis job"""
-    db = next(get_db())
-    job = db.query(AnalysisJob).filter(AnalysisJob.id == job_id).first()
+    job = await db.get(AnalysisJob, job_id)
     
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
@@ -148,14 +263,91 @@ async def get_job_status(job_id: str):
         "status": job.status,
         "created_at": job.created_at,
         "completed_at": job.completed_at,
-        "error_message": job.error_message
+        "error_message": job.error_message,
+        "priority": job.priority,
+        "batch_id": job.batch_id,
+        "cost_class": job.cost_class,
+        "expected_seconds": job.expected_seconds,
+        "started_at": job.started_at,
     }
 
+@app.post("/job/{job_id}/cancel")
+async def cancel_job(job_id: str, db: AsyncSession = Depends(get_db)):
+    """Cancel a pending or running job: in-flight work stops, browsers close, status becomes 'cancelled'"""
+    job = await db.get(AnalysisJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.status not in ("pending", "processing"):
+        raise HTTPException(status_code=409, detail=f"Job already {job.status}")
+    
+    queued = job.status == "pending"
+    job.status = "cancelled"
+    job.error_message = "Cancelled by request"
+    job.completed_at = datetime.utcnow()
+    await db.commit()
+    if queued:
+        # Never dispatched: the scheduler only claims pending jobs
+        JOBS.labels(outcome="cancelled", method="none").inc()
+    # Running in this worker: stop it now; elsewhere its worker sees the status within JOB_CANCEL_POLL_SECONDS
+    stopped_here = cancel_running_job(job_id)
+    return {"job_id": job_id, "status": "cancelled", "stopped_here": stopped_here}
+
+@app.post("/job/{job_id}/retry")
+async def retry_job(job_id: str, db: AsyncSession = Depends(get_db)):
+    """Run a failed or cancelled job again; stages it already completed are restored from their checkpoints"""
+    job = await db.get(AnalysisJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.status not in ("failed", "cancelled"):
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}")
+    
+    job.status = "pending"
+    job.error_message = None
+    job.completed_at = None
+    job.heartbeat_at = None
+    job.started_at = None
+    job.attempts += 1
+    await estimate_requeued(db, job)
+    await db.commit()
+    wake_scheduler()
+    return {"job_id": job_id, "status": "pending", "attempts": job.attempts}
+
+@app.get("/job/{job_id}/trace")
+async def get_job_trace(job_id: str, format: str = "timeline", db: AsyncSession = Depends(get_db)):
+    """Span timeline of a finished job; format=chrome downloads Chrome trace events (chrome://tracing, Perfetto)"""
+    if format not in ("timeline", "chrome"):
+        raise HTTPException(status_code=400, detail="format must be 'timeline' or 'chrome'")
+    row = (await db.execute(select(AnalysisJob.id, AnalysisJob.trace).where(AnalysisJob.id == job_id))).first()
+    if not row:
+        raise HTTPException(status_code=404, detail="Job not found")
+    trace = load_trace(row.trace)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="No trace recorded for this job (not finished yet)")
+    
+    if format == "chrome":
+        return JSONResponse(
+            chrome_trace(trace, job_id),
+            headers={"Content-Disposition": f'attachment; filename="trace-{job_id}.json"'},
+        )
+    return {"job_id": job_id, **trace_timeline(trace)}
+
 @app.get("/results")
-async def get_all_results():
-    """Get all analysis results"""
-    db = next(get_db())
-    results = db.query(AnalysisResult).all()
+async def get_all_results(domain: Optional[str] = None, since: Optional[datetime] = None,
+                          until: Optional[datetime] = None, limit: Optional[int] = None,
+                          offset: int = 0, db: AsyncSession = Depends(get_db)):
+    """Get all analysis results
+
+    Query params:
+    - domain: substring match on the domain (case-insensitive).
+    - since / until: ISO datetimes bounding analyzed_at (since inclusive, until exclusive).
+    - limit / offset: optional pagination.
+    """
+    query = select(AnalysisResult).where(*result_filters(domain, since, until)).order_by(AnalysisResult.id)
+    if offset:
+        query = query.offset(offset)
+    if limit is not None:
+        query = query.limit(limit)
+    results = (await db.scalars(query)).all()
     
     return [
         {
@@ -175,10 +367,9 @@ async def get_all_results():
     ]
 
 @app.get("/results/{result_id}")
-async def get_result(result_id: int):
+async def get_result(result_id: int, db: AsyncSession = Depends(get_db)):
     """Get a specific analysis result"""
-    db = next(get_db())
-    result = db.query(AnalysisResult).filter(AnalysisResult.id == result_id).first()
+    result = await db.get(AnalysisResult, result_id)
     
     if not result:
         raise HTTPException(status_code=404, detail="Result not found")
@@ -194,194 +385,411 @@ async def get_result(result_id: int):
         "self_help_url": result.self_help_url,
         "insurance": result.insurance,
         "insurance_url": result.insurance_url,
-        "analyzed_at": result.analyzed_at
+        "analyzed_at": result.analyzed_at,
+        "facts": {field: getattr(result, field) for field in FACT_FIELDS}
     }
 
+@app.get("/history/{domain}")
+async def get_result_history(domain: str, limit: int = 20, db: AsyncSession = Depends(get_db)):
+    """Get archived (superseded) results for a domain, newest first"""
+    versions = await read_history(db, domain, limit)
+    
+    return [
+        {
+            "id": version.id,
+            "result_id": version.result_id,
+            "domain": version.domain,
+            "shipping_policy": version.shipping_policy,
+            "shipping_url": version.shipping_url,
+            "return_policy": version.return_policy,
+            "return_url": version.return_url,
+            "self_help_returns": version.self_help_returns,
+            "self_help_url": version.self_help_url,
+            "insurance": version.insurance,
+            "insurance_url": version.insurance_url,
+            "analyzed_at": version.analyzed_at,
+            "archived_at": version.archived_at
+        }
+        for version in versions
+    ]
+
+@app.get("/search")
+async def search_results(q: str, limit: int = 20, offset: int = 0, db: AsyncSession = Depends(get_db)):
+    """Ranked full-text search over policy text, with highlighted snippets"""
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="Query must not be empty")
+    return await search_policies(db, q, min(max(limit, 1), 100), max(offset, 0))
+
+@app.get("/facts")
+async def get_policy_facts(min_return_days: Optional[int] = None, max_return_days: Optional[int] = None,
+                           max_free_shipping: Optional[float] = None, currency: Optional[str] = None,
+                           max_standard_days: Optional[int] = None, max_express_days: Optional[int] = None,
+                           restocking_fee: Optional[bool] = None, insurance_provider: Optional[str] = None,
+                           limit: int = 100, offset: int = 0, db: AsyncSession = Depends(get_db)):
+    """Sites matching structured policy facts
+
+    e.g. /facts?min_return_days=60 or /facts?max_free_shipping=50&currency=USD
+    (a threshold of 0 means free shipping on every order).
+    """
+    filters = fact_filters(min_return_days, max_return_days, max_free_shipping, currency,
+                           max_standard_days, max_express_days, restocking_fee, insurance_provider)
+    query = (
+        select(AnalysisResult.id, AnalysisResult.domain, AnalysisResult.analyzed_at,
+               *[getattr(AnalysisResult, field) for field in FACT_FIELDS])
+        .where(*filters)
+        .order_by(AnalysisResult.id)
+        .offset(max(offset, 0))
+        .limit(min(max(limit, 1), 1000))
+    )
+    total = await db.scalar(select(func.count(AnalysisResult.id)).where(*filters))
+    rows = (await db.execute(query)).mappings().all()
+    
+    return {"total": total, "limit": limit, "offset": offset, "results": [dict(row) for row in rows]}
+
+@app.get("/facts/aggregate")
+async def get_policy_facts_aggregate(group_by: Optional[str] = None, min_return_days: Optional[int] = None,
+                                     max_return_days: Optional[int] = None, max_free_shipping: Optional[float] = None,
+                                     currency: Optional[str] = None, max_standard_days: Optional[int] = None,
+                                     max_express_days: Optional[int] = None, restocking_fee: Optional[bool] = None,
+                                     insurance_provider: Optional[str] = None, db: AsyncSession = Depends(get_db)):
+    """Count / min / avg / max of the numeric facts, optionally grouped (same filters as /facts)"""
+    if group_by and group_by not in FACT_GROUPS:
+        raise HTTPException(status_code=400, detail=f"group_by must be one of: {', '.join(FACT_GROUPS)}")
+    filters = fact_filters(min_return_days, max_return_days, max_free_shipping, currency,
+                           max_standard_days, max_express_days, restocking_fee, insurance_provider)
+    return await aggregate_facts(db, filters, group_by)
+
+async def _stream_results(filters, serialize):
+    """Run the export query on its own session, closed once the stream is exhausted"""
+    async with SessionLocal() as db:
+        async for chunk in serialize(iter_result_rows(db, filters)):
+            yield chunk
+
 @app.get("/export/csv")
-async def export_csv(sep: str | None = None, bom: bool = False):
-    """Export all results as CSV.
+async def export_csv(sep: str | None = None, bom: bool = False, domain: Optional[str] = None,
+                     since: Optional[datetime] = None, until: Optional[datetime] = None):
+    """Export results as CSV, streamed row by row.
 
     Query params:
     - sep: ',', ';', 'tab' or single-char. Defaults to ';' for better Excel compatibility.
     - bom: true/false. If true, writes UTF-8 BOM (Excel-friendly).
+    - domain, since, until: same filters as GET /results.
     """
-    import io
-    import csv
-    from fastapi.responses import StreamingResponse
-
-    db = next(get_db())
-    results = db.query(AnalysisResult).all()
-
-    # Build rows
-    headers = [
-        "domain",
-        "shipping_policy",
-        "shipping_url",
-        "return_policy",
-        "return_url",
-        "self_help_returns",
-        "self_help_url",
-        "insurance",
-        "insurance_url",
-        "analyzed_at",
-    ]
-
-    # Determine delimiter
-    def resolve_delimiter(val: str | None) -> str:
-        if not val:
-            return ';'
-        v = val.lower()
-        if v in {',', 'comma'}:
-            return ','
-        if v in {';', 'semicolon', 'semi'}:
-            return ';'
-        if v in {'tab', '\t'}:
-            return '\t'
-        # If single char provided, use it; else fallback to ';'
-        return v[0] if len(v) == 1 else ';'
-
     delimiter = resolve_delimiter(sep)
-
-    output = io.StringIO()
-    writer = csv.writer(output, delimiter=delimiter, quoting=csv.QUOTE_MINIMAL, lineterminator='\n')
-    writer.writerow(headers)
-    for r in results:
-        writer.writerow([
-            r.domain,
-            (r.shipping_policy or "").replace("\n", " "),
-            r.shipping_url or "",
-            (r.return_policy or "").replace("\n", " "),
-            r.return_url or "",
-            (r.self_help_returns or "").replace("\n", " "),
-            r.self_help_url or "",
-            (r.insurance or "").replace("\n", " "),
-            r.insurance_url or "",
-            r.analyzed_at,
-        ])
-
-    output.seek(0)
-    data_bytes = output.getvalue().encode('utf-8-sig' if bom else 'utf-8')
+    filters = result_filters(domain, since, until)
     return StreamingResponse(
-        io.BytesIO(data_bytes),
+        _stream_results(filters, lambda rows: iter_csv(rows, delimiter=delimiter, bom=bom)),
         media_type="text/csv",
         headers={"Content-Disposition": "attachment; filename=ecommerce_policies.csv"}
     )
 
+@app.get("/export/ndjson")
+async def export_ndjson(domain: Optional[str] = None, since: Optional[datetime] = None,
+                        until: Optional[datetime] = None):
+    """Export results as newline-delimited JSON (one object per line), streamed.
+
+    Query params:
+    - domain, since, until: same filters as GET /results.
+    """
+    filters = result_filters(domain, since, until)
+    return StreamingResponse(
+        _stream_results(filters, iter_ndjson),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": "attachment; filename=ecommerce_policies.ndjson"}
+    )
+
+@app.get("/export/snapshot")
+async def export_snapshot(format: str = "parquet", since: Optional[datetime] = None,
+                          compression: Optional[str] = None):
+    """Export a compressed columnar snapshot (Parquet or Arrow IPC file).
+
+    Query params:
+    - format: 'parquet' (default) or 'arrow'.
+    - since: only rows analyzed strictly after this ISO datetime (incremental pulls).
+    - compression: zstd (default), lz4 or none; for parquet also snappy, gzip or brotli.
+
+    The X-Snapshot-Watermark response header carries the max analyzed_at shipped;
+    pass it back as `since` to pull only newer rows next time.
+    """
+    import tempfile
+    from snapshot import SNAPSHOT_FORMATS, SNAPSHOT_COMPRESSION, SNAPSHOT_COMPRESSIONS, write_snapshot
+
+    if format not in SNAPSHOT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format: {format}")
+    compression = compression or SNAPSHOT_COMPRESSION
+    if compression not in SNAPSHOT_COMPRESSIONS[format]:
+        allowed = ", ".join(SNAPSHOT_COMPRESSIONS[format])
+        raise HTTPException(status_code=400, detail=f"Unsupported {format} compression: {compression} (allowed: {allowed})")
+
+    # Spool to disk past 8MB so large snapshots never sit in memory
+    spool = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+
+    try:
+        async with SessionLocal() as db:
+            stats = await write_snapshot(db, spool, fmt=format, since=since, compression=compression)
+    except Exception as e:
+        spool.close()
+        raise HTTPException(status_code=500, detail=f"Snapshot failed: {str(e)}")
+    spool.seek(0)
+
+    def stream():
+        try:
+            while chunk := spool.read(64 * 1024):
+                yield chunk
+        finally:
+            spool.close()
+
+    extension = "parquet" if format == "parquet" else "arrow"
+    headers = {
+        "Content-Disposition": f"attachment; filename=analysis_results.{extension}",
+        "X-Snapshot-Rows": str(stats["rows"]),
+    }
+    if stats["watermark"]:
+        headers["X-Snapshot-Watermark"] = stats["watermark"].isoformat()
+    media_type = "application/vnd.apache.parquet" if format == "parquet" else "application/vnd.apache.arrow.file"
+    return StreamingResponse(stream(), media_type=media_type, headers=headers)
+
 @app.delete("/results/{result_id}")
-async def delete_result(result_id: int):
+async def delete_result(result_id: int, db: AsyncSession = Depends(get_db)):
     """Delete a specific analysis result"""
-    db = next(get_db())
-    result = db.query(AnalysisResult).filter(AnalysisResult.id == result_id).first()
+    result = await db.get(AnalysisResult, result_id)
     
     if not result:
         raise HTTPException(status_code=404, detail="Result not found")
     
-    db.delete(result)
-    db.commit()
+    await db.delete(result)
+    await record_result_removed(db, result)
+    await db.commit()
     
     return {"message": f"Result {result_id} deleted successfully"}
 
 @app.delete("/results")
-async def delete_all_results():
+async def delete_all_results(db: AsyncSession = Depends(get_db)):
     """Delete all analysis results"""
-    db = next(get_db())
-    count = db.query(AnalysisResult).count()
-    db.query(AnalysisResult).delete()
-    db.commit()
+    count = await db.scalar(select(func.count()).select_from(AnalysisResult))
+    await db.execute(delete(AnalysisResult))
+    await record_results_cleared(db)
+    await db.commit()
     
     return {"message": f"All {count} results deleted successfully"}
 
 @app.get("/stats")
-async def get_stats():
-    """Get platform statistics"""
-    db = next(get_db())
-    
-    total_sites = db.query(AnalysisResult).count()
-    sites_with_self_service = db.query(AnalysisResult).filter(
-        AnalysisResult.self_help_returns.like("Yes%")
-    ).count()
-    sites_with_insurance = db.query(AnalysisResult).filter(
-        AnalysisResult.insurance.like("Yes%")
-    ).count()
-    
-    success_rate = 100.0 if total_sites == 0 else (total_sites / total_sites) * 100
-    self_service_rate = 0.0 if total_sites == 0 else (sites_with_self_service / total_sites) * 100
-    insurance_rate = 0.0 if total_sites == 0 else (sites_with_insurance / total_sites) * 100
-    
-    return {
-        "total_sites": total_sites,
-        "success_rate": round(success_rate, 1),
-        "self_service_rate": round(self_service_rate, 1),
-        "insurance_rate": round(insurance_rate, 1),
-        "sites_with_self_service": sites_with_self_service,
-        "sites_with_insurance": sites_with_insurance
-    }
+async def get_stats(db: AsyncSession = Depends(get_db)):
+    """Get platform statistics (served from maintained counters)"""
+    return await read_stats(db)
+
+@app.get("/stats/firecrawl")
+async def get_firecrawl_stats(db: AsyncSession = Depends(get_db)):
+    """Per-field miss rate of the main analysis and speculative Firecrawl time saved vs wasted"""
+    return await read_firecrawl_stats(db)
+
+@app.get("/stats/llm")
+async def get_llm_stats():
+    """Shared OpenAI rate-limit buckets (requests/tokens available per model, active 429 blocks)"""
+    return await run_bookkeeping(get_limiter().snapshot)
+
+@app.get("/stats/hosts")
+async def get_host_stats():
+    """Target hosts with an open circuit, failures or a throttled request rate (host_health.py)"""
+    return await run_bookkeeping(get_host_health().snapshot)
 
-async def create_analysis_job(url: str) -> str:
-    """Create a new analysis job"""
-    import uuid
-    from datetime import datetime
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics (per-stage histograms and counters, merged across gunicorn workers)"""
+    body, content_type = render_metrics()
+    return Response(content=body, headers={"Content-Type": content_type})
+
+@app.get("/debug/profile", dependencies=[Depends(require_debug_token)])
+async def debug_profile(seconds: float = 10, interval_ms: float = 10, job_id: Optional[str] = None,
+                        format: str = "collapsed", include_idle: bool = False):
+    """Sample this worker's stacks for `seconds` (optionally only one running job).
+
+    format=collapsed returns flamegraph-ready collapsed stacks (flamegraph.pl, speedscope);
+    format=top returns the hottest functions by self/total samples.
+    """
+    if format not in ("collapsed", "top"):
+        raise HTTPException(status_code=400, detail="format must be 'collapsed' or 'top'")
+    if seconds <= 0:
+        raise HTTPException(status_code=400, detail="seconds must be positive")
+    if job_id and running_trace(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job is not running in this worker")
     
-    db = next(get_db())
-    job_id = str(uuid.uuid4())
+    try:
+        profile = await asyncio.to_thread(sample, seconds, interval_ms, job_id, include_idle)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
     
-    job = AnalysisJob(
-        id=job_id,
-        url=url,
-        status="pending",
-        created_at=datetime.utcnow()
+    summary = {key: value for key, value in profile.items() if key != "stacks"}
+    if format == "top":
+        return {**summary, "pid": os.getpid(), "functions": top_functions(profile)}
+    return PlainTextResponse(
+        collapsed(profile),
+        headers={
+            "Content-Disposition": f'attachment; filename="profile-{os.getpid()}.collapsed"',
+            "X-Profile-Samples": str(profile["samples_kept"]),
+            "X-Profile-Stop-Reason": profile["stop_reason"],
+        },
     )
-    
-    db.add(job)
-    db.commit()
-    
-    return job_id
+
+@app.get("/stats/daily")
+async def get_daily_stats(days: int = 30, db: AsyncSession = Depends(get_db)):
+    """Per-day analyses, failure rate and average job duration"""
+    return await read_daily_series(db, days)
+
+async def _watch_job(job_id: str, budget) -> None:
+    """Refresh the job's heartbeat, and stop the job once POST /job/{id}/cancel (possibly
+    handled by another worker) marked it cancelled"""
+    interval = min(JOB_HEARTBEAT_SECONDS, JOB_CANCEL_POLL_SECONDS) if JOB_CANCEL_POLL_SECONDS > 0 else JOB_HEARTBEAT_SECONDS
+    last_beat = time.monotonic()
+    while not budget.stopped.is_set():
+        await asyncio.sleep(interval)
+        try:
+            async with SessionLocal() as db:
+                if JOB_CANCEL_POLL_SECONDS > 0:
+                    status = await db.scalar(select(AnalysisJob.status).where(AnalysisJob.id == job_id))
+                    if status == "cancelled":
+                        budget.cancel()
+                        return
+                if time.monotonic() - last_beat >= JOB_HEARTBEAT_SECONDS:
+                    await touch_job(db, job_id)
+                    await db.commit()
+                    last_beat = time.monotonic()
+        except Exception as e:
+            print(f"⚠️ Job watcher for {job_id}: {e}")
+
+async def _recover_jobs_forever() -> None:
+    while True:
+        try:
+            async with SessionLocal() as db:
+                recovered = await recover_stale_jobs(db)
+                for job in recovered:
+                    print(f"♻️ Re-queued orphaned job {job.id} ({job.url})")
+                    await estimate_requeued(db, job)
+                await db.commit()
+            if recovered:
+                wake_scheduler()
+        except Exception as e:
+            print(f"⚠️ Stale job recovery failed: {e}")
+        await asyncio.sleep(JOB_STALE_SECONDS / 3)
+
+async def _finish_unsuccessful(db: AsyncSession, job: AnalysisJob, lease: int, trace, status: str, message: str) -> None:
+    """Record a failed / cancelled job (the session may hold a half-done transaction).
+
+    Like completion, only while this worker still owns the job: 'processing' at the attempt it
+    started, or already 'cancelled' by POST /job/{id}/cancel during that attempt.
+    """
+    await db.rollback()
+    owned_states = ["processing", "cancelled"] if status == "cancelled" else ["processing"]
+    owned = await db.execute(
+        update(AnalysisJob)
+        .where(AnalysisJob.id == job.id, AnalysisJob.status.in_(owned_states), AnalysisJob.attempts == lease)
+        .values(status=status, error_message=message, completed_at=datetime.utcnow(), trace=trace.dump())
+    )
+    if owned.rowcount != 1:
+        await db.rollback()
+        await db.refresh(job)
+        print(f"⚠️ Job {job.id}: no longer owned by this worker ({job.status}), {status} outcome not recorded")
+        return
+    await db.refresh(job)
+    await record_job_finished(db, job)
+    await db.commit()
+    JOBS.labels(outcome=status, method="none").inc()
 
 async def process_website(job_id: str, url: str):
-    """Background task to process website analysis"""
-    from datetime import datetime
-    
-    db = next(get_db())
-    job = db.query(AnalysisJob).filter(AnalysisJob.id == job_id).first()
-    
-    try:
-        job.status = "processing"
-        db.commit()
-        
-        # Initialize scraper and analyzer
-        scraper = EcommerceScraper()
-        analyzer = PolicyAnalyzer()
-        
-        # Scrape the website
-        scraped_data = await scraper.scrape_website(url)
-        
-        # Analyze with AI
-        analysis = await analyzer.analyze_policies(scraped_data)
-        
-        # Save results
-        result = AnalysisResult(
-            domain=analysis["domain"],
-            shipping_policy=analysis["shipping_policy"],
-            shipping_url=analysis["shipping_url"],
-            return_policy=analysis["return_policy"],
-            return_url=analysis["return_url"],
-            self_help_returns=analysis["self_help_returns"],
-            self_help_url=analysis["self_help_url"],
-            insurance=analysis["insurance"],
-            insurance_url=analysis["insurance_url"],
-            analyzed_at=datetime.utcnow()
-        )
-        
-        db.add(result)
-        job.status = "completed"
-        job.completed_at = datetime.utcnow()
-        db.commit()
-        
-    except Exception as e:
-        job.status = "failed"
-        job.error_message = str(e)
-        job.completed_at = datetime.utcnow()
-        db.commit()
+    """Process a job claimed by the scheduler"""
+    started = time.perf_counter()
+    with start_trace(job_id) as trace, span("process_website", job_id=job_id, url=url) as root_span, \
+            job_budget(job_id) as budget:
+        async with SessionLocal() as db:
+            job = await db.get(AnalysisJob, job_id)
+            if job.status == "cancelled":
+                # Cancelled right after the scheduler claimed it
+                JOBS.labels(outcome="cancelled", method="none").inc()
+                return
+            if job.status != "processing":
+                return  # no longer ours (recovered elsewhere)
+            lease = job.attempts  # recovery bumps attempts when it hands the job to another worker
+            checkpoints = await load_checkpoints(db, job_id)
+            root_span.set(attempt=job.attempts + 1, resumed=checkpoints.resumed)
+            watcher = asyncio.create_task(_watch_job(job_id, budget))
+            
+            with JOBS_RUNNING.track_inprogress(), use_checkpoints(checkpoints):
+                try:
+                    speculative_fields = await read_weak_fields(db)
+                    job.status = "processing"
+                    job.heartbeat_at = datetime.utcnow()
+                    await db.commit()
+                    
+                    # Shared, app-scoped scraper and analyzer (pooled connections, see clients.py)
+                    clients = get_clients()
+                    scraper = clients.scraper
+                    analyzer = clients.analyzer
+                    
+                    analysis = checkpoint("analysis")
+                    if analysis is not None:
+                        # Interrupted after the analysis (while saving): nothing left to scrape or ask GPT-4
+                        print(f"♻️ Job {job_id}: analysis restored from checkpoint")
+                        scraped_data = {}
+                    else:
+                        # Scrape the website
+                        with stage("scrape") as scrape_span:
+                            scraped_data = await scraper.scrape_website(url)
+                            scrape_span.set(pages=len(scraped_data.get("policy_pages") or {}),
+                                            stop_reason=scraped_data.get("stop_reason"))
+                        
+                        # Analyze with AI
+                        with stage("analysis") as analysis_span:
+                            analysis = await analyzer.analyze_policies(scraped_data, speculative_fields=speculative_fields)
+                            analysis_span.set(method=analysis.get("extraction_method", "llm"))
+                        await save_checkpoint("analysis", analysis)
+                    
+                    # Parse typed facts (return window, free-shipping threshold, ...) out of the text
+                    analysis.update(extract_facts(analysis))
+                    
+                    # Save results (upsert the domain's current row, archive the previous one)
+                    if not analysis.get("domain"):
+                        analysis["domain"] = scraped_data.get("domain") or urlparse(url).netloc
+                    with stage("save"):
+                        # Complete only our own claim: still 'processing' at the attempt we started. A job
+                        # recovered (and re-run) elsewhere or cancelled meanwhile keeps its new owner's state.
+                        owned = await db.execute(
+                            update(AnalysisJob)
+                            .where(AnalysisJob.id == job_id, AnalysisJob.status == "processing",
+                                   AnalysisJob.attempts == lease)
+                            .values(status="completed", completed_at=datetime.utcnow(),
+                                    cost_class=run_cost_class(scraped_data, resumed=bool(checkpoints.resumed)))
+                        )
+                        if owned.rowcount == 1:
+                            await db.refresh(job)
+                            await save_result(db, analysis, analyzed_at=datetime.utcnow())
+                            await record_field_outcomes(db, analysis)
+                            await record_job_finished(db, job)
+                            await clear_checkpoints(db, job_id)
+                            job.trace = trace.dump()
+                            await db.commit()
+                        else:
+                            await db.rollback()
+                            await db.refresh(job)
+                    if owned.rowcount == 1:
+                        JOBS.labels(outcome="completed", method=analysis.get("extraction_method", "llm")).inc()
+                    else:
+                        print(f"⚠️ Job {job_id}: no longer owned by this worker ({job.status}), result not saved")
+                    
+                except asyncio.CancelledError:
+                    if not budget.stopped.is_set():
+                        raise  # worker shutting down, not a cancel / deadline of this job
+                    asyncio.current_task().uncancel()
+                    if budget.cancelled:
+                        await _finish_unsuccessful(db, job, lease, trace, "cancelled", "Cancelled by request")
+                    else:
+                        await _finish_unsuccessful(db, job, lease, trace, "failed",
+                                                   f"Job deadline of {budget.seconds:.0f}s exceeded")
+                except Exception as e:
+                    cancelled = isinstance(e, BudgetExhausted) and budget.cancelled
+                    await _finish_unsuccessful(db, job, lease, trace, "cancelled" if cancelled else "failed", str(e))
+                finally:
+                    watcher.cancel()
+    JOB_SECONDS.labels(outcome=job.status).observe(time.perf_counter() - started)
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,138 @@
+"""
+Prometheus metrics for the analysis pipeline (GET /metrics).
+
+Histograms and counters per stage: platform detection, URL discovery, page
+fetches by tier (requests / playwright) with page sizes, LLM latency and tokens
+by call site and model, Firecrawl search/scrape calls, queue depth, active
+browsers and job outcomes.
+
+Under gunicorn every worker is a separate process, so values are written to
+PROMETHEUS_MULTIPROC_DIR (set up in gunicorn.conf.py) and /metrics merges all
+workers' files. Without that variable (uvicorn --reload, scripts) the default
+in-process registry is used.
+"""
+
+import os
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+
+from tracing import span
+
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+# Pipeline stages take from milliseconds (platform detection) to minutes (Playwright crawl + GPT-4)
+_STAGE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+_FETCH_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60)
+_BYTES_BUCKETS = (1_000, 5_000, 20_000, 50_000, 100_000, 250_000, 500_000, 1_000_000, 5_000_000)
+_TOKEN_BUCKETS = (100, 250, 500, 1_000, 2_000, 4_000, 8_000, 16_000, 32_000)
+
+STAGE_SECONDS = Histogram(
+    "analyzer_stage_seconds", "Time spent per pipeline stage", ["stage"], buckets=_STAGE_BUCKETS,
+)
+PAGE_FETCH_SECONDS = Histogram(
+    "analyzer_page_fetch_seconds", "Page fetch latency by tier", ["tier", "outcome"], buckets=_FETCH_BUCKETS,
+)
+PAGE_BYTES = Histogram(
+    "analyzer_page_bytes", "Fetched page size by tier", ["tier"], buckets=_BYTES_BUCKETS,
+)
+LLM_REQUEST_SECONDS = Histogram(
+    "analyzer_llm_request_seconds", "OpenAI chat completion latency (queueing excluded)",
+    ["call_site", "model", "outcome"], buckets=_STAGE_BUCKETS,
+)
+LLM_QUEUE_SECONDS = Histogram(
+    "analyzer_llm_queue_seconds", "Time waiting for rate-limit budget", ["call_site", "model"], buckets=_STAGE_BUCKETS,
+)
+LLM_TOKENS = Counter(
+    "analyzer_llm_tokens", "Tokens used by OpenAI calls", ["call_site", "model", "kind"],
+)
+LLM_REQUEST_TOKENS = Histogram(
+    "analyzer_llm_request_tokens", "Total tokens per OpenAI call", ["call_site", "model"], buckets=_TOKEN_BUCKETS,
+)
+FIRECRAWL_CALLS = Counter(
+    "analyzer_firecrawl_calls", "Firecrawl API calls", ["operation", "outcome"],
+)
+FIRECRAWL_SECONDS = Histogram(
+    "analyzer_firecrawl_call_seconds", "Firecrawl API call latency", ["operation"], buckets=_FETCH_BUCKETS,
+)
+JOBS = Counter(
+    "analyzer_jobs", "Finished analysis jobs", ["outcome", "method"],
+)
+JOB_SECONDS = Histogram(
+    "analyzer_job_seconds", "End-to-end job duration", ["outcome"], buckets=_STAGE_BUCKETS,
+)
+# Gauges are summed over live workers (dead workers' files are dropped by gunicorn's child_exit hook),
+# except the queue: it lives in the database and every worker's dispatcher reports the same count
+JOBS_QUEUED = Gauge("analyzer_jobs_queued", "Jobs accepted but not started", multiprocess_mode="livemax")
+JOBS_RUNNING = Gauge("analyzer_jobs_running", "Jobs currently processing", multiprocess_mode="livesum")
+ACTIVE_BROWSERS = Gauge("analyzer_active_browsers", "Playwright browsers currently open", multiprocess_mode="livesum")
+ADMISSION_LIMIT = Gauge("analyzer_admission_concurrency_limit", "Adaptive job concurrency limit",
+                        multiprocess_mode="livesum")
+MEMORY_PRESSURE = Gauge("analyzer_memory_pressure", "Fraction of the memory limit in use", multiprocess_mode="livemax")
+ADMISSION_REJECTED = Counter("analyzer_admission_rejected", "Submissions refused with 429", ["reason"])
+HOST_OUTCOMES = Counter("analyzer_host_requests", "Direct requests to target sites by outcome", ["outcome"])
+HOST_CIRCUIT_EVENTS = Counter("analyzer_host_circuit_events", "Per-host circuit breaker transitions", ["event"])
+
+
+@contextmanager
+def stage(name: str, **attrs):
+    """Time a pipeline stage (recorded even when the stage raises); also a span of the job's trace"""
+    started = time.perf_counter()
+    try:
+        with span(name, **attrs) as current:
+            yield current
+    finally:
+        STAGE_SECONDS.labels(stage=name).observe(time.perf_counter() - started)
+
+
+def record_fetch(tier: str, seconds: float, size: Optional[int] = None, outcome: str = "ok") -> None:
+    PAGE_FETCH_SECONDS.labels(tier=tier, outcome=outcome).observe(seconds)
+    if size is not None:
+        PAGE_BYTES.labels(tier=tier).observe(size)
+
+
+def record_llm_call(call_site: str, model: str, seconds: float, outcome: str, usage=None) -> None:
+    LLM_REQUEST_SECONDS.labels(call_site=call_site, model=model, outcome=outcome).observe(seconds)
+    if usage is None:
+        return
+    prompt = getattr(usage, "prompt_tokens", None) or 0
+    completion = getattr(usage, "completion_tokens", None) or 0
+    LLM_TOKENS.labels(call_site=call_site, model=model, kind="prompt").inc(prompt)
+    LLM_TOKENS.labels(call_site=call_site, model=model, kind="completion").inc(completion)
+    LLM_REQUEST_TOKENS.labels(call_site=call_site, model=model).observe(prompt + completion)
+
+
+@contextmanager
+def firecrawl_call(operation: str, **attrs):
+    """Count and time one Firecrawl API call (search / scrape)"""
+    started = time.perf_counter()
+    try:
+        with span(f"firecrawl.{operation}", **attrs) as current:
+            yield current
+    except Exception:
+        FIRECRAWL_CALLS.labels(operation=operation, outcome="error").inc()
+        raise
+    else:
+        FIRECRAWL_CALLS.labels(operation=operation, outcome="ok").inc()
+    finally:
+        FIRECRAWL_SECONDS.labels(operation=operation).observe(time.perf_counter() - started)
+
+
+def render_metrics():
+    """(body, content type) for GET /metrics, merged across gunicorn workers when multiprocess"""
+    if MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_worker_dead(pid: int) -> None:
+    """gunicorn child_exit hook: drop the live gauges of a worker that exited"""
+    if MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(pid)
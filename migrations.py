@@ -0,0 +1,493 @@
+#!/usr/bin/env python3
+"""
+Versioned schema migrations (replaces Base.metadata.create_all).
+
+Each migration is a frozen, ordered step: it must describe the schema as it was
+at that version rather than importing the live models, so later model changes
+never alter what an old migration does. Applied versions are recorded in
+schema_migrations; a worker claims a version by inserting its row first, so
+concurrent workers starting together apply every step exactly once. On SQLite
+the claim transaction takes the write lock up front (BEGIN IMMEDIATE); a worker
+that still finds the database locked (another one is running a long step) waits
+and re-checks instead of crashing, up to MIGRATION_LOCK_TIMEOUT_SECONDS.
+
+CLI:
+    python migrations.py            # apply pending migrations
+    python migrations.py --status   # list applied / pending versions
+"""
+
+import argparse
+import asyncio
+import os
+import time
+from datetime import datetime
+from typing import Callable, List, Tuple
+from urllib.parse import urlparse
+
+from sqlalchemy import (
+    Boolean, Column, Date, DateTime, Float, Index, Integer, LargeBinary, MetaData, String, Table, Text,
+    bindparam, func, insert, select, text,
+)
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import DBAPIError, IntegrityError, OperationalError
+from sqlalchemy.schema import CreateColumn
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+MIGRATION_LOCK_TIMEOUT_SECONDS = float(os.getenv("MIGRATION_LOCK_TIMEOUT_SECONDS", 600))
+_LOCK_RETRY_SECONDS = 1.0
+
+_meta = MetaData()
+
+schema_migrations = Table(
+    "schema_migrations", _meta,
+    Column("version", Integer, primary_key=True),
+    Column("description", String(200), nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+def _add_column(conn: Connection, table: Table, column: Column) -> None:
+    """ALTER TABLE ... ADD COLUMN rendered for the connection's dialect"""
+    ddl = CreateColumn(column).compile(dialect=conn.dialect)
+    conn.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {ddl}")
+
+
+# --- 0001: baseline schema (tables as created by the former create_all) ---
+
+def _0001_baseline(conn: Connection) -> None:
+    meta = MetaData()
+    Table(
+        "analysis_results", meta,
+        Column("id", Integer, primary_key=True, index=True),
+        Column("domain", String(255), nullable=False, index=True),
+        Column("shipping_policy", Text),
+        Column("shipping_url", String(500)),
+        Column("return_policy", Text),
+        Column("return_url", String(500)),
+        Column("self_help_returns", String(500)),
+        Column("self_help_url", String(500)),
+        Column("insurance", String(500)),
+        Column("insurance_url", String(500)),
+        Column("analyzed_at", DateTime),
+    )
+    Table(
+        "analysis_jobs", meta,
+        Column("id", String(36), primary_key=True, index=True),
+        Column("url", String(500), nullable=False),
+        Column("status", String(20), nullable=False),
+        Column("created_at", DateTime),
+        Column("completed_at", DateTime),
+        Column("error_message", Text),
+    )
+    Table(
+        "platform_stats", meta,
+        Column("id", Integer, primary_key=True),
+        Column("total_sites", Integer, nullable=False),
+        Column("sites_with_self_service", Integer, nullable=False),
+        Column("sites_with_insurance", Integer, nullable=False),
+        Column("jobs_completed", Integer, nullable=False),
+        Column("jobs_failed", Integer, nullable=False),
+        Column("updated_at", DateTime),
+    )
+    Table(
+        "daily_stats", meta,
+        Column("day", Date, primary_key=True),
+        Column("analyses", Integer, nullable=False),
+        Column("jobs_completed", Integer, nullable=False),
+        Column("jobs_failed", Integer, nullable=False),
+        Column("job_duration_seconds", Float, nullable=False),
+    )
+    # checkfirst: databases created by create_all before migrations existed are adopted as-is
+    meta.create_all(conn, checkfirst=True)
+
+
+# --- 0002: indexes for job polling, time-range filters and per-domain history ---
+
+def _0002_indexes(conn: Connection) -> None:
+    meta = MetaData()
+    jobs = Table("analysis_jobs", meta, Column("status", String(20)), Column("created_at", DateTime))
+    results = Table("analysis_results", meta, Column("domain", String(255)), Column("analyzed_at", DateTime))
+    for index in (
+        Index("ix_analysis_jobs_status", jobs.c.status),
+        Index("ix_analysis_jobs_created_at", jobs.c.created_at),
+        Index("ix_analysis_results_analyzed_at", results.c.analyzed_at),
+        Index("ix_analysis_results_domain_analyzed_at", results.c.domain, results.c.analyzed_at),
+    ):
+        index.create(conn, checkfirst=True)
+
+
+# --- 0003: one current row per domain, superseded versions archived to history ---
+
+_RESULT_FIELDS = (
+    "domain, shipping_policy, shipping_url, return_policy, return_url, "
+    "self_help_returns, self_help_url, insurance, insurance_url, analyzed_at"
+)
+
+def _0003_result_history(conn: Connection) -> None:
+    meta = MetaData()
+    history = Table(
+        "analysis_results_history", meta,
+        Column("id", Integer, primary_key=True),
+        Column("result_id", Integer),
+        Column("domain", String(255), nullable=False),
+        Column("shipping_policy", Text),
+        Column("shipping_url", String(500)),
+        Column("return_policy", Text),
+        Column("return_url", String(500)),
+        Column("self_help_returns", String(500)),
+        Column("self_help_url", String(500)),
+        Column("insurance", String(500)),
+        Column("insurance_url", String(500)),
+        Column("analyzed_at", DateTime),
+        Column("archived_at", DateTime, index=True),
+        Index("ix_analysis_results_history_domain_analyzed_at", "domain", "analyzed_at"),
+    )
+    history.create(conn, checkfirst=True)
+
+    # Keep the newest row (highest id) per domain; archive and drop the rest
+    superseded = (
+        "r.id < (SELECT MAX(n.id) FROM analysis_results n WHERE n.domain = r.domain)"
+    )
+    conn.execute(
+        text(
+            f"INSERT INTO analysis_results_history (result_id, {_RESULT_FIELDS}, archived_at) "
+            f"SELECT r.id, {', '.join('r.' + f.strip() for f in _RESULT_FIELDS.split(','))}, :now "
+            f"FROM analysis_results r WHERE {superseded}"
+        ),
+        {"now": datetime.utcnow()},
+    )
+    conn.execute(text(f"DELETE FROM analysis_results WHERE id IN (SELECT r.id FROM analysis_results r WHERE {superseded})"))
+
+    old = Table("analysis_results", MetaData(), Column("domain", String(255)))
+    Index("ix_analysis_results_domain", old.c.domain).drop(conn, checkfirst=True)
+    new = Table("analysis_results", MetaData(), Column("domain", String(255)))
+    Index("ix_analysis_results_domain", new.c.domain, unique=True).create(conn)
+
+    # Counters counted every historical copy; recount them against the deduplicated table
+    yes = "LOWER(TRIM({0})) LIKE 'yes%'"
+    conn.execute(text(
+        "UPDATE platform_stats SET "
+        "total_sites = (SELECT COUNT(*) FROM analysis_results), "
+        f"sites_with_self_service = (SELECT COUNT(*) FROM analysis_results WHERE {yes.format('self_help_returns')}), "
+        f"sites_with_insurance = (SELECT COUNT(*) FROM analysis_results WHERE {yes.format('insurance')})"
+    ))
+
+
+# --- 0004: full-text index over the extracted policy text ---
+
+_FTS_COLUMNS = ("shipping_policy", "return_policy", "self_help_returns", "insurance")
+
+def _0004_policy_search(conn: Connection) -> None:
+    columns = ", ".join(_FTS_COLUMNS)
+    if conn.dialect.name == "postgresql":
+        document = " || ".join(
+            f"setweight(to_tsvector('english'::regconfig, coalesce({column}, '')), '{weight}')"
+            for column, weight in zip(_FTS_COLUMNS, "ABBC")
+        )
+        conn.exec_driver_sql(
+            f"ALTER TABLE analysis_results ADD COLUMN search_vector tsvector "
+            f"GENERATED ALWAYS AS ({document}) STORED"
+        )
+        conn.exec_driver_sql(
+            "CREATE INDEX ix_analysis_results_search_vector ON analysis_results USING GIN (search_vector)"
+        )
+        return
+
+    # SQLite: external-content FTS5 table kept in sync by triggers
+    old_values = ", ".join(f"old.{column}" for column in _FTS_COLUMNS)
+    new_values = ", ".join(f"new.{column}" for column in _FTS_COLUMNS)
+    conn.exec_driver_sql(
+        f"CREATE VIRTUAL TABLE analysis_results_fts USING fts5({columns}, "
+        f"content='analysis_results', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+    )
+    conn.exec_driver_sql(
+        f"CREATE TRIGGER analysis_results_fts_ai AFTER INSERT ON analysis_results BEGIN "
+        f"INSERT INTO analysis_results_fts(rowid, {columns}) VALUES (new.id, {new_values}); END"
+    )
+    conn.exec_driver_sql(
+        f"CREATE TRIGGER analysis_results_fts_ad AFTER DELETE ON analysis_results BEGIN "
+        f"INSERT INTO analysis_results_fts(analysis_results_fts, rowid, {columns}) "
+        f"VALUES ('delete', old.id, {old_values}); END"
+    )
+    conn.exec_driver_sql(
+        f"CREATE TRIGGER analysis_results_fts_au AFTER UPDATE OF {columns} ON analysis_results BEGIN "
+        f"INSERT INTO analysis_results_fts(analysis_results_fts, rowid, {columns}) "
+        f"VALUES ('delete', old.id, {old_values}); "
+        f"INSERT INTO analysis_results_fts(rowid, {columns}) VALUES (new.id, {new_values}); END"
+    )
+    conn.exec_driver_sql("INSERT INTO analysis_results_fts(analysis_results_fts) VALUES ('rebuild')")
+
+
+# --- 0005: typed policy facts (return window, free-shipping threshold, ...) ---
+
+def _0005_policy_facts(conn: Connection) -> None:
+    results = Table(
+        "analysis_results", MetaData(),
+        Column("return_window_days", Integer),
+        Column("free_shipping_threshold", Float),
+        Column("free_shipping_currency", String(3)),
+        Column("standard_delivery_days", Integer),
+        Column("express_delivery_days", Integer),
+        Column("restocking_fee", Boolean),
+        Column("insurance_provider", String(50)),
+        Column("facts_extracted_at", DateTime),
+    )
+    for column in results.columns:
+        _add_column(conn, results, column)
+
+    # Rows are filled by facts.backfill_facts() at startup (extraction lives in code, not SQL)
+    for index in (
+        Index("ix_analysis_results_return_window_days", results.c.return_window_days),
+        Index("ix_analysis_results_free_shipping", results.c.free_shipping_currency, results.c.free_shipping_threshold),
+        Index("ix_analysis_results_standard_delivery_days", results.c.standard_delivery_days),
+        Index("ix_analysis_results_express_delivery_days", results.c.express_delivery_days),
+        Index("ix_analysis_results_insurance_provider", results.c.insurance_provider),
+        Index("ix_analysis_results_facts_extracted_at", results.c.facts_extracted_at),
+    ):
+        index.create(conn)
+
+
+# --- 0006: per-field Firecrawl statistics (speculative fallback) ---
+
+def _0006_firecrawl_field_stats(conn: Connection) -> None:
+    meta = MetaData()
+    Table(
+        "firecrawl_field_stats", meta,
+        Column("field", String(50), primary_key=True),
+        Column("analyses", Integer, nullable=False),
+        Column("missing", Integer, nullable=False),
+        Column("speculated", Integer, nullable=False),
+        Column("speculation_used", Integer, nullable=False),
+        Column("speculation_cancelled", Integer, nullable=False),
+        Column("seconds_saved", Float, nullable=False),
+        Column("seconds_wasted", Float, nullable=False),
+        Column("updated_at", DateTime),
+    )
+    meta.create_all(conn)
+
+
+
+# --- 0007: per-job trace timeline ---
+
+def _0007_job_trace(conn: Connection) -> None:
+    jobs = Table("analysis_jobs", MetaData(), Column("trace", LargeBinary))
+    _add_column(conn, jobs, jobs.c.trace)
+
+
+# --- 0008: stage checkpoints + heartbeat/attempts for resuming interrupted jobs ---
+
+def _0008_job_checkpoints(conn: Connection) -> None:
+    meta = MetaData()
+    Table(
+        "job_checkpoints", meta,
+        Column("job_id", String(36), primary_key=True),
+        Column("stage", String(50), primary_key=True),
+        Column("key", String(500), primary_key=True),
+        Column("data", LargeBinary, nullable=False),
+        Column("created_at", DateTime, nullable=False),
+    )
+    meta.create_all(conn)
+
+    jobs = Table(
+        "analysis_jobs", MetaData(),
+        Column("heartbeat_at", DateTime),
+        Column("attempts", Integer, nullable=False, server_default="0"),
+    )
+    for column in jobs.columns:
+        _add_column(conn, jobs, column)
+
+
+
+# --- 0009: job queue scheduling (priority, fair share per submitter, expected cost) ---
+
+def _0009_job_scheduling(conn: Connection) -> None:
+    jobs = Table(
+        "analysis_jobs", MetaData(),
+        Column("priority", Integer, nullable=False, server_default="0"),
+        Column("submitter", String(100)),
+        Column("batch_id", String(36)),
+        Column("domain", String(255)),
+        Column("cost_class", String(20)),
+        Column("expected_seconds", Float),
+        Column("started_at", DateTime),
+    )
+    for column in jobs.columns:
+        _add_column(conn, jobs, column)
+
+    indexed = Table(
+        "analysis_jobs", MetaData(),
+        Column("status", String(20)), Column("priority", Integer), Column("submitter", String(100)),
+        Column("batch_id", String(36)), Column("domain", String(255)), Column("completed_at", DateTime),
+    )
+    for index in (
+        Index("ix_analysis_jobs_status_priority", indexed.c.status, indexed.c.priority),
+        Index("ix_analysis_jobs_status_submitter", indexed.c.status, indexed.c.submitter),
+        Index("ix_analysis_jobs_batch_id", indexed.c.batch_id),
+        Index("ix_analysis_jobs_domain_completed_at", indexed.c.domain, indexed.c.completed_at),
+    ):
+        index.create(conn)
+
+
+# --- 0010: normalized domains (0003 deduplicated on the raw value) ---
+
+def _0010_normalize_domains(conn: Connection) -> None:
+    def domain_key(value: str) -> str:
+        # Frozen copy of result_store.domain_key: 'https://WWW.Shop.com/' -> 'www.shop.com'
+        value = (value or "").strip().lower()
+        if "://" in value:
+            value = urlparse(value).netloc
+        return value.split("/")[0].rstrip(".")
+
+    # Keep the newest row (highest id) per normalized domain; archive and drop the rest
+    rows = conn.execute(text("SELECT id, domain FROM analysis_results ORDER BY id")).all()
+    newest = {domain_key(domain): id_ for id_, domain in rows}
+    superseded = [id_ for id_, domain in rows if newest[domain_key(domain)] != id_]
+    fields = ", ".join("r." + f.strip() for f in _RESULT_FIELDS.split(","))
+    archive = text(
+        f"INSERT INTO analysis_results_history (result_id, {_RESULT_FIELDS}, archived_at) "
+        f"SELECT r.id, {fields}, :now FROM analysis_results r WHERE r.id IN :ids"
+    ).bindparams(bindparam("ids", expanding=True))
+    drop = text("DELETE FROM analysis_results WHERE id IN :ids").bindparams(bindparam("ids", expanding=True))
+    now = datetime.utcnow()
+    for start in range(0, len(superseded), 500):
+        ids = superseded[start:start + 500]
+        conn.execute(archive, {"ids": ids, "now": now})
+        conn.execute(drop, {"ids": ids})
+
+    # Rewrite only after the duplicates are gone, so the keys never collide
+    for table in ("analysis_results", "analysis_results_history"):
+        for id_, domain in conn.execute(text(f"SELECT id, domain FROM {table}")).all():
+            if domain_key(domain) != domain:
+                conn.execute(text(f"UPDATE {table} SET domain = :domain WHERE id = :id"),
+                             {"domain": domain_key(domain), "id": id_})
+
+    if superseded:
+        # Counters counted every copy of a merged domain; recount them against the deduplicated table
+        yes = "LOWER(TRIM({0})) LIKE 'yes%'"
+        conn.execute(text(
+            "UPDATE platform_stats SET "
+            "total_sites = (SELECT COUNT(*) FROM analysis_results), "
+            f"sites_with_self_service = (SELECT COUNT(*) FROM analysis_results WHERE {yes.format('self_help_returns')}), "
+            f"sites_with_insurance = (SELECT COUNT(*) FROM analysis_results WHERE {yes.format('insurance')})"
+        ))
+
+
+# --- 0011: policy facts parsed again (return windows / delivery times from their own clause) ---
+
+def _0011_reextract_policy_facts(conn: Connection) -> None:
+    # Rows are re-parsed by facts.backfill_facts() at startup
+    conn.execute(text("UPDATE analysis_results SET facts_extracted_at = NULL"))
+
+
+# --- 0012: case-insensitive insurance provider lookups ---
+
+def _0012_insurance_provider_lower_index(conn: Connection) -> None:
+    results = Table("analysis_results", MetaData(), Column("insurance_provider", String(50)))
+    # Serves fact_filters' lower(insurance_provider) = :provider (?insurance_provider=route)
+    Index("ix_analysis_results_insurance_provider_lower", func.lower(results.c.insurance_provider)).create(conn)
+
+
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "baseline schema", _0001_baseline),
+    (2, "job status/created_at and result analyzed_at/(domain, analyzed_at) indexes", _0002_indexes),
+    (3, "unique current result per domain + analysis_results_history", _0003_result_history),
+    (4, "full-text search over policy fields (FTS5 / tsvector)", _0004_policy_search),
+    (5, "typed, indexed policy facts on analysis_results", _0005_policy_facts),
+    (6, "firecrawl_field_stats for speculative Firecrawl searches", _0006_firecrawl_field_stats),
+    (7, "analysis_jobs.trace (compressed per-job span timeline)", _0007_job_trace),
+    (8, "job_checkpoints + analysis_jobs.heartbeat_at/attempts (resume interrupted jobs)", _0008_job_checkpoints),
+    (9, "analysis_jobs priority/submitter/batch_id/domain/cost (job scheduler)", _0009_job_scheduling),
+    (10, "analysis_results/history domains normalized (lowercase, trimmed) and deduplicated", _0010_normalize_domains),
+    (11, "policy facts re-extracted (return window / delivery time parsing)", _0011_reextract_policy_facts),
+    (12, "lower(insurance_provider) index for case-insensitive provider filters", _0012_insurance_provider_lower_index),
+]
+
+
+def _applied_versions(conn: Connection) -> set:
+    return set(conn.execute(select(schema_migrations.c.version)).scalars())
+
+
+def _ensure_version_table(conn: Connection) -> None:
+    schema_migrations.create(conn, checkfirst=True)
+
+
+def _claim_and_apply(conn: Connection, version: int, description: str,
+                     step: Callable[[Connection], None]) -> None:
+    if conn.dialect.name == "sqlite":
+        # Write lock before any read: no deferred transaction left to upgrade (SQLITE_BUSY)
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+    # Claim the version first: the insert takes the write lock, so a concurrent
+    # worker blocks here and then fails on the duplicate key instead of re-running DDL.
+    conn.execute(insert(schema_migrations).values(
+        version=version, description=description, applied_at=datetime.utcnow()
+    ))
+    step(conn)
+
+
+async def run_migrations(engine: AsyncEngine) -> List[int]:
+    """Apply pending migrations; returns the versions applied by this call"""
+    try:
+        async with engine.begin() as conn:
+            await conn.run_sync(_ensure_version_table)
+    except DBAPIError:
+        pass  # created concurrently by another worker
+
+    applied = []
+    for version, description, step in MIGRATIONS:
+        if await _apply_one(engine, version, description, step):
+            print(f"🗄️ Migration {version:04d} applied: {description}")
+            applied.append(version)
+    return applied
+
+
+def _is_locked(error: OperationalError) -> bool:
+    return "locked" in str(error.orig).lower() or "busy" in str(error.orig).lower()
+
+
+async def _apply_one(engine: AsyncEngine, version: int, description: str,
+                     step: Callable[[Connection], None]) -> bool:
+    """Apply one step unless already applied; False if another worker did it"""
+    deadline = time.monotonic() + MIGRATION_LOCK_TIMEOUT_SECONDS
+    while True:
+        async with engine.connect() as conn:
+            if version in await conn.run_sync(_applied_versions):
+                return False
+        try:
+            async with engine.begin() as conn:
+                await conn.run_sync(_claim_and_apply, version, description, step)
+            return True
+        except IntegrityError:
+            return False  # applied by another worker in the meantime
+        except OperationalError as e:
+            # Another worker holds the write lock longer than the busy timeout (long step)
+            if not _is_locked(e) or time.monotonic() > deadline:
+                raise
+            print(f"⏳ Migration {version:04d}: database locked by another worker, re-checking...")
+            await asyncio.sleep(_LOCK_RETRY_SECONDS)
+
+
+async def migration_status(engine: AsyncEngine) -> List[Tuple[int, str, bool]]:
+    async with engine.begin() as conn:
+        await conn.run_sync(_ensure_version_table)
+        applied = await conn.run_sync(_applied_versions)
+    return [(version, description, version in applied) for version, description, _ in MIGRATIONS]
+
+
+async def _main(show_status: bool) -> None:
+    from database import engine, close_db
+
+    try:
+        if show_status:
+            for version, description, done in await migration_status(engine):
+                print(f"{'✅' if done else '⏳'} {version:04d} {description}")
+        else:
+            applied = await run_migrations(engine)
+            print(f"✅ Schema up to date ({len(applied)} migration(s) applied)")
+    finally:
+        await close_db()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply database schema migrations")
+    parser.add_argument("--status", action="store_true", help="List applied and pending migrations")
+    asyncio.run(_main(parser.parse_args().status))
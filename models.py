@@ -1,12 +1,16 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text
+from sqlalchemy import Boolean, Column, Integer, String, DateTime, Text, Date, Float, Index, LargeBinary, func
+from sqlalchemy.orm import deferred
 from datetime import datetime
 from database import Base
 
+# Schema changes go through migrations.py; keep these models in sync with it.
+
 class AnalysisResult(Base):
+    """Current result per domain (one row per domain, upserted on every analysis)"""
     __tablename__ = "analysis_results"
     
     id = Column(Integer, primary_key=True, index=True)
-    domain = Column(String(255), nullable=False, index=True)
+    domain = Column(String(255), nullable=False, unique=True, index=True)
     shipping_policy = Column(Text, nullable=True)
     shipping_url = Column(String(500), nullable=True)
     return_policy = Column(Text, nullable=True)
@@ -15,14 +19,118 @@ class AnalysisResult(Base):
     self_help_url = Column(String(500), nullable=True)
     insurance = Column(String(500), nullable=True)
     insurance_url = Column(String(500), nullable=True)
-    analyzed_at = Column(DateTime, default=datetime.utcnow)
+    analyzed_at = Column(DateTime, default=datetime.utcnow, index=True)
+    
+    # Typed facts parsed from the policy text (facts.py)
+    return_window_days = Column(Integer, nullable=True, index=True)
+    free_shipping_threshold = Column(Float, nullable=True)  # 0 = free shipping on every order
+    free_shipping_currency = Column(String(3), nullable=True)
+    standard_delivery_days = Column(Integer, nullable=True, index=True)
+    express_delivery_days = Column(Integer, nullable=True, index=True)
+    restocking_fee = Column(Boolean, nullable=True)
+    insurance_provider = Column(String(50), nullable=True, index=True)
+    facts_extracted_at = Column(DateTime, nullable=True, index=True)
+    
+    __table_args__ = (
+        Index("ix_analysis_results_domain_analyzed_at", "domain", "analyzed_at"),
+        Index("ix_analysis_results_free_shipping", "free_shipping_currency", "free_shipping_threshold"),
+        Index("ix_analysis_results_insurance_provider_lower", func.lower(insurance_provider)),
+    )
+
+class AnalysisResultHistory(Base):
+    """Append-only archive of superseded results (pruned by retention policy)"""
+    __tablename__ = "analysis_results_history"
+    
+    id = Column(Integer, primary_key=True)
+    result_id = Column(Integer, nullable=True)  # id of the current row it was archived from
+    domain = Column(String(255), nullable=False)
+    shipping_policy = Column(Text, nullable=True)
+    shipping_url = Column(String(500), nullable=True)
+    return_policy = Column(Text, nullable=True)
+    return_url = Column(String(500), nullable=True)
+    self_help_returns = Column(String(500), nullable=True)
+    self_help_url = Column(String(500), nullable=True)
+    insurance = Column(String(500), nullable=True)
+    insurance_url = Column(String(500), nullable=True)
+    analyzed_at = Column(DateTime, nullable=True)
+    archived_at = Column(DateTime, default=datetime.utcnow, index=True)
+    
+    __table_args__ = (
+        Index("ix_analysis_results_history_domain_analyzed_at", "domain", "analyzed_at"),
+    )
 
 class AnalysisJob(Base):
     __tablename__ = "analysis_jobs"
     
     id = Column(String(36), primary_key=True, index=True)  # UUID
     url = Column(String(500), nullable=False)
-    status = Column(String(20), nullable=False, default="pending")  # pending, processing, completed, failed
-    created_at = Column(DateTime, default=datetime.utcnow)
+    status = Column(String(20), nullable=False, default="pending", index=True)  # pending, processing, completed, failed, cancelled
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
     completed_at = Column(DateTime, nullable=True)
     error_message = Column(Text, nullable=True)
+    # zlib-compressed span timeline (tracing.py); deferred so job listings never load it
+    trace = deferred(Column(LargeBinary, nullable=True))
+    # Liveness of the worker running the job, and how many times it was (re)started (checkpoints.py)
+    heartbeat_at = Column(DateTime, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    # Scheduling (scheduler.py): higher priority first, fair share per submitter, shortest expected job first
+    priority = Column(Integer, nullable=False, default=0, server_default="0")
+    submitter = Column(String(100), nullable=True)
+    batch_id = Column(String(36), nullable=True)
+    domain = Column(String(255), nullable=True)
+    cost_class = Column(String(20), nullable=True)  # cached, shopify, heavy, unknown
+    expected_seconds = Column(Float, nullable=True)
+    started_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_analysis_jobs_status_priority", "status", "priority"),
+        Index("ix_analysis_jobs_status_submitter", "status", "submitter"),
+        Index("ix_analysis_jobs_batch_id", "batch_id"),
+        Index("ix_analysis_jobs_domain_completed_at", "domain", "completed_at"),
+    )
+
+class JobCheckpoint(Base):
+    """Output of a finished pipeline stage, so a retried/resumed job continues from there"""
+    __tablename__ = "job_checkpoints"
+    
+    job_id = Column(String(36), primary_key=True)
+    stage = Column(String(50), primary_key=True)  # main_page, platform, urls, page, llm, analysis
+    key = Column(String(500), primary_key=True, default="")  # page URL for stage "page"
+    data = Column(LargeBinary, nullable=False)  # zlib-compressed JSON
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class PlatformStats(Base):
+    """Running counters behind GET /stats (single row, id=1), maintained on every write"""
+    __tablename__ = "platform_stats"
+    
+    id = Column(Integer, primary_key=True)
+    total_sites = Column(Integer, nullable=False, default=0)
+    sites_with_self_service = Column(Integer, nullable=False, default=0)
+    sites_with_insurance = Column(Integer, nullable=False, default=0)
+    jobs_completed = Column(Integer, nullable=False, default=0)
+    jobs_failed = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class DailyStats(Base):
+    """Per-day analysis/job counters for time series (one row per UTC day)"""
+    __tablename__ = "daily_stats"
+    
+    day = Column(Date, primary_key=True)
+    analyses = Column(Integer, nullable=False, default=0)
+    jobs_completed = Column(Integer, nullable=False, default=0)
+    jobs_failed = Column(Integer, nullable=False, default=0)
+    job_duration_seconds = Column(Float, nullable=False, default=0.0)
+
+class FirecrawlFieldStats(Base):
+    """Per-field miss rate of the main analysis and outcome of speculative Firecrawl searches"""
+    __tablename__ = "firecrawl_field_stats"
+    
+    field = Column(String(50), primary_key=True)
+    analyses = Column(Integer, nullable=False, default=0)
+    missing = Column(Integer, nullable=False, default=0)  # main analysis left the field missing/vague
+    speculated = Column(Integer, nullable=False, default=0)
+    speculation_used = Column(Integer, nullable=False, default=0)
+    speculation_cancelled = Column(Integer, nullable=False, default=0)
+    seconds_saved = Column(Float, nullable=False, default=0.0)
+    seconds_wasted = Column(Float, nullable=False, default=0.0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
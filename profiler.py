@@ -0,0 +1,146 @@
+"""
+On-demand sampling profiler for a live worker (GET /debug/profile).
+
+A background thread snapshots every thread's Python stack with
+sys._current_frames() every few milliseconds and counts identical stacks. The
+result is in collapsed-stack format ("frame;frame;frame count" per line), which
+flamegraph.pl, speedscope and inferno read directly. Nothing is instrumented, so
+the only cost is the sampling itself, and only while a profile is running.
+
+With a job_id, only samples belonging to that job are kept: event-loop samples
+whose stack runs through that job's process_website coroutine, plus worker
+threads currently inside one of the job's trace spans (tracing.py).
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+from tracing import running_trace
+
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", 120))
+PROFILE_DEFAULT_INTERVAL_MS = float(os.getenv("PROFILE_DEFAULT_INTERVAL_MS", 10))
+
+# Leaf frames of threads that are parked (event loop waiting on epoll, idle executor workers, ...)
+_IDLE_LEAVES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+    ("socket.py", "accept"),
+}
+
+_JOB_FUNCTION = "process_website"
+_lock = threading.Lock()
+
+
+class ProfilerBusy(Exception):
+    """Another profile is already running in this process"""
+
+
+def _label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ",")
+
+
+def _stack(frame) -> List:
+    """(code, frame) pairs of a thread's stack, leaf first"""
+    codes = []
+    while frame is not None:
+        codes.append((frame.f_code, frame))
+        frame = frame.f_back
+    return codes
+
+
+def _is_idle(stack: List) -> bool:
+    code = stack[0][0]
+    return (os.path.basename(code.co_filename), code.co_name) in _IDLE_LEAVES
+
+
+def _belongs_to_job(stack: List, job_id: str) -> bool:
+    return any(
+        code.co_name == _JOB_FUNCTION and frame.f_locals.get("job_id") == job_id
+        for code, frame in stack
+    )
+
+
+def sample(seconds: float, interval_ms: float = PROFILE_DEFAULT_INTERVAL_MS,
+           job_id: Optional[str] = None, include_idle: bool = False) -> Dict:
+    """Sample all threads (or one job's) for `seconds`; returns collapsed stacks and counts.
+
+    Blocking: run it in a worker thread. With job_id, stops early once the job finishes.
+    """
+    if not _lock.acquire(blocking=False):
+        raise ProfilerBusy("a profile is already running in this worker")
+    try:
+        me = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        stacks: Counter = Counter()
+        taken = kept = 0
+        interval = max(interval_ms, 1.0) / 1000
+        started = time.perf_counter()
+        deadline = started + min(seconds, PROFILE_MAX_SECONDS)
+        stop_reason = "duration"
+
+        while time.perf_counter() < deadline:
+            trace = running_trace(job_id) if job_id else None
+            if job_id and trace is None:
+                stop_reason = "job_finished"
+                break
+            job_threads = trace.worker_threads() if trace else set()
+
+            frames = sys._current_frames()
+            for ident, frame in frames.items():
+                if ident == me:
+                    continue
+                stack = _stack(frame)
+                taken += 1
+                if not include_idle and _is_idle(stack):
+                    continue
+                if job_id and ident not in job_threads and not _belongs_to_job(stack, job_id):
+                    continue
+                kept += 1
+                if ident not in names:
+                    names.update({thread.ident: thread.name for thread in threading.enumerate()})
+                stacks[";".join([names.get(ident, str(ident))] + [_label(code) for code, _ in reversed(stack)])] += 1
+            frames = stack = frame = None  # don't keep other threads' frames alive between samples
+            time.sleep(interval)
+
+        elapsed = time.perf_counter() - started
+        return {
+            "seconds": round(elapsed, 2),
+            "interval_ms": interval_ms,
+            "job_id": job_id,
+            "stop_reason": stop_reason,
+            "samples_taken": taken,
+            "samples_kept": kept,
+            "stacks": stacks,
+        }
+    finally:
+        _lock.release()
+
+
+def collapsed(profile: Dict) -> str:
+    """Brendan Gregg's collapsed format, hottest stacks first"""
+    return "".join(f"{stack} {count}\n" for stack, count in profile["stacks"].most_common())
+
+
+def top_functions(profile: Dict, limit: int = 30) -> List[Dict]:
+    """Functions by self samples (leaf) and total samples (anywhere on the stack)"""
+    self_counts: Counter = Counter()
+    total_counts: Counter = Counter()
+    for stack, count in profile["stacks"].items():
+        frames = stack.split(";")[1:]
+        if not frames:
+            continue
+        self_counts[frames[-1]] += count
+        for frame in set(frames):
+            total_counts[frame] += count
+    kept = profile["samples_kept"] or 1
+    return [
+        {"function": name, "self": self_counts[name], "total": total,
+         "self_pct": round(100 * self_counts[name] / kept, 1), "total_pct": round(100 * total / kept, 1)}
+        for name, total in sorted(total_counts.items(), key=lambda item: (self_counts[item[0]], item[1]), reverse=True)[:limit]
+    ]
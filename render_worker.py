@@ -0,0 +1,265 @@
+"""
+Render service: the Chromium browsers live here, not in the API workers.
+
+With SCRAPE_RENDERER=service the scraper sends each policy page to this
+process (POST /render over a local unix socket, or HTTP when it runs in its own
+container) and gets back the extracted text; 404 detection and short-content
+fallbacks stay in the scraper. A browser leak or crash then costs a render
+restart, not an API worker and the jobs it was running.
+
+- one shared Chromium, RENDER_CONCURRENCY pages rendering at once (each in its
+  own context); further requests wait for a slot.
+- the browser is recycled after RENDER_MAX_RENDERS_PER_BROWSER renders or when
+  the service (browser processes included) exceeds RENDER_MAX_MEMORY_MB: new
+  renders go to a fresh browser, the old one is closed once its pages finish.
+  A browser that crashed is relaunched on the next render.
+- `python render_worker.py` supervises the server: when it exits or is killed
+  (OOM) it is started again, backing off up to RENDER_RESTART_MAX_BACKOFF_SECONDS.
+
+GET /health reports the browser state, renders in flight and memory.
+"""
+
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import time
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+import httpx
+from fastapi import FastAPI, HTTPException
+from pydantic import BaseModel
+
+from renderer import launch_browser, render_page
+from resources import process_tree_rss
+
+# unix:///path/to.sock (same host) or http://host:port (separate container)
+RENDER_WORKER_URL = os.getenv("RENDER_WORKER_URL", "unix:///tmp/analyzer-render.sock")
+RENDER_CONCURRENCY = int(os.getenv("RENDER_CONCURRENCY", 4))
+RENDER_MAX_MEMORY_MB = float(os.getenv("RENDER_MAX_MEMORY_MB", 1500))
+RENDER_MAX_RENDERS_PER_BROWSER = int(os.getenv("RENDER_MAX_RENDERS_PER_BROWSER", 200))
+RENDER_RESTART_MAX_BACKOFF_SECONDS = float(os.getenv("RENDER_RESTART_MAX_BACKOFF_SECONDS", 30))
+RENDER_STABLE_SECONDS = 60  # a server up this long resets the restart backoff
+
+_UNIX_PREFIX = "unix://"
+
+
+# --- server ---
+
+class BrowserPool:
+    def __init__(self):
+        self.renders = 0
+        self.restarts = 0
+        self._playwright = None
+        self._browser = None
+        self._browser_renders = 0
+        self._in_flight: Dict[object, int] = {}  # browser -> pages rendering on it (retired browsers included)
+        self._slots = asyncio.Semaphore(RENDER_CONCURRENCY)
+        self._launching = asyncio.Lock()
+
+    async def start(self) -> None:
+        from playwright.async_api import async_playwright
+        self._playwright = await async_playwright().start()
+
+    async def stop(self) -> None:
+        for browser in set(self._in_flight) | {self._browser} - {None}:
+            await self._close(browser)
+        if self._playwright is not None:
+            await self._playwright.stop()
+
+    @property
+    def in_flight(self) -> int:
+        return sum(self._in_flight.values())
+
+    @property
+    def browser_connected(self) -> bool:
+        return self._browser is not None and self._browser.is_connected()
+
+    async def _current(self):
+        async with self._launching:
+            if self._browser is not None and not self._browser.is_connected():
+                print("💥 Browser disconnected, relaunching")
+                self.restarts += 1
+                if not self._in_flight.get(self._browser):
+                    self._in_flight.pop(self._browser, None)
+                self._browser = None
+            if self._browser is None:
+                self._browser = await launch_browser(self._playwright)
+                self._browser_renders = 0
+                self._in_flight.setdefault(self._browser, 0)
+            return self._browser
+
+    def _over_memory(self) -> bool:
+        rss = process_tree_rss()
+        return rss is not None and rss > RENDER_MAX_MEMORY_MB * 1024 * 1024
+
+    async def render(self, url: str, timeout_seconds: float) -> Dict:
+        deadline = time.monotonic() + timeout_seconds
+
+        def timeout_ms(seconds: float) -> float:
+            # Playwright reads 0 as "no timeout": keep at least a moment
+            return max(min(seconds, deadline - time.monotonic()), 0.1) * 1000
+
+        async with self._slots:
+            browser = await self._current()
+            self._in_flight[browser] += 1
+            self._browser_renders += 1
+            self.renders += 1
+            try:
+                return await asyncio.wait_for(render_page(browser, url, timeout_ms),
+                                              max(deadline - time.monotonic(), 0.1))
+            finally:
+                self._in_flight[browser] -= 1
+                await self._release(browser)
+
+    async def _release(self, browser) -> None:
+        if browser is self._browser and (self._browser_renders >= RENDER_MAX_RENDERS_PER_BROWSER or self._over_memory()):
+            print(f"♻️ Recycling browser after {self._browser_renders} renders")
+            self.restarts += 1
+            self._browser = None  # the next render launches a fresh one
+        if browser is not self._browser and self._in_flight.get(browser) == 0:
+            await self._close(browser)
+
+    async def _close(self, browser) -> None:
+        self._in_flight.pop(browser, None)
+        try:
+            await browser.close()
+        except Exception as e:
+            print(f"⚠️ Browser close: {e}")
+
+
+class RenderRequest(BaseModel):
+    url: str
+    timeout_seconds: float = 60
+
+
+app = FastAPI(title="Render service")
+_pool: Optional[BrowserPool] = None
+
+
+@app.on_event("startup")
+async def startup():
+    global _pool
+    # Install Playwright browsers (the API workers no longer need them)
+    try:
+        subprocess.run([sys.executable, "-m", "playwright", "install", "chromium"],
+                       check=True, capture_output=True)
+        print("✅ Playwright browsers installed successfully")
+    except Exception as e:
+        print(f"⚠️ Playwright browser installation warning: {e}")
+    _pool = BrowserPool()
+    await _pool.start()
+    print(f"🎭 Render service ready on {RENDER_WORKER_URL} ({RENDER_CONCURRENCY} pages at once)")
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    if _pool is not None:
+        await _pool.stop()
+
+
+@app.post("/render")
+async def render(request: RenderRequest):
+    started = time.perf_counter()
+    try:
+        rendered = await _pool.render(request.url, request.timeout_seconds)
+    except Exception as e:
+        print(f"❌ Render failed for {request.url}: {type(e).__name__}: {e}")
+        raise HTTPException(status_code=502, detail=f"{type(e).__name__}: {e}")
+    return {**rendered, "elapsed_ms": round((time.perf_counter() - started) * 1000)}
+
+
+@app.get("/health")
+async def health():
+    rss = process_tree_rss()
+    return {
+        "status": "ok",
+        "browser_connected": _pool.browser_connected,
+        "in_flight": _pool.in_flight,
+        "renders": _pool.renders,
+        "browser_restarts": _pool.restarts,
+        "rss_mb": round(rss / 1024 / 1024, 1) if rss is not None else None,
+    }
+
+
+def serve() -> None:
+    import uvicorn
+    if RENDER_WORKER_URL.startswith(_UNIX_PREFIX):
+        path = RENDER_WORKER_URL[len(_UNIX_PREFIX):]
+        if os.path.exists(path):
+            os.unlink(path)  # left over by a server that was killed
+        uvicorn.run(app, uds=path)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=urlparse(RENDER_WORKER_URL).port or 80)
+
+
+def supervise() -> None:
+    """Run the server in a child process, restarting it whenever it exits"""
+    child: Optional[subprocess.Popen] = None
+    stopping = False
+    backoff = 1.0
+
+    def stop(signum, _frame):
+        nonlocal stopping
+        stopping = True
+        if child is not None and child.poll() is None:
+            child.send_signal(signum)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    while not stopping:
+        started = time.monotonic()
+        child = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve"])
+        code = child.wait()
+        if stopping:
+            break
+        if time.monotonic() - started >= RENDER_STABLE_SECONDS:
+            backoff = 1.0
+        print(f"💥 Render server exited with {code}, restarting in {backoff:.0f}s")
+        time.sleep(backoff)
+        backoff = min(backoff * 2, RENDER_RESTART_MAX_BACKOFF_SECONDS)
+
+
+# --- client (API workers) ---
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _render_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        if RENDER_WORKER_URL.startswith(_UNIX_PREFIX):
+            transport = httpx.AsyncHTTPTransport(uds=RENDER_WORKER_URL[len(_UNIX_PREFIX):])
+            _client = httpx.AsyncClient(transport=transport, base_url="http://render")
+        else:
+            _client = httpx.AsyncClient(base_url=RENDER_WORKER_URL)
+    return _client
+
+
+async def render_remote(url: str, timeout_seconds: float) -> Dict:
+    """Render `url` in the render service: {content, final_url, alt_content, elapsed_ms}"""
+    response = await _render_client().post(
+        "/render", json={"url": url, "timeout_seconds": timeout_seconds}, timeout=timeout_seconds + 10,
+    )
+    if response.status_code == 502:
+        raise RuntimeError(response.json()["detail"])
+    response.raise_for_status()
+    return response.json()
+
+
+async def close_render_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    if "--serve" in sys.argv:
+        serve()
+    else:
+        supervise()
@@ -0,0 +1,196 @@
+"""
+Chromium page rendering, shared by the in-process renderer (scraper.py) and the
+render service (render_worker.py): launch options, stealth init script, the
+navigation/wait sequence and clean-text extraction of the main content. Each
+context starts from the domain's stored session (browser_sessions.py).
+
+render_page returns the raw extraction; deciding what to keep (404 detection,
+short-content fallbacks) stays with the scraper.
+"""
+
+from typing import Callable, Dict, Optional
+from urllib.parse import urlparse
+
+from browser_sessions import get_session_store
+from executors import run_bookkeeping
+
+BROWSER_ARGS = [
+    '--no-sandbox',
+    '--disable-setuid-sandbox',
+    '--disable-dev-shm-usage',
+    '--disable-accelerated-2d-canvas',
+    '--no-first-run',
+    '--no-zygote',
+    '--disable-gpu',
+    '--disable-blink-features=AutomationControlled'
+]
+
+CONTEXT_OPTIONS = dict(
+    user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    viewport={'width': 1920, 'height': 1080},
+    locale='en-US',
+    timezone_id='America/New_York',
+    extra_http_headers={
+        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8',
+        'Accept-Language': 'en-US,en;q=0.9',
+        'Accept-Encoding': 'gzip, deflate, br',
+        'Cache-Control': 'no-cache',
+        'Pragma': 'no-cache',
+        'Sec-Fetch-Dest': 'document',
+        'Sec-Fetch-Mode': 'navigate',
+        'Sec-Fetch-Site': 'none',
+        'Sec-Fetch-User': '?1',
+        'Upgrade-Insecure-Requests': '1',
+    }
+)
+
+# Stealth: remove webdriver traces
+STEALTH_SCRIPT = """
+Object.defineProperty(navigator, 'webdriver', {
+    get: () => undefined,
+});
+
+// Mock plugins
+Object.defineProperty(navigator, 'plugins', {
+    get: () => [1, 2, 3, 4, 5],
+});
+
+// Mock languages
+Object.defineProperty(navigator, 'languages', {
+    get: () => ['en-US', 'en'],
+});
+"""
+
+# Extract PERFECT clean text content
+EXTRACT_SCRIPT = '''
+() => {
+    // Remove all problematic elements
+    const elementsToRemove = document.querySelectorAll('script, style, nav, header, footer, aside, noscript');
+    elementsToRemove.forEach(el => el.remove());
+
+    // Get main content with priority selectors
+    const selectors = [
+        'main', '[role="main"]', '.main-content', '.content',
+        '.policy-content', '.page-content', '.rte', '.shopify-policy__container',
+        'article', '.article', '[class*="policy"]', '[class*="shipping"]', '[class*="return"]'
+    ];
+
+    let mainElement = null;
+    for (const selector of selectors) {
+        const element = document.querySelector(selector);
+        if (element && element.innerText.length > 200) {
+            mainElement = element;
+            break;
+        }
+    }
+
+    // Fallback to body
+    const targetElement = mainElement || document.body;
+
+    // Get clean text - no HTML, no corruption
+    return targetElement.innerText || targetElement.textContent || '';
+}
+'''
+
+# Redirect targets of anti-bot walls: the session used is burnt
+WAF_BLOCK_MARKERS = ('walmart.com/blocked?',)
+
+# Below this, the page is likely blocked: Walmart gets a second, lighter load
+SHORT_CONTENT_CHARS = 600
+
+
+async def launch_browser(playwright):
+    return await playwright.chromium.launch(headless=True, args=BROWSER_ARGS)
+
+
+def _needs_warm_up(url: str) -> bool:
+    # Walmart help pages only load with the session cookies of a homepage visit
+    parsed_url = urlparse(url)
+    return 'walmart.com' in parsed_url.netloc and '/help/' in url
+
+
+def is_waf_block(final_url: str) -> bool:
+    return any(marker in final_url for marker in WAF_BLOCK_MARKERS)
+
+
+async def render_page(browser, url: str, timeout_ms: Callable[[float], float]) -> Dict:
+    """Render `url` in a fresh context of `browser`, reusing the domain's stored session.
+
+    timeout_ms(seconds) gives each step's timeout in ms (shrunk to the caller's
+    deadline). Returns content (main element text), final_url and, for short
+    Walmart pages, alt_content from a domcontentloaded-only load.
+    """
+    domain = urlparse(url).netloc.lower()
+    sessions = get_session_store()
+    # The session store is blocking sqlite3: keep it off the event loop
+    state = await run_bookkeeping(sessions.load, domain)
+    rendered, captured = await _render(browser, url, timeout_ms, state)
+    if is_waf_block(rendered['final_url']):
+        await run_bookkeeping(sessions.drop, domain)
+        if state is not None:
+            print(f"    🔄 Stored session for {domain} blocked, warming up a new one...")
+            rendered, captured = await _render(browser, url, timeout_ms, None)
+    if captured is not None:
+        await run_bookkeeping(sessions.save, domain, captured)
+    return rendered
+
+
+async def _render(browser, url: str, timeout_ms: Callable[[float], float], state: Optional[Dict]):
+    """(rendered page, storage state to keep for the domain or None)"""
+    context = await browser.new_context(storage_state=state, **CONTEXT_OPTIONS)
+    try:
+        page = await context.new_page()
+        await page.add_init_script(STEALTH_SCRIPT)
+
+        # For Walmart help pages: preload homepage to get session cookies (once per stored session)
+        parsed_url = urlparse(url)
+        if state is None and _needs_warm_up(url):
+            print(f"    🍪 Preloading Walmart homepage for session cookies...")
+            try:
+                await page.goto(f"{parsed_url.scheme}://{parsed_url.netloc}", timeout=timeout_ms(15), wait_until='domcontentloaded')
+                await page.wait_for_timeout(2000)  # Let cookies set
+            except Exception:
+                pass  # Continue even if homepage fails
+
+        # Navigate to target page
+        await page.goto(url, timeout=timeout_ms(30), wait_until='networkidle')
+
+        # Wait for dynamic content and potential anti-bot checks
+        await page.wait_for_timeout(3000)
+
+        # Try to wait for main content to load
+        try:
+            await page.wait_for_selector('main, [role="main"], .main-content, .content', timeout=timeout_ms(5))
+        except Exception:
+            pass  # Continue if no main content selector found
+        await page.wait_for_timeout(3000)  # Wait for JS to load content
+
+        # Detect WAF blocks via URL
+        final_url = page.url
+        blocked = is_waf_block(final_url)
+        if blocked:
+            print(f"    🚫 WAF block detected at {final_url}")
+        content = await page.evaluate(EXTRACT_SCRIPT)
+
+        alt_content = None
+        if content and 100 < len(content) < SHORT_CONTENT_CHARS and 'walmart.com' in url:
+            # Try without waiting for networkidle (faster load)
+            try:
+                alt_page = await context.new_page()
+                await alt_page.goto(url, timeout=timeout_ms(20), wait_until='domcontentloaded')
+                await alt_page.wait_for_timeout(1000)
+                alt_content = await alt_page.evaluate('() => document.body.innerText || document.body.textContent || ""')
+                await alt_page.close()
+            except Exception:
+                pass
+
+        captured = None
+        if state is None and not blocked:
+            try:
+                captured = await context.storage_state()
+            except Exception:
+                pass  # next render of the domain warms up again
+        return {'content': content, 'final_url': final_url, 'alt_content': alt_content}, captured
+    finally:
+        # Also runs on cancellation / deadline: closes the context and its pages
+        await context.close()
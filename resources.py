@@ -0,0 +1,57 @@
+"""
+Resource readings from /proc and the cgroup filesystem (Linux; None elsewhere).
+
+Used by admission control (admission.py) and the render service
+(render_worker.py) to follow memory, Chromium child processes included.
+"""
+
+import os
+from typing import Dict, Optional, Tuple
+
+_UNLIMITED = 1 << 60  # cgroup v1 reports "no limit" as a huge page-aligned number
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def _read(path: str) -> Optional[str]:
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _memory_stat(path: str) -> Dict[str, int]:
+    stat = {}
+    for line in (_read(path) or "").splitlines():
+        name, _, value = line.partition(" ")
+        if value.isdigit():
+            stat[name] = int(value)
+    return stat
+
+
+def container_memory() -> Tuple[Optional[int], Optional[int]]:
+    """(working set, limit) in bytes from the cgroup; None where not available"""
+    current = _read("/sys/fs/cgroup/memory.current")
+    if current is not None:  # cgroup v2
+        limit = _read("/sys/fs/cgroup/memory.max")
+        inactive = _memory_stat("/sys/fs/cgroup/memory.stat").get("inactive_file", 0)
+        return int(current) - inactive, int(limit) if limit and limit.isdigit() else None
+    usage = _read("/sys/fs/cgroup/memory/memory.usage_in_bytes")
+    if usage is not None:  # cgroup v1
+        limit = int(_read("/sys/fs/cgroup/memory/memory.limit_in_bytes") or _UNLIMITED)
+        inactive = _memory_stat("/sys/fs/cgroup/memory/memory.stat").get("total_inactive_file", 0)
+        return int(usage) - inactive, limit if limit < _UNLIMITED else None
+    return None, None
+
+
+def process_tree_rss(pid: int = None) -> Optional[int]:
+    """Resident bytes of a process and all its descendants (this worker + its Chromium processes)"""
+    pid = pid or os.getpid()
+    statm = _read(f"/proc/{pid}/statm")
+    if statm is None:
+        return None
+    total = int(statm.split()[1]) * _PAGE_SIZE
+    for tid in os.listdir(f"/proc/{pid}/task") if os.path.isdir(f"/proc/{pid}/task") else ():
+        for child in (_read(f"/proc/{pid}/task/{tid}/children") or "").split():
+            total += process_tree_rss(int(child)) or 0
+    return total
@@ -0,0 +1,131 @@
+"""
+Current-result-per-domain storage.
+
+analysis_results holds exactly one row per domain and is updated with an upsert;
+the version it replaces is copied to the append-only analysis_results_history
+table, which is pruned by age and by number of versions kept per domain.
+"""
+
+import os
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+from sqlalchemy import delete, func, select, text, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import dialect_insert
+from facts import FACT_FIELDS, extract_facts
+from models import AnalysisResult, AnalysisResultHistory
+from stats import record_result_added, record_result_removed
+
+POLICY_FIELDS = [
+    "shipping_policy",
+    "shipping_url",
+    "return_policy",
+    "return_url",
+    "self_help_returns",
+    "self_help_url",
+    "insurance",
+    "insurance_url",
+]
+
+# Retention for superseded versions; 0 disables the corresponding limit
+HISTORY_RETENTION_DAYS = int(os.getenv("RESULT_HISTORY_RETENTION_DAYS", 365))
+HISTORY_MAX_VERSIONS = int(os.getenv("RESULT_HISTORY_MAX_VERSIONS", 20))
+
+
+def domain_key(value: str) -> str:
+    """Normalize a domain (or URL) to the key stored in analysis_results.domain"""
+    value = (value or "").strip().lower()
+    if "://" in value:
+        value = urlparse(value).netloc
+    return value.split("/")[0].rstrip(".")
+
+
+async def _lock_domain(db: AsyncSession, domain: str) -> None:
+    """Serialize concurrent writers for one domain for the rest of the transaction"""
+    if db.bind.dialect.name == "postgresql":
+        await db.execute(text("SELECT pg_advisory_xact_lock(hashtext(:domain))"), {"domain": domain})
+    else:
+        # A write statement takes SQLite's database write lock even when no row matches
+        await db.execute(update(AnalysisResult).where(AnalysisResult.domain == domain).values(domain=domain))
+
+
+def _archive(current: AnalysisResult) -> AnalysisResultHistory:
+    return AnalysisResultHistory(
+        result_id=current.id,
+        domain=current.domain,
+        analyzed_at=current.analyzed_at,
+        archived_at=datetime.utcnow(),
+        **{field: getattr(current, field) for field in POLICY_FIELDS},
+    )
+
+
+async def save_result(db: AsyncSession, analysis: Dict, analyzed_at: Optional[datetime] = None) -> AnalysisResult:
+    """Upsert the current result for analysis['domain'], archiving the previous version.
+
+    Runs in the caller's transaction (the caller commits), so the archive, the
+    upsert and the stats counters change atomically.
+    """
+    domain = domain_key(analysis["domain"])
+    values = {field: analysis.get(field) for field in POLICY_FIELDS}
+    values["analyzed_at"] = analyzed_at or datetime.utcnow()
+    facts = {field: analysis[field] for field in FACT_FIELDS if field in analysis} or extract_facts(analysis)
+    values.update({field: facts.get(field) for field in FACT_FIELDS}, facts_extracted_at=datetime.utcnow())
+
+    await _lock_domain(db, domain)
+    current = await db.scalar(select(AnalysisResult).where(AnalysisResult.domain == domain))
+    if current is not None:
+        db.add(_archive(current))
+        await db.flush()
+        await record_result_removed(db, current)
+
+    stmt = dialect_insert(db)(AnalysisResult).values(domain=domain, **values)
+    stmt = stmt.on_conflict_do_update(index_elements=[AnalysisResult.domain], set_=values)
+    await db.execute(stmt)
+
+    result = await db.scalar(
+        select(AnalysisResult)
+        .where(AnalysisResult.domain == domain)
+        .execution_options(populate_existing=True)
+    )
+    await record_result_added(db, result)
+    await prune_history(db, domain)
+    return result
+
+
+async def prune_history(db: AsyncSession, domain: Optional[str] = None) -> None:
+    """Apply the retention policy, to one domain or (domain=None) to the whole archive"""
+    if HISTORY_RETENTION_DAYS > 0:
+        cutoff = datetime.utcnow() - timedelta(days=HISTORY_RETENTION_DAYS)
+        stmt = delete(AnalysisResultHistory).where(AnalysisResultHistory.archived_at < cutoff)
+        if domain:
+            stmt = stmt.where(AnalysisResultHistory.domain == domain)
+        await db.execute(stmt)
+
+    if HISTORY_MAX_VERSIONS > 0:
+        # Rank versions newest first within each domain; past the cap they go
+        rank = func.row_number().over(
+            partition_by=AnalysisResultHistory.domain,
+            order_by=(AnalysisResultHistory.analyzed_at.desc(), AnalysisResultHistory.id.desc()),
+        )
+        ranked = select(AnalysisResultHistory.id, rank.label("rank"))
+        if domain:
+            ranked = ranked.where(AnalysisResultHistory.domain == domain)
+        ranked = ranked.subquery()
+        await db.execute(
+            delete(AnalysisResultHistory)
+            .where(AnalysisResultHistory.id.in_(select(ranked.c.id).where(ranked.c.rank > HISTORY_MAX_VERSIONS)))
+        )
+
+
+async def read_history(db: AsyncSession, domain: str, limit: int = 20) -> List[AnalysisResultHistory]:
+    """Archived versions for a domain, newest first"""
+    rows = await db.scalars(
+        select(AnalysisResultHistory)
+        .where(AnalysisResultHistory.domain == domain_key(domain))
+        .order_by(AnalysisResultHistory.analyzed_at.desc(), AnalysisResultHistory.id.desc())
+        .limit(limit)
+    )
+    return rows.all()
@@ -0,0 +1,335 @@
+"""
+Deterministic pre-extraction of the four policy fields from scraped pages.
+
+Compiled EN/FR patterns (the same targets the analyzer's system prompt lists:
+"within X days", "FREE shipping over $X", "Ground: 3-5 business days",
+"returns portal", "Route package protection", ...) run over every scraped page
+and produce per-field candidates with a confidence score. When all four fields
+are confident the analyzer skips GPT-4 entirely; otherwise the candidates are
+passed to the model as hints.
+"""
+
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+from facts import (
+    INSURANCE_PROVIDERS, iter_durations, parse_free_shipping_threshold, parse_restocking_fee,
+    parse_return_window, parse_shipping_options,
+)
+
+RULE_FIELDS = ["shipping_policy", "return_policy", "self_help_returns", "insurance"]
+RULES_MIN_CONFIDENCE = float(os.getenv("RULES_MIN_CONFIDENCE", 0.8))
+# Lower bar used by the scraper to decide a field already has evidence (stop fetching pages)
+COVERAGE_MIN_CONFIDENCE = float(os.getenv("SCRAPE_COVERAGE_MIN_CONFIDENCE", 0.6))
+
+# Which page types are authoritative for each field (see EcommerceScraper._classify_page_type)
+_FIELD_PAGES = {
+    "shipping_policy": {"shipping"},
+    "return_policy": {"returns"},
+    "self_help_returns": {"returns", "help"},
+    "insurance": {"shipping", "help", "policy"},
+}
+
+_SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?])\s+|\n+")
+_MAX_EVIDENCE_CHARS = 300
+
+_SHIPPING_RE = re.compile(
+    r"free\s+(?:standard\s+)?shipping|shipping\s+(?:is\s+)?free|livraison\s+(?:gratuite|offerte)"
+    r"|\b(?:ground|standard|economy|express|expedited|2-day|next-day|overnight|priority)\s*(?:shipping|delivery)?\s*:"
+    r"|business\s+days|jours\s+ouvr|delivery\s+(?:time|window)|délai\s+de\s+livraison|ships?\s+within"
+    r"|order(?:s|ed)?\s+(?:placed\s+)?before\s+\d{1,2}(?::\d\d)?\s*(?:am|pm)",
+    re.IGNORECASE,
+)
+_RETURN_RE = re.compile(
+    r"return|refund|exchange|retour|rembours|échange|rétractation",
+    re.IGNORECASE,
+)
+_RETURN_CONDITIONS_RE = re.compile(
+    r"unworn|unused|unwashed|tags?\s+attached|original\s+(?:condition|packaging)|unopened|final\s+sale"
+    r"|non\s+(?:porté|utilisé)|étiquettes?|emballage\s+d'origine|état\s+d'origine",
+    re.IGNORECASE,
+)
+# Portal / online wording only: "start a return" alone is also what "email us to start a return" says
+_SELF_SERVICE_RE = re.compile(
+    r"returns?\s+(?:portal|center|centre)|online\s+returns?|self[\s-]service\s+returns?"
+    r"|(?:start|initiate|request|create|submit)\s+(?:a|your)\s+return\s+(?:online|here|at\s+\S+\.[a-z]{2,}|in\s+your\s+account)"
+    r"|returns\.[a-z0-9-]+\.[a-z]{2,}"
+    r"|loop\s?returns|happy\s?returns|returnly|narvar|aftership|redo\b|return\s+prime"
+    r"|portail\s+(?:de\s+)?retours?|retour\s+en\s+ligne|effectuer\s+(?:votre|un)\s+retour\s+en\s+ligne",
+    re.IGNORECASE,
+)
+# "[^.]" that lets e-mail addresses and hosts through: "email support@shop.com to start a return"
+_IN_SENTENCE = r"(?:[^.]|\.(?=\w))"
+_CONTACT_FOR_RETURN_RE = re.compile(
+    r"(?:contact|email|e-mail|call)\s+(?:our\s+|us\s+)?(?:customer\s+(?:service|care|support)|support|us|[\w.+-]+@[\w-]+\.\w)"
+    rf"{_IN_SENTENCE}{{0,80}}(?:return|refund|authori[sz]ation|RMA)"
+    rf"|(?:return|refund){_IN_SENTENCE}{{0,80}}(?:contact|email)\s+(?:our\s+|us\b|[\w.+-]+@)"
+    r"|return[^.]{0,40}\b(?:by|via|through)\s+(?:e-?mail|phone)"
+    r"|contactez\s+(?:notre\s+)?service\s+client[^.]{0,80}retour",
+    re.IGNORECASE,
+)
+_PROTECTION_RE = re.compile(
+    r"package\s+protection|shipping\s+(?:protection|insurance)|protection\s+plans?|extended\s+warranty"
+    r"|insured\s+shipping|assurance\s+(?:colis|livraison)|garantie\s+(?:étendue|commerciale)",
+    re.IGNORECASE,
+)
+
+# Negation in the clause just before a match: "we do not offer a returns portal", "no package protection"
+_NEGATION_RE = re.compile(
+    r"\b(?:not|no|never|cannot|unable|without|aucune?|sans|pas|ne|jamais)\b|n['’]t\b|\bn['’]",
+    re.IGNORECASE,
+)
+_NEGATION_WINDOW_CHARS = 40
+_CLAUSE_BREAK_RE = re.compile(r"[,;:()]")
+
+# Return apps named in the self-service value ("Yes - customers can initiate returns through Loop Returns")
+_RETURN_APPS = {
+    "Loop Returns": re.compile(r"loop\s?returns", re.IGNORECASE),
+    "Happy Returns": re.compile(r"happy\s?returns", re.IGNORECASE),
+    "Returnly": re.compile(r"returnly", re.IGNORECASE),
+    "Narvar": re.compile(r"narvar", re.IGNORECASE),
+    "AfterShip": re.compile(r"aftership", re.IGNORECASE),
+    "Redo": re.compile(r"\bredo\b", re.IGNORECASE),
+    "Return Prime": re.compile(r"return\s+prime", re.IGNORECASE),
+}
+_RETURNS_HOST_RE = re.compile(r"returns\.[a-z0-9-]+\.[a-z]{2,}", re.IGNORECASE)
+_CURRENCY_PREFIXES = {"USD": "$", "EUR": "€", "GBP": "£", "CAD": "CA$", "AUD": "AU$"}
+
+_INSURANCE_MENTION_RE = re.compile(r"insur|protect|warrant|assurance|garantie|coverage|couverture", re.IGNORECASE)
+# Inferred absence stays strictly below the skip threshold: GPT-4 always confirms it
+_NO_INSURANCE_CONFIDENCE = min(0.7, RULES_MIN_CONFIDENCE - 0.1)
+# Shipping without a price and a delivery time for every option (or with conflicting ones) too
+_PARTIAL_SHIPPING_CONFIDENCE = RULES_MIN_CONFIDENCE - 0.1
+
+
+def _sentences(text: str) -> List[str]:
+    return [s.strip() for s in _SENTENCE_SPLIT_RE.split(text or "") if 15 <= len(s.strip()) <= 400]
+
+
+def _negated(sentence: str, start: int) -> bool:
+    window = sentence[max(0, start - _NEGATION_WINDOW_CHARS):start]
+    clause = _CLAUSE_BREAK_RE.split(window)[-1]  # "If you're not satisfied, start a return" is not negated
+    return bool(_NEGATION_RE.search(clause))
+
+
+def _matches(sentences: List[str], pattern: re.Pattern) -> Tuple[List[str], List[str]]:
+    """(affirmed, negated) sentences matching `pattern`; affirmed if any match has no negation before it"""
+    affirmed, negated = [], []
+    for sentence in sentences:
+        starts = [match.start() for match in pattern.finditer(sentence)]
+        if starts:
+            (negated if all(_negated(sentence, start) for start in starts) else affirmed).append(sentence)
+    return affirmed, negated
+
+
+def _evidence(sentences: List[str]) -> str:
+    text = ""
+    for sentence in sentences:
+        if len(text) + len(sentence) > _MAX_EVIDENCE_CHARS:
+            break
+        text = f"{text} {sentence}".strip()
+    return text or sentences[0][:_MAX_EVIDENCE_CHARS]
+
+
+def _candidate(value: str, confidence: float, url: str, evidence: str = "") -> Dict:
+    """`value` follows the analyzer prompt's format for the field; `evidence` is the page text it comes from"""
+    return {"value": value, "confidence": round(min(confidence, 1.0), 2), "url": url, "evidence": evidence}
+
+
+def _money(amount: float, currency: Optional[str]) -> str:
+    number = f"{amount:.0f}" if amount == int(amount) else f"{amount:.2f}"
+    prefix = _CURRENCY_PREFIXES.get(currency or "USD", f"{currency} ")
+    return f"{prefix}{number}"
+
+
+def _days(days: int) -> str:
+    return f"{days} day" if days == 1 else f"{days} days"
+
+
+def _option_value(option: Dict) -> str:
+    """'Standard 3-5 days ($6.95)'"""
+    days = option["days"]
+    span = f"{option['min_days']}-{days} days" if option["min_days"] < days else _days(days)
+    if option["cost"] is None:
+        return f"{option['label']} {span}"
+    price = "FREE" if option["cost"] == 0 else _money(option["cost"], option["currency"])
+    return f"{option['label']} {span} ({price})"
+
+
+def _shipping_value(threshold: Optional[float], currency: Optional[str], options: List[Dict]) -> Optional[str]:
+    """'FREE shipping over $75. Standard 3-5 days ($6.95), Expedited 2 days ($14.95).'"""
+    parts = []
+    if threshold == 0.0:
+        parts.append("FREE shipping on all orders.")
+    elif threshold is not None:
+        parts.append(f"FREE shipping over {_money(threshold, currency)}.")
+    if options:
+        parts.append(", ".join(_option_value(option) for option in options) + ".")
+    return " ".join(parts) or None
+
+
+def _return_value(window: Optional[int], related: List[str]) -> Optional[str]:
+    """'30-day returns. Conditions: unworn, tags attached. No restocking fee.' from the sentences about returns"""
+    if window is None:
+        return None
+    value = f"{window}-day returns."
+    joined = " ".join(related)
+    terms = list(dict.fromkeys(match.group(0).lower() for match in _RETURN_CONDITIONS_RE.finditer(joined)))
+    if terms:
+        value += f" Conditions: {', '.join(terms)}."
+    restocking = parse_restocking_fee(joined)
+    if restocking is not None:
+        value += " Restocking fee applies." if restocking else " No restocking fee."
+    return value
+
+
+def _self_service_value(sentence: str) -> str:
+    for name, pattern in _RETURN_APPS.items():
+        if pattern.search(sentence):
+            return f"Yes - customers can initiate returns through {name}"
+    host = _RETURNS_HOST_RE.search(sentence)
+    if host:
+        return f"Yes - customers can initiate returns through {host.group(0).lower()}"
+    return "Yes - customers can initiate returns through the online returns portal"
+
+
+def _shipping_candidate(text: str, url: str, authoritative: bool) -> Optional[Dict]:
+    hits, _ = _matches(_sentences(text), _SHIPPING_RE)
+    if not hits:
+        return None
+    joined = " ".join(hits)
+    threshold, currency = parse_free_shipping_threshold(joined)
+    options = list({(o["label"], o["days"], o["cost"]): o for o in parse_shipping_options(joined)}.values())
+    standard = any(option["speed"] == "standard" for option in options)
+    express = any(option["speed"] == "express" for option in options)
+    confidence = 0.3 + 0.3 * (threshold is not None) + 0.2 * standard + 0.1 * express
+    confidence += 0.15 if authoritative else 0.0
+    # Skipping GPT-4 needs every option priced, and one reading per option (pages repeating it are fine)
+    labels = [option["label"].lower() for option in options]
+    if not options or any(option["cost"] is None for option in options) or len(set(labels)) < len(labels):
+        confidence = min(confidence, _PARTIAL_SHIPPING_CONFIDENCE)
+    quoted = [s for s in hits if parse_shipping_options(s)]
+    evidence = _evidence(quoted + [s for s in hits if s not in quoted])
+    return _candidate(_shipping_value(threshold, currency, options) or evidence, confidence, url, evidence)
+
+
+def _return_candidate(text: str, url: str, authoritative: bool) -> Optional[Dict]:
+    related = [s for s in _sentences(text) if _RETURN_RE.search(s)]
+    hits = [s for s in related if any(True for _ in iter_durations(s))]
+    if not hits:
+        return None
+    window = parse_return_window(" ".join(hits))
+    conditions = [s for s in related if _RETURN_CONDITIONS_RE.search(s)]
+    confidence = 0.35 + 0.3 * (window is not None) + 0.15 * bool(conditions) + (0.2 if authoritative else 0.0)
+    evidence = _evidence(hits[:1] + [s for s in conditions if s not in hits[:1]])
+    return _candidate(_return_value(window, related) or evidence, confidence, url, evidence)
+
+
+def _self_service_candidate(text: str, url: str, authoritative: bool) -> Optional[Dict]:
+    sentences = _sentences(text)
+    # Contact-to-return sentences first: "email support@... to start a return" is never self-service
+    contact, _ = _matches(sentences, _CONTACT_FOR_RETURN_RE)
+    portal, no_portal = _matches([s for s in sentences if s not in contact], _SELF_SERVICE_RE)
+    if portal:
+        # A page that also denies a portal ("not for sale items") is weaker evidence
+        confidence = 0.7 + (0.2 if authoritative else 0.0) - (0.2 if no_portal else 0.0)
+        return _candidate(_self_service_value(portal[0]), confidence, url, _evidence(portal[:1]))
+    if contact:
+        return _candidate("No - returns require contacting customer service",
+                          0.6 + (0.2 if authoritative else 0.0), url, _evidence(contact[:1]))
+    if no_portal:
+        return _candidate("No - no self-service returns portal offered",
+                          0.5 + (0.2 if authoritative else 0.0), url, _evidence(no_portal[:1]))
+    return None
+
+
+def _insurance_candidate(text: str, url: str, authoritative: bool) -> Optional[Dict]:
+    sentences = _sentences(text)
+    for name, pattern in INSURANCE_PROVIDERS.items():
+        hits, _ = _matches(sentences, pattern)
+        if hits:
+            evidence = _evidence(hits[:2])
+            at_checkout = " at checkout" if "checkout" in evidence.lower() else ""
+            return _candidate(f"Yes - {name} protection offered{at_checkout}",
+                              0.85 + (0.1 if authoritative else 0.0), url, evidence)
+    hits, denials = _matches(sentences, _PROTECTION_RE)
+    if hits:
+        evidence = _evidence(hits[:2])
+        plan = _PROTECTION_RE.search(hits[0]).group(0).lower()
+        at_checkout = " at checkout" if "checkout" in evidence.lower() else ""
+        return _candidate(f"Yes - {plan} offered{at_checkout}", 0.65 + (0.15 if authoritative else 0.0), url, evidence)
+    if denials:
+        return _candidate("No - no protection offered", 0.5 + (0.15 if authoritative else 0.0), url,
+                          _evidence(denials[:1]))
+    return None
+
+
+_EXTRACTORS = {
+    "shipping_policy": _shipping_candidate,
+    "return_policy": _return_candidate,
+    "self_help_returns": _self_service_candidate,
+    "insurance": _insurance_candidate,
+}
+
+
+def extract_candidates(scraped_data: Dict, infer_absence: bool = True) -> Dict[str, List[Dict]]:
+    """Per-field candidates over all scraped pages, best first.
+
+    infer_absence=False drops the "no insurance mentioned" candidate, which only
+    holds once every page has been read.
+    """
+    candidates = {field: [] for field in RULE_FIELDS}
+    for page_key, page in (scraped_data.get("policy_pages") or {}).items():
+        page_type = re.sub(r"_\d+$", "", page_key)  # 'returns_1' -> 'returns'
+        content, url = page.get("content") or "", page.get("url") or scraped_data.get("main_url", "")
+        for field, extractor in _EXTRACTORS.items():
+            candidate = extractor(content, url, page_type in _FIELD_PAGES[field])
+            if candidate:
+                candidates[field].append(candidate)
+
+    # Absence is only evidence when both core policy pages were read and nothing mentions protection
+    pages = scraped_data.get("policy_pages") or {}
+    page_types = {re.sub(r"_\d+$", "", key) for key in pages}
+    if (infer_absence and not candidates["insurance"] and {"shipping", "returns"} <= page_types
+            and not any(_INSURANCE_MENTION_RE.search(page.get("content") or "") for page in pages.values())):
+        candidates["insurance"].append(_candidate(
+            "No - no shipping protection or insurance mentioned on the policy pages",
+            _NO_INSURANCE_CONFIDENCE, pages["shipping"].get("url", ""),
+        ))
+
+    for field in RULE_FIELDS:
+        candidates[field].sort(key=lambda c: c["confidence"], reverse=True)
+    return candidates
+
+
+def best_candidates(candidates: Dict[str, List[Dict]]) -> Dict[str, Optional[Dict]]:
+    return {field: (candidates[field][0] if candidates[field] else None) for field in RULE_FIELDS}
+
+
+def is_confident(best: Dict[str, Optional[Dict]], threshold: float = RULES_MIN_CONFIDENCE) -> bool:
+    """True when every field has a candidate at or above `threshold` (the LLM can be skipped)"""
+    return all(best[field] and best[field]["confidence"] >= threshold for field in RULE_FIELDS)
+
+
+def coverage_map(scraped_data: Dict, threshold: float = COVERAGE_MIN_CONFIDENCE) -> Dict[str, Dict]:
+    """Per-field evidence found so far: {field: {covered, confidence, url}} (positive evidence only)"""
+    best = best_candidates(extract_candidates(scraped_data, infer_absence=False))
+    return {
+        field: {
+            "covered": bool(candidate and candidate["confidence"] >= threshold),
+            "confidence": candidate["confidence"] if candidate else 0.0,
+            "url": candidate["url"] if candidate else None,
+        }
+        for field, candidate in best.items()
+    }
+
+
+def format_hints(best: Dict[str, Optional[Dict]]) -> str:
+    """Rule hits as a prompt section; the model verifies them against the page content"""
+    lines = [
+        f"- {field} (confidence {candidate['confidence']}, {candidate['url']}): {candidate['value']}"
+        + (f' (from: "{candidate["evidence"]}")' if candidate["evidence"] and candidate["evidence"] != candidate["value"] else "")
+        for field, candidate in best.items() if candidate
+    ]
+    return "\n".join(lines)
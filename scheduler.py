@@ -0,0 +1,253 @@
+"""
+Job queue scheduler: which pending job runs next, and when.
+
+POST /analyze and /analyze/batch only insert 'pending' rows; every worker runs a
+dispatcher that starts up to JOB_CONCURRENCY jobs at a time, claiming each with
+a conditional UPDATE (pending -> processing) so a job runs on exactly one worker.
+The next job is picked by:
+
+1. priority - interactive single-URL requests (JOB_PRIORITY_INTERACTIVE) before
+   batch submissions (JOB_PRIORITY_BATCH); a waiting job gains one level every
+   JOB_PRIORITY_AGING_SECONDS so batches are never starved;
+2. fair share - among equal priorities, the submitter with the fewest jobs
+   running (all workers) goes first, so one 2,000-domain batch does not hold
+   every slot while another submitter waits;
+3. shortest expected job first - from the domain's history: a job resuming
+   from its checkpoints is nearly free ('cached'), a Shopify store takes the
+   fast path ('shopify'), anything else needs the browser and Firecrawl
+   ('heavy'); durations of the domain's recent runs refine the class default.
+
+JOB_INTERACTIVE_RESERVED_SLOTS of the slots only take interactive jobs, so a
+single URL starts right away even while batches fill the rest. JOB_CONCURRENCY
+is a ceiling: the number of slots follows memory headroom (admission.py).
+"""
+
+import asyncio
+import os
+import uuid
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from sqlalchemy import func, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from admission import AdaptiveConcurrency
+from database import SessionLocal
+from metrics import JOBS_QUEUED
+from models import AnalysisJob, JobCheckpoint
+
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", 8))
+JOB_INTERACTIVE_RESERVED_SLOTS = int(os.getenv("JOB_INTERACTIVE_RESERVED_SLOTS", 1))
+JOB_PRIORITY_INTERACTIVE = int(os.getenv("JOB_PRIORITY_INTERACTIVE", 10))
+JOB_PRIORITY_BATCH = int(os.getenv("JOB_PRIORITY_BATCH", 0))
+JOB_PRIORITY_AGING_SECONDS = float(os.getenv("JOB_PRIORITY_AGING_SECONDS", 300))
+# Pick up jobs queued through other workers (jobs queued here wake the dispatcher at once)
+SCHEDULER_POLL_SECONDS = float(os.getenv("SCHEDULER_POLL_SECONDS", 1))
+
+# Expected duration per cost class until a domain has history of its own
+COST_DEFAULT_SECONDS = {
+    "cached": float(os.getenv("JOB_COST_CACHED_SECONDS", 5)),
+    "shopify": float(os.getenv("JOB_COST_SHOPIFY_SECONDS", 30)),
+    "heavy": float(os.getenv("JOB_COST_HEAVY_SECONDS", 120)),
+    "unknown": float(os.getenv("JOB_COST_UNKNOWN_SECONDS", 60)),
+}
+COST_HISTORY_RUNS = 5  # recent completed runs of a domain averaged into its estimate
+CANDIDATES_PER_SUBMITTER = 5
+_IN_CHUNK = 500
+
+
+def job_domain(url: str) -> str:
+    return urlparse(url).netloc.lower()
+
+
+def run_cost_class(scraped_data: Dict, resumed: bool) -> str:
+    """Cost class of a run that just finished (what the next estimate for its domain is based on)"""
+    if resumed:
+        return "cached"  # partly restored from checkpoints: not representative of a full run
+    return "shopify" if scraped_data.get("is_shopify") else "heavy"
+
+
+async def estimate_costs(db: AsyncSession, domains: Iterable[str]) -> Dict[str, Tuple[str, float]]:
+    """domain -> (cost class, expected seconds) from the domain's recent full runs"""
+    domains = list(set(domains))
+    runs: Dict[str, List[Tuple[str, float]]] = {}
+    for i in range(0, len(domains), _IN_CHUNK):
+        rows = await db.execute(
+            select(AnalysisJob.domain, AnalysisJob.cost_class, AnalysisJob.started_at, AnalysisJob.completed_at)
+            .where(
+                AnalysisJob.domain.in_(domains[i:i + _IN_CHUNK]),
+                AnalysisJob.status == "completed",
+                AnalysisJob.started_at.is_not(None),
+                AnalysisJob.cost_class.in_(("shopify", "heavy")),
+            )
+            .order_by(AnalysisJob.completed_at.desc())
+        )
+        for domain, cost_class, started_at, completed_at in rows:
+            recent = runs.setdefault(domain, [])
+            if len(recent) < COST_HISTORY_RUNS:
+                recent.append((cost_class, (completed_at - started_at).total_seconds()))
+
+    estimates = {}
+    for domain in domains:
+        recent = runs.get(domain)
+        if not recent:
+            estimates[domain] = ("unknown", COST_DEFAULT_SECONDS["unknown"])
+            continue
+        cost_class = recent[0][0]  # the latest run says which path the site takes now
+        seconds = [duration for run_class, duration in recent if run_class == cost_class]
+        estimates[domain] = (cost_class, sum(seconds) / len(seconds))
+    return estimates
+
+
+async def estimate_requeued(db: AsyncSession, job: AnalysisJob) -> None:
+    """Re-estimate a job going back to the queue (retry, orphan recovery): checkpoints make it cheaper"""
+    stages = set(await db.scalars(select(JobCheckpoint.stage).where(JobCheckpoint.job_id == job.id).distinct()))
+    if stages & {"llm", "analysis"}:
+        job.cost_class, job.expected_seconds = "cached", COST_DEFAULT_SECONDS["cached"]
+
+
+async def enqueue_jobs(db: AsyncSession, urls: List[str], priority: int, submitter: Optional[str],
+                       batch_id: Optional[str] = None) -> List[AnalysisJob]:
+    """Insert pending jobs (one transaction) and wake the dispatcher"""
+    estimates = await estimate_costs(db, (job_domain(url) for url in urls))
+    now = datetime.utcnow()
+    jobs = []
+    for url in urls:
+        domain = job_domain(url)
+        cost_class, expected_seconds = estimates[domain]
+        jobs.append(AnalysisJob(
+            id=str(uuid.uuid4()), url=url, status="pending", created_at=now,
+            priority=priority, submitter=submitter, batch_id=batch_id, domain=domain,
+            cost_class=cost_class, expected_seconds=expected_seconds,
+        ))
+    db.add_all(jobs)
+    await db.commit()
+    wake_scheduler()
+    return jobs
+
+
+def _effective_priority(job, now: datetime) -> int:
+    waited = max((now - job.created_at).total_seconds(), 0.0) if job.created_at else 0.0
+    return job.priority + int(waited // JOB_PRIORITY_AGING_SECONDS)
+
+
+class Scheduler:
+    def __init__(self, run: Callable[[str, str], Awaitable[None]]):
+        self.run = run
+        self.running: Dict[str, asyncio.Task] = {}  # job_id -> task, jobs started by this worker
+        self.concurrency = AdaptiveConcurrency(JOB_CONCURRENCY)
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._dispatch_forever())
+
+    def wake(self) -> None:
+        self._wakeup.set()
+
+    async def stop(self) -> None:
+        self._task.cancel()
+        # Interrupted jobs keep status 'processing'; once their heartbeat is stale they are resumed elsewhere
+        for task in self.running.values():
+            task.cancel()
+        await asyncio.gather(self._task, *self.running.values(), return_exceptions=True)
+
+    async def _dispatch_forever(self) -> None:
+        while True:
+            try:
+                await self._dispatch()
+            except Exception as e:
+                print(f"⚠️ Scheduler: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), SCHEDULER_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _dispatch(self) -> None:
+        async with SessionLocal() as db:
+            JOBS_QUEUED.set(await db.scalar(select(func.count()).where(AnalysisJob.status == "pending")))
+            limit = self.concurrency.update(len(self.running))
+            while len(self.running) < limit:
+                interactive_only = len(self.running) >= max(limit - JOB_INTERACTIVE_RESERVED_SLOTS, 1)
+                job = await self._next_job(db, interactive_only)
+                if job is None:
+                    return
+                if await self._claim(db, job.id):
+                    self._start(job.id, job.url)
+                    JOBS_QUEUED.dec()
+
+    async def _next_job(self, db: AsyncSession, interactive_only: bool):
+        # Per submitter: its best few by (priority, expected cost) plus its oldest job, which aging may promote
+        best = func.row_number().over(
+            partition_by=AnalysisJob.submitter,
+            order_by=(AnalysisJob.priority.desc(), AnalysisJob.expected_seconds, AnalysisJob.created_at),
+        ).label("best")
+        oldest = func.row_number().over(partition_by=AnalysisJob.submitter, order_by=AnalysisJob.created_at).label("oldest")
+        ranked = select(
+            AnalysisJob.id, AnalysisJob.url, AnalysisJob.priority, AnalysisJob.submitter,
+            AnalysisJob.expected_seconds, AnalysisJob.created_at, best, oldest,
+        ).where(AnalysisJob.status == "pending")
+        if interactive_only:
+            ranked = ranked.where(AnalysisJob.priority >= JOB_PRIORITY_INTERACTIVE)
+        ranked = ranked.subquery()
+        candidates = (await db.execute(
+            select(ranked).where(or_(ranked.c.best <= CANDIDATES_PER_SUBMITTER, ranked.c.oldest == 1))
+        )).all()
+        if not candidates:
+            return None
+
+        running = dict((await db.execute(
+            select(AnalysisJob.submitter, func.count())
+            .where(AnalysisJob.status == "processing")
+            .group_by(AnalysisJob.submitter)
+        )).all())
+        now = datetime.utcnow()
+        return min(candidates, key=lambda job: (
+            -_effective_priority(job, now),
+            running.get(job.submitter, 0),
+            job.expected_seconds if job.expected_seconds is not None else COST_DEFAULT_SECONDS["unknown"],
+            job.created_at or now,
+        ))
+
+    async def _claim(self, db: AsyncSession, job_id: str) -> bool:
+        now = datetime.utcnow()
+        result = await db.execute(
+            update(AnalysisJob)
+            .where(AnalysisJob.id == job_id, AnalysisJob.status == "pending")
+            .values(status="processing", started_at=now, heartbeat_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+        return result.rowcount == 1  # 0: another worker took it, or it was cancelled meanwhile
+
+    def _start(self, job_id: str, url: str) -> None:
+        task = asyncio.create_task(self.run(job_id, url))
+        self.running[job_id] = task
+
+        def done(_):
+            self.running.pop(job_id, None)
+            self.wake()
+        task.add_done_callback(done)
+
+
+_scheduler: Optional[Scheduler] = None
+
+
+def start_scheduler(run: Callable[[str, str], Awaitable[None]]) -> Scheduler:
+    """Start this worker's dispatcher (startup); `run(job_id, url)` processes a claimed job"""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = Scheduler(run)
+    return _scheduler
+
+
+def wake_scheduler() -> None:
+    """Dispatch now rather than at the next poll (a job was queued or a slot freed)"""
+    if _scheduler is not None:
+        _scheduler.wake()
+
+
+async def stop_scheduler() -> None:
+    global _scheduler
+    if _scheduler is not None:
+        await _scheduler.stop()
+        _scheduler = None
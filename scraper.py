@@ -1,31 +1,119 @@
 
 import asyncio
+import os
 import re
+import time
 from urllib.parse import urlparse
 from typing import Dict, Optional, List
 import requests
+from requests.adapters import HTTPAdapter
 from bs4 import BeautifulSoup
+from rule_extractor import coverage_map
+from deadline import budget_exhausted, budget_timeout, time_left
+from executors import run_bookkeeping, run_io
+from checkpoints import checkpoint, save_checkpoint
+from metrics import ACTIVE_BROWSERS, record_fetch, stage
+from host_health import (
+    HostUnavailable, classify_content, classify_error, classify_status, get_host_health, host_of, host_turn,
+    host_turn_sync, record_outcome,
+)
+from tracing import span
+
+# Incremental scraping: stop once every field has evidence, or when the page/time budget is spent
+SCRAPE_MAX_PAGES = int(os.getenv("SCRAPE_MAX_PAGES", 10))
+SCRAPE_TIME_BUDGET_SECONDS = float(os.getenv("SCRAPE_TIME_BUDGET_SECONDS", 60))
+SCRAPE_PAGE_DELAY_SECONDS = float(os.getenv("SCRAPE_PAGE_DELAY_SECONDS", 1.5))
+# Stop scraping pages when less than this is left of the job deadline (kept for analysis + save)
+SCRAPE_DEADLINE_RESERVE_SECONDS = float(os.getenv("SCRAPE_DEADLINE_RESERVE_SECONDS", 90))
+# Policy page renderer: "playwright" (default, Chromium in this worker), "service" (the render
+# service, render_worker.py) or "requests" where no browser is available
+SCRAPE_RENDERER = os.getenv("SCRAPE_RENDERER", "playwright").strip().lower()
+# Chromium instances open at once per worker ("playwright" renderer); further renders wait for a free browser
+SCRAPE_MAX_BROWSERS = int(os.getenv("SCRAPE_MAX_BROWSERS", 4))
+_browser_slots = asyncio.Semaphore(SCRAPE_MAX_BROWSERS)
+
+# Connection pooling for target sites (per worker process)
+SCRAPER_POOL_HOSTS = int(os.getenv("SCRAPER_POOL_HOSTS", 50))
+SCRAPER_POOL_SIZE_PER_HOST = int(os.getenv("SCRAPER_POOL_SIZE_PER_HOST", 4))
+
 # Optional legacy helper removed by cleanup; provide a no-op fallback
 def find_policy_links(domain: str, limit: int = 10, max_pages: int = 50):
     return []
 
+def _playwright_timeout(seconds: float) -> float:
+    """Playwright timeout (ms), shrunk to the job's time left"""
+    return budget_timeout(seconds) * 1000
+
+
+SCRAPER_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Accept-Encoding': 'gzip, deflate, br',
+    'Connection': 'keep-alive',
+    'Upgrade-Insecure-Requests': '1',
+    'Sec-Fetch-Dest': 'document',
+    'Sec-Fetch-Mode': 'navigate',
+    'Sec-Fetch-Site': 'none',
+    'Sec-Ch-Ua': '"Not_A Brand";v="8", "Chromium";v="120", "Google Chrome";v="120"',
+    'Sec-Ch-Ua-Mobile': '?0',
+    'Sec-Ch-Ua-Platform': '"Windows"'
+}
+
+def new_http_session() -> requests.Session:
+    """Session with browser-like headers and a keep-alive pool per target host"""
+    session = requests.Session()
+    session.headers.update(SCRAPER_HEADERS)
+    adapter = HTTPAdapter(pool_connections=SCRAPER_POOL_HOSTS, pool_maxsize=SCRAPER_POOL_SIZE_PER_HOST)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+# Main content containers, tried in order: the first one with more than 200 chars of text wins
+CONTENT_SELECTORS = [
+    'main', '[role="main"]', '.main-content', '.content',
+    '.policy-content', '.page-content', '.rte', '.shopify-policy__container',
+    'article', '.article', '[class*="policy"]', '[class*="shipping"]', '[class*="return"]'
+]
+
+
+def extract_page_text(html: str) -> str:
+    """Visible text of the page's main content area (requests tier, no network; see benchmarks/)"""
+    soup = BeautifulSoup(html, 'html.parser')
+    
+    # SIMPLE AND EFFECTIVE cleaning (like the working version)
+    # Remove script and style elements
+    for script in soup(["script", "style", "nav", "header", "footer"]):
+        script.decompose()
+    
+    # Try to find main content area
+    main_content = None
+    for selector in CONTENT_SELECTORS:
+        elements = soup.select(selector)
+        for element in elements:
+            text = element.get_text(strip=True)
+            if len(text) > 200:
+                main_content = element
+                break
+        if main_content:
+            break
+    
+    # If no main content found, use body
+    if not main_content:
+        main_content = soup.body or soup
+    
+    # Extract text (SIMPLE approach like working version)
+    text = main_content.get_text(separator=' ', strip=True)
+    
+    # Clean text (SIMPLE like working version)
+    text = re.sub(r'\s+', ' ', text)
+    return text.strip()
+
+
 class EcommerceScraper:
-    def __init__(self):
-        self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
-            'Accept-Language': 'en-US,en;q=0.9',
-            'Accept-Encoding': 'gzip, deflate, br',
-            'Connection': 'keep-alive',
-            'Upgrade-Insecure-Requests': '1',
-            'Sec-Fetch-Dest': 'document',
-            'Sec-Fetch-Mode': 'navigate',
-            'Sec-Fetch-Site': 'none',
-            'Sec-Ch-Ua': '"Not_A Brand";v="8", "Chromium";v="120", "Google Chrome";v="120"',
-            'Sec-Ch-Ua-Mobile': '?0',
-            'Sec-Ch-Ua-Platform': '"Windows"'
-        })
+    def __init__(self, session: Optional[requests.Session] = None):
+        # Pass the app-scoped session (clients.py) to reuse connections across jobs
+        self.session = session or new_http_session()
         
     async def __aenter__(self):
         return self
@@ -35,60 +123,118 @@ class EcommerceScraper:
 
     async def scrape_website(self, url: str) -> Dict:
         """NEW OPTIMIZED scraper - uses complete_crawler to find ALL links first"""
-        domain = urlparse(url).netloc
+        parsed = urlparse(url)
+        domain = parsed.netloc
+        scheme = parsed.scheme or "https"  # http for local stand-ins (load tests)
         
         scraped_content = {
             'domain': domain,
             'main_url': url,
-            'policy_pages': {}
+            'policy_pages': {},
+            'coverage': {},  # per-field evidence found so far (see rule_extractor.coverage_map)
+            'stop_reason': None
         }
         
         try:
             print(f"🔍 Scraping {url}...")
             
+            # Host blocking us lately (host_health.py): no direct requests, Firecrawl takes over
+            if await self._host_open(domain):
+                return self._circuit_open(scraped_content)
+            
             # STEP 1: Get main page with requests (fast)
-            main_content = self._get_page_content_requests(url)
+            # Each step's output is checkpointed: a retried/resumed job skips what it already did
+            main_page = checkpoint("main_page")
+            if main_page is None:
+                main_page = {'content': await run_io(self._get_page_content_requests, url)}
+                if main_page['content']:
+                    await save_checkpoint("main_page", main_page)
+            main_content = main_page['content']
             if main_content:
                 scraped_content['policy_pages']['main'] = {
                     'url': url,
                     'content': main_content
                 }
                 print(f"✅ Main page scraped: {len(main_content)} chars")
+            scraped_content['coverage'] = coverage_map(scraped_content)
             
             # STEP 2: Decide path based on Shopify detection
             try:
-                if await self._is_shopify_site(domain):
+                platform = checkpoint("platform")
+                if platform is None:
+                    with stage("platform_detection"):
+                        platform = {'is_shopify': await self._is_shopify_site(domain, scheme)}
+                    if await self._host_open(domain):  # detection probes were blocked: the answer means nothing
+                        return self._circuit_open(scraped_content)
+                    await save_checkpoint("platform", platform)
+                is_shopify = platform['is_shopify']
+                if is_shopify:
                     print("  🛍️ Shopify site detected, using smart approach...")
                     scraped_content['is_shopify'] = True
-                    policy_urls = await self._get_shopify_policy_urls(domain)
+                    policy_urls = checkpoint("urls")
+                    if policy_urls is None:
+                        with stage("url_discovery"):
+                            policy_urls = await self._get_shopify_policy_urls(domain, scheme)
+                        if await self._host_open(domain):
+                            return self._circuit_open(scraped_content)
+                        await save_checkpoint("urls", policy_urls)
                     print(f"🔗 Found {len(policy_urls)} Shopify policy URLs")
                 else:
                     print("  🔥 Non-Shopify site: skipping internal crawl; Firecrawl will handle discovery")
                     scraped_content['is_shopify'] = False
+                    scraped_content['stop_reason'] = 'not_shopify'
                     return scraped_content
             except Exception as e:
                 print(f"  ⚠️ Shopify detection error: {e}")
                 scraped_content['is_shopify'] = False
+                scraped_content['stop_reason'] = 'not_shopify'
                 return scraped_content
             
-            # STEP 3: SCRAPE ALL PAGES - let AI decide what's useful
+            # STEP 3: SCRAPE PAGES INCREMENTALLY - stop as soon as every field has evidence
             scraped_count = 0
-            max_pages = 10  # Scrape more pages for better AI analysis
+            started = time.monotonic()
+            scraped_content['stop_reason'] = 'urls_exhausted'
             
-            print(f"  📚 Scraping ALL policy pages for comprehensive AI analysis...")
+            print(f"  📚 Scraping policy pages until every field is covered...")
             
             for i, page_url in enumerate(policy_urls, 1):
-                # ONLY stop if we hit the limit
-                if scraped_count >= max_pages:
-                    print(f"  ⏹️ Reached limit of {max_pages} pages")
+                if all(field['covered'] for field in scraped_content['coverage'].values()):
+                    scraped_content['stop_reason'] = 'all_fields_covered'
+                    print(f"  ✅ All fields covered after {scraped_count} page(s), stopping early")
+                    break
+                if scraped_count >= SCRAPE_MAX_PAGES:
+                    scraped_content['stop_reason'] = 'max_pages'
+                    print(f"  ⏹️ Reached limit of {SCRAPE_MAX_PAGES} pages")
+                    break
+                if time.monotonic() - started >= SCRAPE_TIME_BUDGET_SECONDS:
+                    scraped_content['stop_reason'] = 'time_budget'
+                    print(f"  ⏱️ Time budget of {SCRAPE_TIME_BUDGET_SECONDS:.0f}s spent, stopping")
+                    break
+                if time_left() < SCRAPE_DEADLINE_RESERVE_SECONDS:
+                    scraped_content['stop_reason'] = 'job_deadline'
+                    print(f"  ⏱️ Job deadline in {time_left():.0f}s, leaving the rest for analysis")
+                    break
+                if checkpoint("page", page_url) is None and await self._host_open(domain):
+                    scraped_content['stop_reason'] = 'circuit_open'
+                    print(f"  ⛔ {domain} is blocking direct requests, leaving the rest to Firecrawl")
                     break
                     
                 try:
                     print(f"  📄 [{i}/{len(policy_urls)}] Scraping: {page_url}")
                     
-                    # USE PLAYWRIGHT FOR ALL SITES - no more BeautifulSoup corruption
-                    print(f"    🎭 Using Playwright for clean content extraction...")
-                    content = await self._get_clean_content_playwright(page_url)
+                    saved_page = checkpoint("page", page_url)
+                    if saved_page is not None:
+                        print(f"    ♻️ From checkpoint")
+                        content = saved_page['content']
+                    elif SCRAPE_RENDERER == "requests":
+                        # No browser (load tests, hosts without Chromium): plain HTTP + BeautifulSoup
+                        content = await run_io(self._get_page_content_requests, page_url)
+                    else:
+                        # USE PLAYWRIGHT FOR ALL SITES - no more BeautifulSoup corruption
+                        print(f"    🎭 Using Playwright for clean content extraction...")
+                        content = await self._get_clean_content_playwright(page_url)
+                    if saved_page is None and content:  # failed fetches are tried again on resume
+                        await save_checkpoint("page", {'content': content}, key=page_url)
                     
                     if content and len(content) > 200:  # Minimum content threshold
                         page_type = self._classify_page_type(page_url, content)
@@ -102,26 +248,57 @@ class EcommerceScraper:
                         }
                         scraped_count += 1
                         
-                        print(f"    📝 Stored as: {page_key} ({len(content)} chars)")
+                        # Cheap local check (rule_extractor patterns) of what is covered so far
+                        scraped_content['coverage'] = coverage_map(scraped_content)
+                        covered = [name for name, field in scraped_content['coverage'].items() if field['covered']]
+                        print(f"    📝 Stored as: {page_key} ({len(content)} chars) - covered: {', '.join(covered) or 'none'}")
                         
-                        # Add human-like delay between requests
-                        import time
-                        time.sleep(1.5)  # 1.5 second delay to avoid being flagged as bot
+                        # Add human-like delay between requests (without blocking the event loop)
+                        if saved_page is None:
+                            await asyncio.sleep(SCRAPE_PAGE_DELAY_SECONDS)
                     else:
                         print(f"    🚫 Page skipped (404/not found or too short content)")
                         
+                except HostUnavailable as e:
+                    scraped_content['stop_reason'] = 'circuit_open'
+                    print(f"  ⛔ {e}, leaving the rest to Firecrawl")
+                    break
                 except Exception as e:
                     print(f"  ❌ Error scraping {page_url}: {e}")
                     continue
+            else:
+                if all(field['covered'] for field in scraped_content['coverage'].values()):
+                    scraped_content['stop_reason'] = 'all_fields_covered'
             
+            scraped_content['scrape_seconds'] = round(time.monotonic() - started, 2)
             print(f"📄 Total pages scraped: {len(scraped_content['policy_pages'])}")
-            print(f"📚 ALL pages will be sent to AI for comprehensive analysis")
+            print(f"🛑 Stop reason: {scraped_content['stop_reason']} ({scraped_content['scrape_seconds']}s)")
             
         except Exception as e:
             print(f"❌ Error scraping {url}: {e}")
         
         return scraped_content
 
+    async def _host_open(self, domain: str) -> bool:
+        return await run_bookkeeping(get_host_health().is_open, host_of(domain))
+
+    def _circuit_open(self, scraped_content: Dict) -> Dict:
+        print(f"  ⛔ Circuit open for {scraped_content['domain']}: no direct scraping, Firecrawl will handle it")
+        scraped_content['stop_reason'] = 'circuit_open'
+        return scraped_content
+
+    async def _request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Direct request to a target site, paced and tracked per host (host_health.py)"""
+        host = host_of(url)
+        await host_turn(host)
+        try:
+            response = await run_io(getattr(self.session, method), url, **kwargs)
+        except Exception as e:
+            await run_bookkeeping(record_outcome, host, classify_error(e))
+            raise
+        await run_bookkeeping(record_outcome, host, classify_status(response.status_code))
+        return response
+
     def _classify_page_type(self, url: str, content: str) -> str:
         """Classify page type based on URL and content"""
         url_lower = url.lower()
@@ -259,7 +436,8 @@ class EcommerceScraper:
         import os
         
         try:
-            client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+            from llm_limiter import chat_completion
+            client = openai.AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
             
             urls_text = "\n".join([f"{i+1}. {url}" for i, url in enumerate(urls)])
             
@@ -272,7 +450,9 @@ URLs:
 
 Priority order (numbers only):"""
 
-            response = client.chat.completions.create(
+            response = await chat_completion(
+                client,
+                call_site="url_priority",
                 model="gpt-3.5-turbo",
                 messages=[{"role": "user", "content": prompt}],
                 max_tokens=100,
@@ -315,13 +495,13 @@ Priority order (numbers only):"""
         
         return [f"{base_url}{path}" for path in fallback_paths]
     
-    async def _is_shopify_site(self, domain: str) -> bool:
+    async def _is_shopify_site(self, domain: str, scheme: str = "https") -> bool:
         """Detect if site is Shopify using multiple reliable signals"""
-        base_url = f"https://{domain}"
+        base_url = f"{scheme}://{domain}"
         
         try:
             # 1) Headers check - most reliable
-            response = self.session.head(base_url, timeout=12)
+            response = await self._request("head", base_url, timeout=budget_timeout(12))
             headers = {k.lower(): v for k, v in response.headers.items()}
             
             if any(k.startswith("x-shopify") or k.startswith("x-sorting-hat") for k in headers):
@@ -340,7 +520,8 @@ Priority order (numbers only):"""
         # 3) Shopify endpoints check
         for path in ["/cart.js", "/products.json"]:
             try:
-                response = self.session.get(base_url + path, timeout=12, headers={"Accept": "application/json"})
+                response = await self._request("get", base_url + path, timeout=budget_timeout(12),
+                                               headers={"Accept": "application/json"})
                 if response.status_code == 200 and "application/json" in response.headers.get("content-type", ""):
                     print(f"    🛍️ Shopify detected via endpoint {path}")
                     return True
@@ -350,7 +531,7 @@ Priority order (numbers only):"""
 
         # 4) HTML content check (last resort)
         try:
-            response = self.session.get(base_url, timeout=12)
+            response = await self._request("get", base_url, timeout=budget_timeout(12))
             text = response.text
             if any(signal in text for signal in ["window.Shopify", "ShopifyAnalytics", "cdn.shopify.com", "/s/files/1/"]):
                 print(f"    🛍️ Shopify detected via HTML content")
@@ -360,9 +541,9 @@ Priority order (numbers only):"""
 
         return False
     
-    async def _get_shopify_policy_urls(self, domain: str) -> List[str]:
+    async def _get_shopify_policy_urls(self, domain: str, scheme: str = "https") -> List[str]:
         """Get policy URLs for Shopify sites using known patterns + Playwright for JS content"""
-        base_url = f"https://{domain}"
+        base_url = f"{scheme}://{domain}"
         
         # Shopify canonical URLs (highest priority)
         shopify_paths = [
@@ -377,15 +558,16 @@ Priority order (numbers only):"""
         # Quick test for existing URLs
         valid_urls = []
         for path in shopify_paths[:8]:  # Test top 8 only
+            if budget_exhausted():
+                break
             try:
                 url = f"{base_url}{path}"
-                response = self.session.head(url, timeout=5)
+                response = await self._request("head", url, timeout=budget_timeout(5))
                 if response.status_code == 200:
                     valid_urls.append(url)
                     print(f"    ✅ Found Shopify page: {path}")
                 
-                import time
-                time.sleep(1.5)  # Faster for URL testing
+                await asyncio.sleep(1.5)  # Faster for URL testing
                 
             except Exception:
                 continue
@@ -394,162 +576,93 @@ Priority order (numbers only):"""
     
     async def _get_clean_content_playwright(self, url: str) -> Optional[str]:
         """Extract clean content using Playwright (for ALL sites - no BeautifulSoup corruption)"""
+        await host_turn(host_of(url))  # HostUnavailable: the caller stops scraping this host
+        if SCRAPE_RENDERER == "service":
+            return await self._render_remote(url)
+        with span("browser_wait"):
+            await _browser_slots.acquire()
+        try:
+            started = time.perf_counter()
+            with span("fetch.playwright", url=url) as fetch_span, ACTIVE_BROWSERS.track_inprogress():
+                content = await self._render_playwright(url)
+                fetch_span.set(bytes=len(content.encode()) if content else 0)
+        finally:
+            _browser_slots.release()
+        record_fetch("playwright", time.perf_counter() - started,
+                     len(content.encode()) if content else None, "ok" if content else "empty")
+        return content
+
+    async def _render_remote(self, url: str) -> Optional[str]:
+        """Render through the render service (render_worker.py): no Chromium in this worker"""
+        from render_worker import render_remote
+
+        started = time.perf_counter()
+        with span("fetch.render_service", url=url) as fetch_span:
+            try:
+                rendered = await render_remote(url, budget_timeout(60))
+            except Exception as e:
+                print(f"    ❌ Render service error: {e}")
+                await run_bookkeeping(record_outcome, host_of(url), classify_error(e))
+                content = None
+            else:
+                await run_bookkeeping(record_outcome, host_of(url), classify_content(rendered['content'], rendered['final_url']))
+                content = await self._clean_rendered(url, rendered)
+            fetch_span.set(bytes=len(content.encode()) if content else 0)
+        record_fetch("render_service", time.perf_counter() - started,
+                     len(content.encode()) if content else None, "ok" if content else "empty")
+        return content
+
+    async def _render_playwright(self, url: str) -> Optional[str]:
         try:
             from playwright.async_api import async_playwright
-            
+            from renderer import launch_browser, render_page
+
             async with async_playwright() as p:
-                browser = await p.chromium.launch(
-                    headless=True,
-                    args=[
-                        '--no-sandbox',
-                        '--disable-setuid-sandbox',
-                        '--disable-dev-shm-usage',
-                        '--disable-accelerated-2d-canvas',
-                        '--no-first-run',
-                        '--no-zygote',
-                        '--disable-gpu',
-                        '--disable-blink-features=AutomationControlled'
-                    ]
-                )
-                context = await browser.new_context(
-                    user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                    viewport={'width': 1920, 'height': 1080},
-                    locale='en-US',
-                    timezone_id='America/New_York',
-                    extra_http_headers={
-                        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8',
-                        'Accept-Language': 'en-US,en;q=0.9',
-                        'Accept-Encoding': 'gzip, deflate, br',
-                        'Cache-Control': 'no-cache',
-                        'Pragma': 'no-cache',
-                        'Sec-Fetch-Dest': 'document',
-                        'Sec-Fetch-Mode': 'navigate',
-                        'Sec-Fetch-Site': 'none',
-                        'Sec-Fetch-User': '?1',
-                        'Upgrade-Insecure-Requests': '1',
-                    }
-                )
-                page = await context.new_page()
-                
-                # Stealth: remove webdriver traces
-                await page.add_init_script("""
-                    Object.defineProperty(navigator, 'webdriver', {
-                        get: () => undefined,
-                    });
-                    
-                    // Mock plugins
-                    Object.defineProperty(navigator, 'plugins', {
-                        get: () => [1, 2, 3, 4, 5],
-                    });
-                    
-                    // Mock languages
-                    Object.defineProperty(navigator, 'languages', {
-                        get: () => ['en-US', 'en'],
-                    });
-                """)
-                
-                # For Walmart help pages: preload homepage to get session cookies
-                from urllib.parse import urlparse
-                parsed_url = urlparse(url)
-                if 'walmart.com' in parsed_url.netloc and '/help/' in url:
-                    print(f"    🍪 Preloading Walmart homepage for session cookies...")
-                    try:
-                        await page.goto(f"{parsed_url.scheme}://{parsed_url.netloc}", timeout=15000, wait_until='domcontentloaded')
-                        await page.wait_for_timeout(2000)  # Let cookies set
-                    except:
-                        pass  # Continue even if homepage fails
-                
-                # Navigate to target page
-                await page.goto(url, timeout=30000, wait_until='networkidle')
-                
-                # Wait for dynamic content and potential anti-bot checks
-                await page.wait_for_timeout(3000)
-                
-                # Try to wait for main content to load
+                browser = await launch_browser(p)
                 try:
-                    await page.wait_for_selector('main, [role="main"], .main-content, .content', timeout=5000)
-                except:
-                    pass  # Continue if no main content selector found
-                await page.wait_for_timeout(3000)  # Wait for JS to load content
-                
-                # Extract PERFECT clean text content
-                # Detect WAF blocks via URL
-                final_url = page.url
-                if 'walmart.com/blocked?' in final_url:
-                    print(f"    🚫 WAF block detected at {final_url}")
-                content = await page.evaluate('''() => {
-                    // Remove all problematic elements
-                    const elementsToRemove = document.querySelectorAll('script, style, nav, header, footer, aside, noscript');
-                    elementsToRemove.forEach(el => el.remove());
-                    
-                    // Get main content with priority selectors
-                    const selectors = [
-                        'main', '[role="main"]', '.main-content', '.content',
-                        '.policy-content', '.page-content', '.rte', '.shopify-policy__container',
-                        'article', '.article', '[class*="policy"]', '[class*="shipping"]', '[class*="return"]'
-                    ];
-                    
-                    let mainElement = null;
-                    for (const selector of selectors) {
-                        const element = document.querySelector(selector);
-                        if (element && element.innerText.length > 200) {
-                            mainElement = element;
-                            break;
-                        }
-                    }
-                    
-                    // Fallback to body
-                    const targetElement = mainElement || document.body;
-                    
-                    // Get clean text - no HTML, no corruption
-                    return targetElement.innerText || targetElement.textContent || '';
-                }''')
-                
-                await browser.close()
-                
-                if content and len(content) > 100:
-                    # Check if this is a 404 or not found page
-                    if self._is_404_or_not_found(content):
-                        print(f"    🚫 Playwright detected 404/Not Found page, skipping...")
-                        return None
-                    
-                    # If content looks too short (likely blocked), try multiple fallbacks
-                    if len(content) < 600:
-                        print(f"    ⚠️ Playwright content short ({len(content)} chars), trying fallbacks...")
-                        
-                        # Try requests fallback first
-                        req_text = self._get_page_content_requests(url)
-                        if req_text and len(req_text) > 600:
-                            print(f"    ✅ Requests fallback extracted {len(req_text)} chars")
-                            return req_text[:10000]
-                        
-                        # For Walmart specifically, try different approach
-                        if 'walmart.com' in url:
-                            print(f"    🔄 Walmart detected, trying alternative extraction...")
-                            # Try without waiting for networkidle (faster load)
-                            try:
-                                alt_page = await context.new_page()
-                                await alt_page.goto(url, timeout=20000, wait_until='domcontentloaded')
-                                await alt_page.wait_for_timeout(1000)
-                                alt_content = await alt_page.evaluate('() => document.body.innerText || document.body.textContent || ""')
-                                await alt_page.close()
-                                if alt_content and len(alt_content) > len(content):
-                                    print(f"    ✅ Alternative extraction got {len(alt_content)} chars")
-                                    return alt_content[:10000]
-                            except:
-                                pass
-                        
-                        print(f"    ⚠️ All fallbacks short, using best available ({len(content)} chars)")
-                        return content[:10000]
-
-                    print(f"    ✅ Playwright extracted {len(content)} chars")
-                    return content[:10000]
-                else:
-                    print(f"    ⚠️ Playwright content too short: {len(content) if content else 0} chars")
-                    return None
-                
+                    rendered = await render_page(browser, url, _playwright_timeout)
+                finally:
+                    # Also runs on cancellation / job deadline: closes the context and its pages
+                    await browser.close()
         except Exception as e:
             print(f"    ❌ Playwright error: {e}")
+            await run_bookkeeping(record_outcome, host_of(url), classify_error(e))
+            return None
+        await run_bookkeeping(record_outcome, host_of(url), classify_content(rendered['content'], rendered['final_url']))
+        return await self._clean_rendered(url, rendered)
+
+    async def _clean_rendered(self, url: str, rendered: Dict) -> Optional[str]:
+        """Keep or replace a rendered page's text (renderer.render_page output): 404s, short-content fallbacks"""
+        content = rendered['content']
+        if content and len(content) > 100:
+            # Check if this is a 404 or not found page
+            if self._is_404_or_not_found(content):
+                print(f"    🚫 Playwright detected 404/Not Found page, skipping...")
+                return None
+
+            # If content looks too short (likely blocked), try multiple fallbacks
+            if len(content) < 600:
+                print(f"    ⚠️ Playwright content short ({len(content)} chars), trying fallbacks...")
+
+                # Try requests fallback first
+                req_text = await run_io(self._get_page_content_requests, url)
+                if req_text and len(req_text) > 600:
+                    print(f"    ✅ Requests fallback extracted {len(req_text)} chars")
+                    return req_text[:10000]
+
+                # For Walmart specifically, the renderer also tried a lighter load
+                alt_content = rendered.get('alt_content')
+                if alt_content and len(alt_content) > len(content):
+                    print(f"    ✅ Alternative extraction got {len(alt_content)} chars")
+                    return alt_content[:10000]
+
+                print(f"    ⚠️ All fallbacks short, using best available ({len(content)} chars)")
+                return content[:10000]
+
+            print(f"    ✅ Playwright extracted {len(content)} chars")
+            return content[:10000]
+        else:
+            print(f"    ⚠️ Playwright content too short: {len(content) if content else 0} chars")
             return None
 
     def _is_404_or_not_found(self, text: str, response_code: int = 200) -> bool:
@@ -590,46 +703,25 @@ Priority order (numbers only):"""
         """Get page content using requests + BeautifulSoup"""
         try:
             print(f"  📥 Fetching {url}...")
-            response = self.session.get(url, timeout=10)
+            host = host_of(url)
+            host_turn_sync(host)
+            started = time.perf_counter()
+            try:
+                with span("fetch.requests", url=url) as fetch_span:
+                    response = self.session.get(url, timeout=budget_timeout(10))
+                    fetch_span.set(status=response.status_code, bytes=len(response.content))
+            except Exception as e:
+                record_fetch("requests", time.perf_counter() - started, outcome="error")
+                record_outcome(host, classify_error(e))
+                raise
+            record_fetch("requests", time.perf_counter() - started, len(response.content),
+                         "ok" if response.ok else f"http_{response.status_code // 100}xx")
+            if not response.ok:
+                record_outcome(host, classify_status(response.status_code))
             response.raise_for_status()
             
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            # SIMPLE AND EFFECTIVE cleaning (like the working version)
-            import re
-            
-            # Remove script and style elements
-            for script in soup(["script", "style", "nav", "header", "footer"]):
-                script.decompose()
-            
-            # Try to find main content area
-            main_content = None
-            content_selectors = [
-                'main', '[role="main"]', '.main-content', '.content',
-                '.policy-content', '.page-content', '.rte', '.shopify-policy__container',
-                'article', '.article', '[class*="policy"]', '[class*="shipping"]', '[class*="return"]'
-            ]
-            
-            for selector in content_selectors:
-                elements = soup.select(selector)
-                for element in elements:
-                    text = element.get_text(strip=True)
-                    if len(text) > 200:
-                        main_content = element
-                        break
-                if main_content:
-                    break
-            
-            # If no main content found, use body
-            if not main_content:
-                main_content = soup.body or soup
-            
-            # Extract text (SIMPLE approach like working version)
-            text = main_content.get_text(separator=' ', strip=True)
-            
-            # Clean text (SIMPLE like working version)
-            text = re.sub(r'\s+', ' ', text)
-            text = text.strip()
+            text = extract_page_text(response.text)
+            record_outcome(host, classify_content(text))
             
             # Check if this is a 404 or not found page
             if self._is_404_or_not_found(text, response.status_code):
@@ -757,11 +849,14 @@ Priority order (numbers only):"""
         found_count = 0
         
         for pattern in all_patterns:
+            if budget_exhausted():
+                print(f"  ⏱️ Job deadline reached, stopping URL probing")
+                break
             test_url = f"https://{domain}{pattern}"
             
             # Quick HEAD request to check if URL is active
             try:
-                response = self.session.head(test_url, timeout=3, allow_redirects=True)
+                response = self.session.head(test_url, timeout=budget_timeout(3), allow_redirects=True)
                 if response.status_code < 400:
                     active_urls.append(test_url)
                     found_count += 1
@@ -0,0 +1,106 @@
+"""
+Ranked full-text search over the extracted policy text.
+
+SQLite uses the FTS5 table analysis_results_fts (bm25 ranking, snippet());
+Postgres uses the generated search_vector column (ts_rank, ts_headline). Both
+indexes are created by migration 0004 and kept in sync on every write.
+"""
+
+import re
+from typing import Dict
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+SEARCH_FIELDS = ["shipping_policy", "return_policy", "self_help_returns", "insurance"]
+
+HIGHLIGHT_START = "<mark>"
+HIGHLIGHT_END = "</mark>"
+SNIPPET_TOKENS = 16
+
+_TERM_RE = re.compile(r"\w+\*?", re.UNICODE)
+
+
+def _fts5_query(q: str) -> str:
+    """Turn free text into a safe FTS5 query: every term quoted, all terms required,
+    a trailing '*' keeps prefix matching (e.g. 'protect*')."""
+    terms = []
+    for term in _TERM_RE.findall(q):
+        prefix = term.endswith("*")
+        word = term.rstrip("*")
+        if word:
+            terms.append(f'"{word}"*' if prefix else f'"{word}"')
+    return " ".join(terms)
+
+
+def _row_to_hit(row) -> Dict:
+    snippets = {
+        field: row[f"{field}_snippet"]
+        for field in SEARCH_FIELDS
+        if row[f"{field}_snippet"] and HIGHLIGHT_START in row[f"{field}_snippet"]
+    }
+    return {
+        "id": row["id"],
+        "domain": row["domain"],
+        "analyzed_at": row["analyzed_at"],
+        "rank": float(row["rank"]),
+        "snippets": snippets,
+    }
+
+
+async def _search_sqlite(db: AsyncSession, q: str, limit: int, offset: int) -> Dict:
+    match = _fts5_query(q)
+    if not match:
+        return {"total": 0, "results": []}
+
+    snippet_columns = ", ".join(
+        f"snippet(analysis_results_fts, {index}, '{HIGHLIGHT_START}', '{HIGHLIGHT_END}', '…', {SNIPPET_TOKENS}) "
+        f"AS {field}_snippet"
+        for index, field in enumerate(SEARCH_FIELDS)
+    )
+    # bm25() is lower-is-better; negate it so higher rank means more relevant on both backends
+    rows = await db.execute(
+        text(
+            f"SELECT r.id, r.domain, r.analyzed_at, -bm25(analysis_results_fts) AS rank, {snippet_columns} "
+            "FROM analysis_results_fts JOIN analysis_results r ON r.id = analysis_results_fts.rowid "
+            "WHERE analysis_results_fts MATCH :match "
+            "ORDER BY bm25(analysis_results_fts) LIMIT :limit OFFSET :offset"
+        ),
+        {"match": match, "limit": limit, "offset": offset},
+    )
+    total = await db.scalar(
+        text("SELECT COUNT(*) FROM analysis_results_fts WHERE analysis_results_fts MATCH :match"),
+        {"match": match},
+    )
+    return {"total": total, "results": [_row_to_hit(row) for row in rows.mappings()]}
+
+
+async def _search_postgres(db: AsyncSession, q: str, limit: int, offset: int) -> Dict:
+    options = f"StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_END}, MaxWords={SNIPPET_TOKENS}, MinWords=5"
+    headline_columns = ", ".join(
+        f"ts_headline('english', coalesce(r.{field}, ''), query, '{options}') AS {field}_snippet"
+        for field in SEARCH_FIELDS
+    )
+    rows = await db.execute(
+        text(
+            f"SELECT r.id, r.domain, r.analyzed_at, ts_rank(r.search_vector, query) AS rank, {headline_columns} "
+            "FROM analysis_results r, websearch_to_tsquery('english', :q) query "
+            "WHERE r.search_vector @@ query "
+            "ORDER BY rank DESC LIMIT :limit OFFSET :offset"
+        ),
+        {"q": q, "limit": limit, "offset": offset},
+    )
+    total = await db.scalar(
+        text("SELECT COUNT(*) FROM analysis_results WHERE search_vector @@ websearch_to_tsquery('english', :q)"),
+        {"q": q},
+    )
+    return {"total": total, "results": [_row_to_hit(row) for row in rows.mappings()]}
+
+
+async def search_policies(db: AsyncSession, q: str, limit: int = 20, offset: int = 0) -> Dict:
+    """Ranked search with highlighted snippets per matching policy field"""
+    if db.bind.dialect.name == "postgresql":
+        page = await _search_postgres(db, q, limit, offset)
+    else:
+        page = await _search_sqlite(db, q, limit, offset)
+    return {"query": q, "limit": limit, "offset": offset, **page}
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Columnar snapshots of analysis_results (Parquet / Arrow IPC) for analytics consumers.
+
+Snapshots are written in row-group batches straight from the batched result
+iterator, so the table is never held in memory. Incremental mode only ships rows
+analyzed strictly after a watermark (the max analyzed_at of the previous pull).
+
+CLI:
+    python snapshot.py --out-dir ./snapshots                 # full snapshot
+    python snapshot.py --out-dir ./snapshots --incremental   # rows since last run
+    python snapshot.py --out-dir ./snapshots --since 2024-05-01T00:00:00 --format arrow
+"""
+
+import argparse
+import asyncio
+import os
+from datetime import datetime
+from typing import BinaryIO, Optional
+
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from exporter import EXPORT_COLUMNS, iter_result_rows
+from models import AnalysisResult
+
+SNAPSHOT_COLUMNS = ["id"] + EXPORT_COLUMNS
+SNAPSHOT_FORMATS = {"parquet", "arrow"}
+SNAPSHOT_ROW_GROUP_SIZE = int(os.getenv("SNAPSHOT_ROW_GROUP_SIZE", 10000))
+SNAPSHOT_COMPRESSION = os.getenv("SNAPSHOT_COMPRESSION", "zstd")
+# Codecs each writer supports (Arrow IPC buffers: lz4 frame or zstd only)
+SNAPSHOT_COMPRESSIONS = {
+    "parquet": ["zstd", "snappy", "gzip", "brotli", "lz4", "none"],
+    "arrow": ["zstd", "lz4", "none"],
+}
+
+SNAPSHOT_SCHEMA = pa.schema(
+    [("id", pa.int64())]
+    + [(name, pa.string()) for name in EXPORT_COLUMNS if name != "analyzed_at"]
+    + [("analyzed_at", pa.timestamp("us"))]
+)
+
+WATERMARK_FILE = "_watermark"
+
+
+def _to_batch(rows) -> pa.RecordBatch:
+    columns = list(zip(*rows))
+    by_name = dict(zip(SNAPSHOT_COLUMNS, columns))
+    return pa.RecordBatch.from_arrays(
+        [pa.array(by_name[field.name], type=field.type) for field in SNAPSHOT_SCHEMA],
+        schema=SNAPSHOT_SCHEMA,
+    )
+
+
+async def write_snapshot(db: AsyncSession, sink: BinaryIO, fmt: str = "parquet",
+                         since: Optional[datetime] = None,
+                         compression: str = SNAPSHOT_COMPRESSION) -> dict:
+    """Write a snapshot to `sink`, one row group per SNAPSHOT_ROW_GROUP_SIZE rows.
+
+    Returns {"rows": n, "watermark": max analyzed_at or None}. The watermark is what
+    an incremental consumer should pass as `since` on its next pull. Encoding and
+    compression run in a worker thread so the event loop keeps serving requests.
+    """
+    if fmt not in SNAPSHOT_FORMATS:
+        raise ValueError(f"Unsupported snapshot format: {fmt}")
+    if compression not in SNAPSHOT_COMPRESSIONS[fmt]:
+        raise ValueError(f"Unsupported {fmt} compression: {compression} "
+                         f"(allowed: {', '.join(SNAPSHOT_COMPRESSIONS[fmt])})")
+
+    filters = [AnalysisResult.analyzed_at > since] if since else []
+    if fmt == "parquet":
+        writer = pq.ParquetWriter(sink, SNAPSHOT_SCHEMA, compression=compression)
+        write = lambda batch: writer.write_table(pa.Table.from_batches([batch]))
+    else:
+        options = ipc.IpcWriteOptions(compression=None if compression == "none" else compression)
+        writer = ipc.new_file(sink, SNAPSHOT_SCHEMA, options=options)
+        write = writer.write_batch
+
+    total = 0
+    watermark = None
+    pending = []
+    try:
+        async for row in iter_result_rows(db, filters, columns=SNAPSHOT_COLUMNS):
+            pending.append(tuple(row))
+            analyzed_at = row[-1]
+            if analyzed_at and (watermark is None or analyzed_at > watermark):
+                watermark = analyzed_at
+            if len(pending) >= SNAPSHOT_ROW_GROUP_SIZE:
+                await asyncio.to_thread(write, _to_batch(pending))
+                total += len(pending)
+                pending = []
+        if pending:
+            await asyncio.to_thread(write, _to_batch(pending))
+            total += len(pending)
+    finally:
+        writer.close()
+
+    return {"rows": total, "watermark": watermark}
+
+
+def _read_watermark(out_dir: str) -> Optional[datetime]:
+    path = os.path.join(out_dir, WATERMARK_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        value = f.read().strip()
+    return datetime.fromisoformat(value) if value else None
+
+
+def _write_watermark(out_dir: str, watermark: datetime) -> None:
+    with open(os.path.join(out_dir, WATERMARK_FILE), "w") as f:
+        f.write(watermark.isoformat())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a columnar snapshot of analysis_results")
+    parser.add_argument("--out-dir", default="snapshots", help="Directory receiving snapshot partitions")
+    parser.add_argument("--format", choices=sorted(SNAPSHOT_FORMATS), default="parquet")
+    parser.add_argument("--compression", default=SNAPSHOT_COMPRESSION, help="parquet: zstd, snappy, gzip, brotli, lz4 or none; arrow: zstd, lz4 or none")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--since", type=datetime.fromisoformat, help="Only rows analyzed after this ISO datetime")
+    group.add_argument("--incremental", action="store_true",
+                       help=f"Resume from the watermark stored in <out-dir>/{WATERMARK_FILE}")
+    args = parser.parse_args()
+    if args.compression not in SNAPSHOT_COMPRESSIONS[args.format]:
+        parser.error(f"--compression for {args.format}: one of {', '.join(SNAPSHOT_COMPRESSIONS[args.format])}")
+    asyncio.run(_run(args))
+
+
+async def _run(args) -> None:
+    from database import SessionLocal, close_db
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    since = _read_watermark(args.out_dir) if args.incremental else args.since
+    extension = "parquet" if args.format == "parquet" else "arrow"
+    path = os.path.join(args.out_dir, f"analysis_results-{datetime.utcnow():%Y%m%dT%H%M%S}.{extension}")
+
+    try:
+        async with SessionLocal() as db:
+            with open(path, "wb") as sink:
+                stats = await write_snapshot(db, sink, fmt=args.format, since=since, compression=args.compression)
+    finally:
+        await close_db()
+
+    if stats["rows"] == 0:
+        os.remove(path)
+        print(f"📭 No new rows since {since.isoformat() if since else 'the beginning'}")
+        return
+
+    if stats["watermark"]:
+        _write_watermark(args.out_dir, stats["watermark"])
+    print(f"✅ Wrote {stats['rows']} rows to {path} (watermark: {stats['watermark']})")
+
+
+if __name__ == "__main__":
+    main()
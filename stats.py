@@ -0,0 +1,253 @@
+"""
+Incrementally maintained platform statistics.
+
+Every write path (result saved/deleted, job finished) calls one of the record_*
+helpers inside its own transaction, so GET /stats is a single primary-key read
+instead of COUNT/LIKE scans over analysis_results.
+"""
+
+import os
+from datetime import date, datetime, timedelta
+from typing import Dict, List
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import dialect_insert
+from models import AnalysisJob, AnalysisResult, DailyStats, FirecrawlFieldStats, PlatformStats
+
+STATS_ROW_ID = 1
+
+# A field is "historically weak" (speculative Firecrawl) once the main analysis misses it this often
+SPECULATIVE_MIN_MISS_RATE = float(os.getenv("FIRECRAWL_SPECULATIVE_MIN_MISS_RATE", 0.5))
+SPECULATIVE_MIN_SAMPLES = int(os.getenv("FIRECRAWL_SPECULATIVE_MIN_SAMPLES", 10))
+SPECULATIVE_MAX_FIELDS = int(os.getenv("FIRECRAWL_SPECULATIVE_MAX_FIELDS", 2))
+
+
+def _is_yes(value) -> bool:
+    # Same semantics as the former LIKE 'Yes%' (case-insensitive in SQLite)
+    return str(value or "").strip().lower().startswith("yes")
+
+
+async def _bump_platform(db: AsyncSession, **deltas) -> None:
+    values = {name: getattr(PlatformStats, name) + delta for name, delta in deltas.items() if delta}
+    if values:
+        values["updated_at"] = datetime.utcnow()
+        await db.execute(update(PlatformStats).where(PlatformStats.id == STATS_ROW_ID).values(**values))
+
+
+async def _bump_daily(db: AsyncSession, day: date, **deltas) -> None:
+    """Atomically add `deltas` to the bucket for `day`, creating it if needed"""
+    stmt = dialect_insert(db)(DailyStats).values(day=day, **deltas)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[DailyStats.day],
+        set_={name: getattr(DailyStats, name) + stmt.excluded[name] for name in deltas},
+    )
+    await db.execute(stmt)
+
+
+async def record_result_added(db: AsyncSession, result: AnalysisResult) -> None:
+    await _bump_platform(
+        db,
+        total_sites=1,
+        sites_with_self_service=int(_is_yes(result.self_help_returns)),
+        sites_with_insurance=int(_is_yes(result.insurance)),
+    )
+    await _bump_daily(db, (result.analyzed_at or datetime.utcnow()).date(), analyses=1)
+
+
+async def record_result_removed(db: AsyncSession, result: AnalysisResult) -> None:
+    # Daily buckets count analyses performed, so they are left untouched
+    await _bump_platform(
+        db,
+        total_sites=-1,
+        sites_with_self_service=-int(_is_yes(result.self_help_returns)),
+        sites_with_insurance=-int(_is_yes(result.insurance)),
+    )
+
+
+async def record_results_cleared(db: AsyncSession) -> None:
+    await db.execute(
+        update(PlatformStats)
+        .where(PlatformStats.id == STATS_ROW_ID)
+        .values(total_sites=0, sites_with_self_service=0, sites_with_insurance=0,
+                updated_at=datetime.utcnow())
+    )
+
+
+async def record_job_finished(db: AsyncSession, job: AnalysisJob) -> None:
+    """Count a job that just reached 'completed' or 'failed' (cancelled jobs are not counted)"""
+    if job.status == "cancelled":
+        return
+    failed = job.status == "failed"
+    finished_at = job.completed_at or datetime.utcnow()
+    duration = (finished_at - job.created_at).total_seconds() if job.created_at else 0.0
+    await _bump_platform(db, jobs_completed=int(not failed), jobs_failed=int(failed))
+    await _bump_daily(
+        db,
+        finished_at.date(),
+        jobs_completed=int(not failed),
+        jobs_failed=int(failed),
+        job_duration_seconds=max(duration, 0.0),
+    )
+
+
+async def record_field_outcomes(db: AsyncSession, analysis: Dict) -> None:
+    """Count per-field misses of the main analysis and speculative Firecrawl outcomes.
+
+    Reads analysis['field_missing'] ({field: bool}) and analysis['speculation']
+    ({field: {outcome, seconds_saved, seconds_wasted}}) as set by PolicyAnalyzer.
+    """
+    missing = analysis.get("field_missing") or {}
+    speculation = analysis.get("speculation") or {}
+    for field in set(missing) | set(speculation):
+        report = speculation.get(field) or {}
+        deltas = {
+            "analyses": int(field in missing),
+            "missing": int(bool(missing.get(field))),
+            "speculated": int(bool(report)),
+            "speculation_used": int(report.get("outcome") == "used"),
+            "speculation_cancelled": int(report.get("outcome") == "cancelled"),
+            "seconds_saved": float(report.get("seconds_saved") or 0.0),
+            "seconds_wasted": float(report.get("seconds_wasted") or 0.0),
+        }
+        stmt = dialect_insert(db)(FirecrawlFieldStats).values(field=field, updated_at=datetime.utcnow(), **deltas)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[FirecrawlFieldStats.field],
+            set_={
+                **{name: getattr(FirecrawlFieldStats, name) + stmt.excluded[name] for name in deltas},
+                "updated_at": stmt.excluded.updated_at,
+            },
+        )
+        await db.execute(stmt)
+
+
+async def read_weak_fields(db: AsyncSession) -> List[str]:
+    """Fields the main analysis misses most often (worst first), candidates for speculation"""
+    rows = (await db.scalars(
+        select(FirecrawlFieldStats).where(FirecrawlFieldStats.analyses >= SPECULATIVE_MIN_SAMPLES)
+    )).all()
+    weak = [row for row in rows if row.missing / row.analyses >= SPECULATIVE_MIN_MISS_RATE]
+    weak.sort(key=lambda row: row.missing / row.analyses, reverse=True)
+    return [row.field for row in weak[:SPECULATIVE_MAX_FIELDS]]
+
+
+async def ensure_stats(db: AsyncSession) -> None:
+    """Create and backfill the counters from existing rows (one-time scan)"""
+    if await db.get(PlatformStats, STATS_ROW_ID) is not None:
+        return
+    # Workers starting together all get here: only the one whose insert lands backfills. The
+    # others wait on its uncommitted row (write lock on SQLite) and then find it taken.
+    claimed = await db.execute(
+        dialect_insert(db)(PlatformStats)
+        .values(id=STATS_ROW_ID, total_sites=0, sites_with_self_service=0, sites_with_insurance=0,
+                jobs_completed=0, jobs_failed=0, updated_at=datetime.utcnow())
+        .on_conflict_do_nothing(index_elements=[PlatformStats.id])
+    )
+    if claimed.rowcount != 1:
+        await db.rollback()
+        return
+
+    results = await db.stream(
+        select(AnalysisResult.self_help_returns, AnalysisResult.insurance, AnalysisResult.analyzed_at)
+        .execution_options(yield_per=1000)
+    )
+    total = self_service = insurance = 0
+    daily: Dict[date, dict] = {}
+    async for self_help_returns, insurance_value, analyzed_at in results:
+        total += 1
+        self_service += _is_yes(self_help_returns)
+        insurance += _is_yes(insurance_value)
+        if analyzed_at:
+            bucket = daily.setdefault(analyzed_at.date(), {"analyses": 0, "jobs_completed": 0, "jobs_failed": 0, "job_duration_seconds": 0.0})
+            bucket["analyses"] += 1
+
+    jobs = await db.stream(
+        select(AnalysisJob.status, AnalysisJob.created_at, AnalysisJob.completed_at)
+        .where(AnalysisJob.status.in_(["completed", "failed"]))
+        .execution_options(yield_per=1000)
+    )
+    completed = failed = 0
+    async for status, created_at, completed_at in jobs:
+        is_failed = status == "failed"
+        completed += not is_failed
+        failed += is_failed
+        if completed_at:
+            bucket = daily.setdefault(completed_at.date(), {"analyses": 0, "jobs_completed": 0, "jobs_failed": 0, "job_duration_seconds": 0.0})
+            bucket["jobs_failed" if is_failed else "jobs_completed"] += 1
+            if created_at:
+                bucket["job_duration_seconds"] += max((completed_at - created_at).total_seconds(), 0.0)
+
+    await db.execute(update(PlatformStats).where(PlatformStats.id == STATS_ROW_ID).values(
+        total_sites=total,
+        sites_with_self_service=self_service,
+        sites_with_insurance=insurance,
+        jobs_completed=completed,
+        jobs_failed=failed,
+        updated_at=datetime.utcnow(),
+    ))
+    for day, values in daily.items():
+        await db.merge(DailyStats(day=day, **values))
+    await db.commit()
+
+
+def _rate(part: int, whole: int, empty: float = 0.0) -> float:
+    return empty if whole <= 0 else round(part / whole * 100, 1)
+
+
+async def read_stats(db: AsyncSession) -> Dict:
+    """Platform stats from the counters row (single primary-key read)"""
+    row = await db.get(PlatformStats, STATS_ROW_ID)
+    total_sites = row.total_sites if row else 0
+    self_service = row.sites_with_self_service if row else 0
+    insurance = row.sites_with_insurance if row else 0
+    completed = row.jobs_completed if row else 0
+    failed = row.jobs_failed if row else 0
+
+    return {
+        "total_sites": total_sites,
+        "success_rate": _rate(completed, completed + failed, empty=100.0),
+        "self_service_rate": _rate(self_service, total_sites),
+        "insurance_rate": _rate(insurance, total_sites),
+        "sites_with_self_service": self_service,
+        "sites_with_insurance": insurance,
+        "jobs_completed": completed,
+        "jobs_failed": failed,
+    }
+
+
+async def read_daily_series(db: AsyncSession, days: int = 30) -> List[Dict]:
+    """Per-day analyses, failure rate and average job duration for the last `days` days"""
+    start = datetime.utcnow().date() - timedelta(days=max(days, 1) - 1)
+    rows = (await db.scalars(select(DailyStats).where(DailyStats.day >= start).order_by(DailyStats.day))).all()
+    series = []
+    for row in rows:
+        finished = row.jobs_completed + row.jobs_failed
+        series.append({
+            "day": row.day.isoformat(),
+            "analyses": row.analyses,
+            "jobs_completed": row.jobs_completed,
+            "jobs_failed": row.jobs_failed,
+            "failure_rate": _rate(row.jobs_failed, finished),
+            "avg_job_duration_seconds": round(row.job_duration_seconds / finished, 1) if finished else None,
+        })
+    return series
+
+
+async def read_firecrawl_stats(db: AsyncSession) -> List[Dict]:
+    """Per-field miss rate and speculative Firecrawl time saved vs wasted"""
+    rows = (await db.scalars(select(FirecrawlFieldStats).order_by(FirecrawlFieldStats.field))).all()
+    return [
+        {
+            "field": row.field,
+            "analyses": row.analyses,
+            "miss_rate": _rate(row.missing, row.analyses),
+            "speculated": row.speculated,
+            "speculation_used": row.speculation_used,
+            "speculation_cancelled": row.speculation_cancelled,
+            "seconds_saved": round(row.seconds_saved, 1),
+            "seconds_wasted": round(row.seconds_wasted, 1),
+            "net_seconds_saved": round(row.seconds_saved - row.seconds_wasted, 1),
+        }
+        for row in rows
+    ]
@@ -0,0 +1,187 @@
+"""
+Per-job trace timeline: nested spans with timing, bytes and tokens.
+
+process_website opens a trace; code along the pipeline opens spans with
+`with span("fetch.playwright", url=url) as s: ... s.set(bytes=n)`. The active
+trace and parent span travel in contextvars, so spans opened in worker threads
+(asyncio.to_thread and executors.py copy the context) land in the right job and
+parent. Outside a trace, span() is a no-op.
+
+Stored on the job as zlib-compressed JSON rows [name, start_ms, duration_ms,
+parent, thread, attrs] and served by GET /job/{id}/trace, either as a flat
+timeline or as Chrome trace events (chrome://tracing, Perfetto, speedscope).
+"""
+
+import json
+import os
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, List, Optional
+
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", 2000))
+TRACE_FORMAT_VERSION = 1
+
+_trace: ContextVar[Optional["Trace"]] = ContextVar("trace", default=None)
+_parent: ContextVar[int] = ContextVar("trace_parent", default=-1)
+_running: Dict[str, "Trace"] = {}  # job_id -> trace of jobs running in this process
+
+
+class Span:
+    __slots__ = ("index", "attrs")
+
+    def __init__(self, index: int, attrs: Dict):
+        self.index = index
+        self.attrs = attrs
+
+    def set(self, **attrs) -> None:
+        """Attach attributes known once the work is done (bytes, tokens, status, ...)"""
+        self.attrs.update(attrs)
+
+
+_NOOP_SPAN = Span(-1, {})
+
+
+class Trace:
+    def __init__(self, job_id: Optional[str] = None):
+        self.job_id = job_id
+        self.started_at = datetime.utcnow()
+        self._t0 = time.perf_counter()
+        self._rows: List[list] = []  # [name, start_ms, duration_ms or None, parent, thread, attrs]
+        self._threads: Dict[int, int] = {}
+        self._open: Dict[int, int] = {}  # thread ident -> spans currently open in it
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def _now_ms(self) -> float:
+        return (time.perf_counter() - self._t0) * 1000
+
+    def open(self, name: str, parent: int, attrs: Dict) -> int:
+        with self._lock:
+            if len(self._rows) >= TRACE_MAX_SPANS:
+                self.dropped += 1
+                return -1
+            ident = threading.get_ident()
+            thread = self._threads.setdefault(ident, len(self._threads))
+            self._open[ident] = self._open.get(ident, 0) + 1
+            self._rows.append([name, round(self._now_ms(), 1), None, parent, thread, attrs])
+            return len(self._rows) - 1
+
+    def close(self, index: int) -> None:
+        row = self._rows[index]
+        row[2] = round(self._now_ms() - row[1], 1)
+        with self._lock:
+            ident = threading.get_ident()
+            self._open[ident] -= 1
+            if not self._open[ident]:
+                del self._open[ident]
+
+    def worker_threads(self) -> set:
+        """Threads other than the job's own (event loop) thread currently inside one of its spans"""
+        with self._lock:
+            root = next(iter(self._threads), None)
+            return {ident for ident in self._open if ident != root}
+
+    def dump(self) -> bytes:
+        """Compressed snapshot; spans still open (e.g. the job's root span) end now"""
+        now = round(self._now_ms(), 1)
+        with self._lock:
+            spans = [
+                [name, start, duration if duration is not None else round(now - start, 1), parent, thread,
+                 {key: value for key, value in attrs.items() if value is not None} or None]
+                for name, start, duration, parent, thread, attrs in self._rows
+            ]
+        payload = {
+            "v": TRACE_FORMAT_VERSION,
+            "started_at": self.started_at.isoformat() + "Z",
+            "dropped": self.dropped,
+            "spans": spans,
+        }
+        return zlib.compress(json.dumps(payload, separators=(",", ":"), default=str).encode())
+
+
+@contextmanager
+def start_trace(job_id: Optional[str] = None):
+    """Collect every span opened in this context (one per job)"""
+    trace = Trace(job_id)
+    token = _trace.set(trace)
+    parent_token = _parent.set(-1)
+    if job_id:
+        _running[job_id] = trace
+    try:
+        yield trace
+    finally:
+        if job_id:
+            _running.pop(job_id, None)
+        _parent.reset(parent_token)
+        _trace.reset(token)
+
+
+def running_trace(job_id: str) -> Optional[Trace]:
+    """Trace of a job currently running in this process (None if finished or in another worker)"""
+    return _running.get(job_id)
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Time a unit of work as a child of the current span; yields the Span for late attributes"""
+    trace = _trace.get()
+    if trace is None:
+        yield _NOOP_SPAN
+        return
+    index = trace.open(name, _parent.get(), attrs)
+    if index < 0:
+        yield _NOOP_SPAN
+        return
+    token = _parent.set(index)
+    try:
+        yield Span(index, attrs)
+    except BaseException as e:
+        attrs["error"] = type(e).__name__
+        raise
+    finally:
+        _parent.reset(token)
+        trace.close(index)
+
+
+def load_trace(blob: Optional[bytes]) -> Optional[Dict]:
+    if not blob:
+        return None
+    return json.loads(zlib.decompress(blob))
+
+
+def trace_timeline(trace: Dict) -> Dict:
+    """Flat, start-ordered span list with depth, plus the slowest direct child of the root (the long pole)"""
+    rows = trace["spans"]
+    depth: List[int] = []
+    spans = []
+    for index, (name, start, duration, parent, thread, attrs) in enumerate(rows):
+        depth.append(depth[parent] + 1 if parent >= 0 else 0)
+        spans.append({
+            "id": index, "parent": parent if parent >= 0 else None, "depth": depth[index],
+            "name": name, "start_ms": start, "duration_ms": duration, "thread": thread, **(attrs or {}),
+        })
+    children = [s for s in spans if s["depth"] == 1]
+    long_pole = max(children, key=lambda s: s["duration_ms"], default=None)
+    return {
+        "started_at": trace["started_at"],
+        "total_ms": max((s["start_ms"] + s["duration_ms"] for s in spans), default=0),
+        "dropped_spans": trace.get("dropped", 0),
+        "long_pole": {"name": long_pole["name"], "duration_ms": long_pole["duration_ms"]} if long_pole else None,
+        "spans": spans,
+    }
+
+
+def chrome_trace(trace: Dict, job_id: str) -> Dict:
+    """Chrome trace event format (complete 'X' events, microseconds)"""
+    events = [{"name": "process_name", "ph": "M", "pid": 1, "tid": 0, "args": {"name": f"job {job_id}"}}]
+    for name, start, duration, parent, thread, attrs in trace["spans"]:
+        events.append({
+            "name": name, "cat": name.split(".")[0], "ph": "X", "pid": 1, "tid": thread,
+            "ts": round(start * 1000), "dur": round(duration * 1000), "args": attrs or {},
+        })
+    return {"traceEvents": events, "displayTimeUnit": "ms",
+            "otherData": {"job_id": job_id, "started_at": trace["started_at"]}}